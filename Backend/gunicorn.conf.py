@@ -0,0 +1,27 @@
+"""
+Gunicorn settings; run `gunicorn -c gunicorn.conf.py` from this directory.
+
+The ASGI application is served by uvicorn workers. With `preload_app` the master runs
+`django.setup()`, imports the URLconf and the client libraries (location.startup.preload)
+once, and the forked workers share those modules copy-on-write instead of each
+importing them on its first request. Database
+connections and Vision/HTTP clients are still created per worker, after the fork.
+"""
+import multiprocessing
+import os
+
+# ASGI under uvicorn workers: the async upload/update views and their pooled httpx/gRPC clients
+# share one long-lived event loop per worker instead of a throwaway loop per request
+wsgi_app = "server_location_map.asgi:application"
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "uvicorn_worker.UvicornWorker")
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+preload_app = os.getenv("GUNICORN_PRELOAD", "True") == "True"
+
+
+def when_ready(server):
+    # Runs in the master after the app is loaded and before the workers are forked
+    if preload_app:
+        from location.startup import preload
+        preload()
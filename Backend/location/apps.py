@@ -3,4 +3,7 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'location'
\ No newline at end of file
+    name = 'location'
+
+    def ready(self):
+        from . import signals  # noqa: F401
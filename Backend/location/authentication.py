@@ -0,0 +1,130 @@
+"""
+Token authentication without a database query per request.
+
+`CachedTokenAuthentication` resolves a token key to (user id, is_staff, is_superuser)
+through a per-process LRU with a short TTL, backed by a Django cache shared between
+workers; only a miss in both runs DRF's token + user query. The request user is a
+`User` built from those columns, with every other field deferred, so permission
+checks cost nothing and anything else is loaded on first access. The shared tier is
+skipped when CACHE_ALIAS is process-local (LocMem), where other workers could not see
+its invalidations.
+
+Entries are invalidated by signals (`location/signals.py`) when a token is saved or
+deleted and when a user is saved or deleted, in this process's LRU and in the shared
+cache. Other workers' LRU entries are not reached, so a deleted token, a deactivated
+user or a revoked staff flag can still be accepted by them for up to TTL seconds.
+Changes that bypass signals, such as `QuerySet.update()`, last up to SHARED_TTL
+(TTL without a shared cache).
+"""
+import hashlib
+import threading
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from .lru import LRUCache, MISSING, is_process_local
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "ENABLED": True,
+    "TTL": 30,                  # Seconds an entry lives in the per-process LRU: the revocation window in other workers
+    "SHARED_TTL": 300,          # Seconds an entry lives in the Django cache (shared backends only)
+    "MAX_ENTRIES": 10000,
+    "CACHE_ALIAS": "default",
+    "KEY_PREFIX": "auth-token",
+}
+
+
+def get_token_cache_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "TOKEN_AUTH_CACHE", {})}
+
+
+class TokenCache:
+    """token key → (user id, is_staff, is_superuser); shared-cache keys are hashed so token keys are never stored."""
+
+    def __init__(self, options):
+        self.shared_ttl = options["SHARED_TTL"]
+        self.key_prefix = options["KEY_PREFIX"]
+        self._cache = None if is_process_local(options["CACHE_ALIAS"]) else caches[options["CACHE_ALIAS"]]
+        self._lru = LRUCache(max_entries=options["MAX_ENTRIES"], ttl=options["TTL"])
+
+    def _shared_key(self, key):
+        return f"{self.key_prefix}:{hashlib.sha256(key.encode()).hexdigest()}"
+
+    def get(self, key):
+        entry = self._lru.get(key)
+        if entry is MISSING and self._cache is not None:
+            entry = self._cache.get(self._shared_key(key), MISSING)
+            if entry is not MISSING:
+                entry = tuple(entry)
+                self._lru.set(key, entry)
+        return entry
+
+    def set(self, key, entry):
+        self._lru.set(key, entry)
+        if self._cache is not None:
+            self._cache.set(self._shared_key(key), entry, timeout=self.shared_ttl)
+
+    def invalidate(self, *keys):
+        for key in keys:
+            self._lru.delete(key)
+        if keys and self._cache is not None:
+            self._cache.delete_many([self._shared_key(key) for key in keys])
+
+    def stats(self):
+        return self._lru.stats()
+
+
+_token_cache = None
+_token_cache_lock = threading.Lock()
+
+
+def get_token_cache():
+    """Return the process-wide token cache configured by `settings.TOKEN_AUTH_CACHE`."""
+    global _token_cache
+    if _token_cache is None:
+        with _token_cache_lock:
+            if _token_cache is None:
+                _token_cache = TokenCache(get_token_cache_settings())
+    return _token_cache
+
+
+def _partial_instance(model, values):
+    """A model instance "loaded" with `values` only; its other fields are deferred and fetched on access."""
+    names = [field.attname for field in model._meta.concrete_fields if field.attname in values]
+    return model.from_db(DEFAULT_DB_ALIAS, names, [values[name] for name in names])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        if not get_token_cache_settings()["ENABLED"]:
+            return super().authenticate_credentials(key)
+
+        cache = get_token_cache()
+        entry = cache.get(key)
+        if entry is MISSING:
+            user, token = super().authenticate_credentials(key)  # Raises for unknown keys and inactive users
+            cache.set(key, (user.pk, user.is_staff, user.is_superuser))
+            return user, token
+
+        user_id, is_staff, is_superuser = entry
+        user_model = get_user_model()
+        user = _partial_instance(user_model, {
+            user_model._meta.pk.attname: user_id,
+            "is_active": True,
+            "is_staff": is_staff,
+            "is_superuser": is_superuser,
+        })
+        token = _partial_instance(self.get_model(), {"key": key, "user_id": user_id})
+        token.user = user
+        return user, token
+
+
+def invalidate_user_tokens(user_id):
+    """Drop cached entries for every token of `user_id`."""
+    keys = list(Token.objects.filter(user_id=user_id).values_list('key', flat=True))
+    get_token_cache().invalidate(*keys)
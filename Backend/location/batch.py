@@ -0,0 +1,372 @@
+"""
+Bulk ingestion for `/api/location/upload/batch/`.
+
+A batch is processed in passes instead of image by image: one hashing pass,
+one `image_hash__in` duplicate query, one geocode per distinct address,
+Vision `batch_annotate_images` calls in chunks (run concurrently), one
+one-to-many route search per distinct address, and one `bulk_create`.
+
+Uploads are read lazily and the passes run per CHUNK_SIZE images, so only one
+chunk of image bytes is held in memory at a time; addresses geocoded for an
+earlier chunk are reused.
+"""
+import hashlib
+import os
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, connections, transaction
+from PIL import Image, UnidentifiedImageError
+from .geocoding import get_coordinates
+from .landmark_cache import get_landmark_cache
+from .lru import MISSING
+from .models import LocationImage
+from .serializers import DEFAULT_HOME_ADDRESS, haversine, landmark_fields
+from .providers import get_provider
+from .instrumentation import span
+from .uploads import content_hash
+from .phash import dhash, find_near_duplicate, get_phash_settings, stamp_hash, stored_landmark
+from .preprocess import schedule_derivatives, vision_content
+from .routing import ROUTE_FIELDS, travel_fields_many
+from .response_cache import invalidate_images
+import io
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "MAX_FILES": 1000,          # Keep DATA_UPLOAD_MAX_NUMBER_FILES above it (settings derives it)
+    "CHUNK_SIZE": 100,          # Images read and processed (held in memory) at a time
+    "MAX_ITEM_BYTES": 20 * 1024 * 1024,  # Largest image accepted, uploaded or unpacked from the archive
+    "VISION_BATCH_SIZE": 16,    # Vision accepts at most 16 images per batch_annotate_images request
+    "CONCURRENCY": 4,           # Concurrent geocoding / Vision batch calls per request
+    "INSERT_BATCH_SIZE": 500,
+}
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tif', '.tiff'}
+
+STATUS_CREATED = 'created'
+STATUS_DUPLICATE = 'duplicate'
+STATUS_ERROR = 'error'
+
+INVALID_IMAGE = "Upload a valid image. The file you uploaded was either not an image or a corrupted image."
+DUPLICATE_IMAGE = "This image already exists in the database and cannot be uploaded again."
+
+
+def get_batch_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "LOCATION_BATCH_UPLOAD", {})}
+
+
+class BatchItem:
+    def __init__(self, index, filename, content, home_address, image_hash=None):
+        self.index = index
+        self.filename = filename
+        self.content = content
+        self.home_address = home_address
+        self.image_hash = image_hash or (hashlib.md5(content).hexdigest() if content is not None else None)
+        self.perceptual_hash = None
+        self.status = None
+        self.error = None
+        self.landmark = MISSING
+        self.instance = None
+
+    def result(self):
+        data = {"index": self.index, "filename": self.filename, "status": self.status}
+        if self.instance is not None:
+            data["id"] = self.instance.id
+        if self.error:
+            data["error"] = self.error
+        return data
+
+
+class Uploads:
+    """
+    Uploaded files plus the image entries of an optional zip archive: counted up front,
+    iterated as (filename, bytes, image_hash) with each file read only when it is reached.
+    `image_hash` is the hash computed while receiving the upload, or None. Files larger
+    than `max_bytes` are not read and come with None for their bytes. Archive entries are
+    read through a bounded stream; one whose data does not match its declared size or CRC
+    comes with empty bytes, reported like any other corrupt image.
+    """
+
+    def __init__(self, files, archive=None, max_bytes=None):
+        self.files = files
+        self.max_bytes = max_bytes
+        self.bundle = zipfile.ZipFile(archive) if archive is not None else None
+        self.entries = [] if self.bundle is None else [
+            entry for entry in self.bundle.infolist()
+            if not entry.is_dir() and not os.path.basename(entry.filename).startswith('.')
+            and os.path.splitext(entry.filename)[1].lower() in IMAGE_EXTENSIONS
+        ]
+
+    def __len__(self):
+        return len(self.files) + len(self.entries)
+
+    def _too_large(self, size):
+        return self.max_bytes is not None and size > self.max_bytes
+
+    def __iter__(self):
+        for upload in self.files:
+            if self._too_large(upload.size):
+                yield upload.name, None, None
+                continue
+            upload.seek(0)
+            yield upload.name, upload.read(), content_hash(upload)
+        if self.bundle is not None:
+            with self.bundle:
+                for entry in self.entries:
+                    yield os.path.basename(entry.filename), self._read_entry(entry), None
+
+    def _read_entry(self, entry):
+        if self._too_large(entry.file_size):
+            return None
+        try:
+            with self.bundle.open(entry) as member:
+                content = member.read(self.max_bytes + 1 if self.max_bytes is not None else -1)
+        except (zipfile.BadZipFile, zlib.error, EOFError):
+            return b""
+        return None if self._too_large(len(content)) else content
+
+
+def read_uploads(files, archive=None):
+    """`Uploads` of the request's files and archive; raises `zipfile.BadZipFile` for a broken archive."""
+    return Uploads(files, archive, get_batch_settings()["MAX_ITEM_BYTES"])
+
+
+def _is_image(content):
+    try:
+        with Image.open(io.BytesIO(content)) as img:
+            img.verify()
+        return True
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        return False
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def ingest_batch(uploads, home_addresses):
+    """
+    Ingest `uploads` ((filename, bytes, image_hash or None) triples; bytes are None for an
+    oversized file). `home_addresses` holds one address for the whole batch or one per
+    upload. Returns per-item results in upload order.
+    """
+    options = get_batch_settings()
+    if hasattr(uploads, '__len__') and len(uploads) > options["MAX_FILES"]:
+        raise ValueError(f"A batch may contain at most {options['MAX_FILES']} images.")
+
+    items = []
+    seen = set()        # Hashes created by earlier chunks, for repeats inside the batch itself
+    coordinates = {}    # Geocoded addresses, shared by all chunks
+    with ThreadPoolExecutor(max_workers=options["CONCURRENCY"], thread_name_prefix="batch-upload") as executor:
+        for chunk in _read_chunks(uploads, home_addresses, options):
+            _ingest_chunk(chunk, seen, coordinates, executor, options)
+            for item in chunk:
+                item.content = None  # Only the result outlives the chunk
+            items.extend(chunk)
+
+    created = [item.instance.pk for item in items if item.instance is not None]
+    invalidate_images([])  # `bulk_create()` sends no signals; new rows only change list pages
+    schedule_derivatives(created)
+
+    counts = {status: sum(i.status == status for i in items) for status in (STATUS_CREATED, STATUS_DUPLICATE, STATUS_ERROR)}
+    logger.info(
+        "✅ Batch upload: %s created, %s duplicates, %s errors",
+        counts[STATUS_CREATED], counts[STATUS_DUPLICATE], counts[STATUS_ERROR],
+        extra={"event": "batch_ingested", "counts": counts},
+    )
+    return [item.result() for item in items]
+
+
+def _read_chunks(uploads, home_addresses, options):
+    """Yield lists of up to CHUNK_SIZE `BatchItem`s, reading each upload only when its chunk is due."""
+    chunk = []
+    for index, (filename, content, image_hash) in enumerate(uploads):
+        if index >= options["MAX_FILES"]:
+            raise ValueError(f"A batch may contain at most {options['MAX_FILES']} images.")
+        if len(home_addresses) > 1:
+            address = home_addresses[index] if index < len(home_addresses) else None
+        else:
+            address = home_addresses[0] if home_addresses else DEFAULT_HOME_ADDRESS
+        chunk.append(BatchItem(index, filename, content, address or DEFAULT_HOME_ADDRESS, image_hash))
+        if len(chunk) >= options["CHUNK_SIZE"]:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _ingest_chunk(items, seen, coordinates, executor, options):
+    """Run every pass over one chunk of items and insert its new rows."""
+    # Duplicates: one indexed query for the whole chunk, plus repeats inside the batch itself
+    existing = set(
+        LocationImage.objects.filter(image_hash__in={item.image_hash for item in items if item.image_hash})
+        .values_list('image_hash', flat=True)
+    )
+    accepted = set()  # Hashes of valid items in this chunk: a later copy is a duplicate, an invalid one is not
+    for item in items:
+        if item.content is None:
+            item.status = STATUS_ERROR
+            item.error = f"The file is larger than {options['MAX_ITEM_BYTES']} bytes."
+        elif item.image_hash in existing or item.image_hash in seen or item.image_hash in accepted:
+            item.status = STATUS_DUPLICATE
+            item.error = DUPLICATE_IMAGE
+        elif not _is_image(item.content):
+            item.status = STATUS_ERROR
+            item.error = INVALID_IMAGE
+        else:
+            accepted.add(item.image_hash)
+    pending = [item for item in items if item.status is None]
+
+    if get_phash_settings()["ENABLED"]:
+        for item in pending:
+            try:
+                item.perceptual_hash = dhash(io.BytesIO(item.content))
+            except Exception as e:
+                # `verify()` passes some truncated files that only fail when decoded
+                logger.warning("❗ Batch item %s could not be decoded: %s", item.index, e, extra={"event": "batch_item_invalid"})
+                item.status = STATUS_ERROR
+                item.error = INVALID_IMAGE
+        pending = [item for item in pending if item.status is None]
+
+    # Geocode each distinct address once per batch
+    addresses = sorted({item.home_address for item in pending} - coordinates.keys())
+    coordinates.update(zip(addresses, executor.map(_geocode, addresses)))
+    for item in pending:
+        lat, lng = coordinates[item.home_address]
+        if not lat or not lng:
+            item.status = STATUS_ERROR
+            item.error = "Invalid home address. Could not fetch coordinates."
+    pending = [item for item in pending if item.status is None]
+
+    _detect_landmarks(pending, executor, options)
+
+    pending = [item for item in pending if item.status is None]
+    routes = _routes(pending, coordinates)
+
+    for item in pending:
+        lat, lng = coordinates[item.home_address]
+        landmark = item.landmark
+        fields = {
+            'latitude': lat,
+            'longitude': lng,
+            'home_address': item.home_address,
+            'distance_km': haversine(lat, lng, landmark['landmark_lat'], landmark['landmark_lng']) if landmark else 0.0,
+            **landmark_fields(landmark),
+            **routes.get(item.index, dict.fromkeys(ROUTE_FIELDS)),
+        }
+        item.instance = LocationImage(
+            image=ContentFile(item.content, name=item.filename),
+            image_hash=item.image_hash,
+            **fields,
+        )
+        stamp_hash(item.instance, item.perceptual_hash)
+
+    _insert(pending, options)
+    seen.update(item.image_hash for item in items if item.status == STATUS_CREATED)
+
+
+def _insert(items, options):
+    """
+    `bulk_create` the prepared rows. If concurrent uploads stored some of the same hashes
+    after our duplicate query, the unique constraint rejects the insert: those items are
+    marked duplicate and the rest are inserted again, until an insert succeeds.
+    """
+    to_insert = [item for item in items if item.instance is not None]
+    remaining = to_insert
+    while remaining:
+        try:
+            with span("db.bulk_insert"), transaction.atomic():
+                LocationImage.objects.bulk_create([item.instance for item in remaining], batch_size=options["INSERT_BATCH_SIZE"])
+            break
+        except IntegrityError:
+            taken = set(
+                LocationImage.objects.filter(image_hash__in=[item.image_hash for item in remaining])
+                .values_list('image_hash', flat=True)
+            )
+            if not taken:
+                raise  # Not a duplicate hash: retrying cannot help
+            retry = []
+            for item in remaining:
+                if item.image_hash in taken:
+                    if item.instance.image._committed:
+                        item.instance.image.delete(save=False)  # Stored before the failed insert
+                    item.instance = None
+                    item.status = STATUS_DUPLICATE
+                    item.error = DUPLICATE_IMAGE
+                else:
+                    item.instance.pk = None
+                    retry.append(item)
+            remaining = retry
+
+    for item in to_insert:
+        if item.instance is not None:
+            item.status = STATUS_CREATED
+
+
+def _routes(items, coordinates):
+    """{item index: route fields} for items with a landmark, with one search per home address."""
+    by_address = {}
+    for item in items:
+        if item.landmark:
+            by_address.setdefault(item.home_address, []).append(item)
+    routes = {}
+    for address, group in by_address.items():
+        lat, lng = coordinates[address]
+        landmarks = [(item.landmark['landmark_lat'], item.landmark['landmark_lng']) for item in group]
+        for item, fields in zip(group, travel_fields_many(lat, lng, landmarks)):
+            routes[item.index] = fields
+    return routes
+
+
+def _geocode(address):
+    try:
+        return get_coordinates(address)
+    finally:
+        connections.close_all()  # Pool threads open their own DB connections for the geocoding store
+
+
+def _detect_landmarks(items, executor, options):
+    """
+    Fill `item.landmark` from the landmark cache or a near-duplicate's stored result,
+    sending only the remaining images to Vision in concurrent batches.
+    """
+    cache = get_landmark_cache()
+    misses = []
+    for item in items:
+        item.landmark = cache.get(item.image_hash)
+        if item.landmark is not MISSING:
+            continue
+        near_duplicate = find_near_duplicate(item.perceptual_hash)
+        if near_duplicate is not None:
+            item.landmark = stored_landmark(near_duplicate)
+            cache.set(item.image_hash, item.landmark)
+        else:
+            misses.append(item)
+
+    def annotate(chunk):
+        try:
+            contents = [vision_content(item.content) for item in chunk]
+            with span("landmark.provider_batch"):
+                return chunk, get_provider().detect_landmarks(contents), None
+        except Exception as e:
+            return chunk, None, e
+
+    for chunk, results, error in executor.map(annotate, list(_chunks(misses, options["VISION_BATCH_SIZE"]))):
+        if error is not None:
+            logger.error("❗ Vision batch request failed: %s", error, extra={"event": "vision_batch_failed", "images": len(chunk)})
+            for item in chunk:
+                item.status = STATUS_ERROR
+                item.error = "Landmark detection failed."
+            continue
+        for item, (landmark, item_error) in zip(chunk, results):
+            if item_error:
+                item.status = STATUS_ERROR
+                item.error = f"Landmark detection failed: {item_error}"
+                continue
+            item.landmark = landmark
+            cache.set(item.image_hash, item.landmark)
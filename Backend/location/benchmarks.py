@@ -0,0 +1,328 @@
+"""
+Reproducible benchmarks for the location API (driven by `manage.py run_benchmarks`).
+
+Every run happens in a throw-away test database created from the configured one
+(SQLite or PostgreSQL), with uploads written to a temporary MEDIA_ROOT and Google
+replaced by the offline `GazetteerProvider`, so nothing leaves the machine and no
+quota is spent. Requests go through the full Django/DRF stack via the test client.
+
+Each scenario records per-operation latencies; results carry p50/p95/p99, mean,
+throughput and the process's peak RSS, and are written as JSON that
+`compare_results()` can diff against a baseline run.
+"""
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+import django
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+from . import providers
+from .distance import haversine_one_to_many
+from .models import LocationImage
+from .response_cache import invalidate_images
+from .serializers import haversine
+
+PERCENTILES = (50, 95, 99)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far (ru_maxrss is KiB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def summarize(name, params, latencies, elapsed):
+    """Result record for one scenario; `latencies` in seconds, `elapsed` the wall time of the measured loop."""
+    values = np.asarray(latencies, dtype=np.float64) * 1000
+    percentiles = np.percentile(values, PERCENTILES) if len(values) else [None] * len(PERCENTILES)
+    return {
+        "name": name,
+        "params": params,
+        "n": len(values),
+        **{f"p{p}_ms": round(float(v), 4) if v is not None else None for p, v in zip(PERCENTILES, percentiles)},
+        "mean_ms": round(float(values.mean()), 4) if len(values) else None,
+        "throughput_per_s": round(len(values) / elapsed, 2) if elapsed else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def measure(name, params, operation, iterations, warmup=0):
+    """Time `operation(i)` for `iterations` calls after `warmup` unmeasured ones."""
+    for i in range(warmup):
+        operation(-1 - i)
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        operation(i)
+        latencies.append(time.perf_counter() - t0)
+    return summarize(name, params, latencies, time.perf_counter() - started)
+
+
+class ImageFactory:
+    """Distinct random-noise JPEGs (noise barely compresses, so dimensions control file size)."""
+
+    def __init__(self, seed):
+        self.rng = np.random.default_rng(seed)
+        self.count = 0
+
+    def jpeg(self, width, height):
+        pixels = self.rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, "JPEG", quality=90)
+        self.count += 1
+        return buffer.getvalue()
+
+    def upload(self, width, height):
+        return SimpleUploadedFile(f"bench_{self.count}.jpg", self.jpeg(width, height), content_type="image/jpeg")
+
+
+def seed_rows(target, rng):
+    """Grow the table to `target` rows with bulk inserts (stored file names only, no files)."""
+    existing = LocationImage.objects.count()
+    base = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+    batch = []
+    for i in range(existing, target):
+        lat, lng = 43.65 + rng.uniform(-0.5, 0.5), -79.38 + rng.uniform(-0.5, 0.5)
+        batch.append(LocationImage(
+            image=f"uploads/seed_{i}.jpg",
+            image_hash=f"seed{i:028d}",
+            home_address="35 Davean Dr, North York, ON, Canada M2L 2R6",
+            latitude=43.7355, longitude=-79.3783,
+            landmark_name=f"Landmark {i % 997}", landmark_confidence=90.0,
+            landmark_lat=lat, landmark_lng=lng, distance_km=round(haversine(43.7355, -79.3783, lat, lng), 2),
+            landmark_detected_at=base,
+        ))
+        if len(batch) == 5000:
+            LocationImage.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        LocationImage.objects.bulk_create(batch)
+    invalidate_images([])
+
+
+@contextmanager
+def benchmark_environment(keep_db=False):
+    """Test database, temporary MEDIA_ROOT and the offline provider for the duration of a run."""
+    media_root = tempfile.mkdtemp(prefix="bench_media_")
+    db_settings = settings.DATABASES["default"]
+    if db_settings["ENGINE"].endswith("sqlite3"):
+        # A file (not :memory:) so the worker threads used by batch uploads share the database
+        db_settings.setdefault("TEST", {})["NAME"] = os.path.join(media_root, "bench.sqlite3")
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keep_db)
+    provider_settings = {"BACKEND": "location.providers.GazetteerProvider"}
+    try:
+        with override_settings(MEDIA_ROOT=media_root, LOCATION_PROVIDER=provider_settings, ALLOWED_HOSTS=["*"]):
+            providers._provider = None
+            yield
+    finally:
+        providers._provider = None
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keep_db)
+
+
+def api_client():
+    user, _ = get_user_model().objects.get_or_create(
+        username="benchmark", defaults={"is_staff": True, "is_superuser": True}
+    )
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+def _check(response, expected):
+    if response.status_code not in expected:
+        raise RuntimeError(f"Unexpected HTTP {response.status_code}: {getattr(response, 'data', response.content)!r}")
+
+
+def bench_single_upload(client, images, options):
+    width, height = options["upload_size"]
+
+    def operation(_):
+        response = client.post("/api/location/upload/", {"image": images.upload(width, height)}, format="multipart")
+        _check(response, (201,))
+
+    return measure("upload_single", {"size": [width, height]}, operation, options["uploads"], options["warmup"])
+
+
+def bench_batch_upload(client, images, options):
+    width, height = options["upload_size"]
+    batch_size = options["batch_size"]
+
+    def operation(_):
+        files = [images.upload(width, height) for _ in range(batch_size)]
+        response = client.post("/api/location/upload/batch/", {"images": files}, format="multipart")
+        _check(response, (200, 201))
+
+    result = measure("upload_batch", {"size": [width, height], "batch_size": batch_size},
+                     operation, options["batches"], min(options["warmup"], 1))
+    result["images_per_s"] = round(result["throughput_per_s"] * batch_size, 2) if result["throughput_per_s"] else None
+    return result
+
+
+def bench_reads(client, table_size, rng, options):
+    pks = list(LocationImage.objects.values_list('pk', flat=True))
+    cursors = []
+    response = client.get("/api/location/images/")
+    while response.data.get("next") and len(cursors) < 50:
+        cursors.append(response.data["next"])
+        response = client.get(response.data["next"])
+    params = {"table_size": table_size}
+
+    def first_page(_):
+        _check(client.get("/api/location/images/"), (200,))
+
+    def deep_page(i):
+        _check(client.get(cursors[i % len(cursors)] if cursors else "/api/location/images/"), (200,))
+
+    def detail(_):
+        _check(client.get(f"/api/location/images/{pks[int(rng.integers(len(pks)))]}/"), (200,))
+
+    reads = options["reads"]
+    return [
+        measure("list_first_page", params, first_page, reads, options["warmup"]),
+        measure("list_cursor_page", params, deep_page, reads, options["warmup"]),
+        measure("detail", params, detail, reads, options["warmup"]),
+    ]
+
+
+def bench_duplicate_query(table_size, rng, options):
+    hashes = list(LocationImage.objects.values_list('image_hash', flat=True)[:1000])
+
+    def hit(_):
+        LocationImage.objects.filter(image_hash=hashes[int(rng.integers(len(hashes)))]).exists()
+
+    def miss(i):
+        LocationImage.objects.filter(image_hash=f"missing{i:025d}").exists()
+
+    params = {"table_size": table_size}
+    return [
+        measure("duplicate_query_hit", params, hit, options["reads"], options["warmup"]),
+        measure("duplicate_query_miss", params, miss, options["reads"], options["warmup"]),
+    ]
+
+
+def bench_haversine(rng, options):
+    n = options["haversine_points"]
+    lats, lngs = rng.uniform(-90, 90, n), rng.uniform(-180, 180, n)
+    pairs = list(zip(lats.tolist(), lngs.tolist()))
+
+    def scalar(i):
+        lat, lng = pairs[i % n]
+        haversine(43.7355, -79.3783, lat, lng)
+
+    def vectorized(_):
+        haversine_one_to_many(43.7355, -79.3783, lats, lngs)
+
+    return [
+        measure("haversine_scalar", {}, scalar, min(n, 100_000), options["warmup"]),
+        measure("haversine_one_to_many", {"points": n}, vectorized, 50, 2),
+    ]
+
+
+def bench_image_hash(images, options):
+    results = []
+    for width, height in options["hash_sizes"]:
+        content = images.jpeg(width, height)
+        instance = LocationImage(image=SimpleUploadedFile("hash.jpg", content))
+
+        def operation(_):
+            instance.image.seek(0)
+            instance.calculate_image_hash()
+
+        result = measure("calculate_image_hash", {"size": [width, height]}, operation, options["hash_iterations"], options["warmup"])
+        result["bytes"] = len(content)
+        results.append(result)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(options, progress=print):
+    """Run every selected scenario and return the JSON-serializable report."""
+    rng = np.random.default_rng(options["seed"])
+    images = ImageFactory(options["seed"])
+    results = []
+    with benchmark_environment(keep_db=options.get("keep_db", False)):
+        vendor = connection.vendor
+        client = api_client()
+        selected = set(options["scenarios"])
+
+        if "upload" in selected:
+            progress("upload_single")
+            results.append(bench_single_upload(client, images, options))
+            progress("upload_batch")
+            results.append(bench_batch_upload(client, images, options))
+        if "hash" in selected:
+            progress("calculate_image_hash")
+            results.extend(bench_image_hash(images, options))
+        if "haversine" in selected:
+            progress("haversine")
+            results.extend(bench_haversine(rng, options))
+        if selected & {"reads", "duplicates"}:
+            for table_size in options["table_sizes"]:
+                progress(f"seeding {table_size} rows")
+                seed_rows(table_size, rng)
+                if "reads" in selected:
+                    progress(f"reads @ {table_size}")
+                    results.extend(bench_reads(client, table_size, rng, options))
+                if "duplicates" in selected:
+                    progress(f"duplicate query @ {table_size}")
+                    results.extend(bench_duplicate_query(table_size, rng, options))
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(dt_timezone.utc).isoformat(),
+            "git_revision": git_revision(),
+            "database": vendor,
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "platform": platform.platform(),
+            "options": {key: value for key, value in options.items() if key != "output"},
+        },
+        "results": results,
+    }
+
+
+def _key(result):
+    return result["name"], json.dumps(result["params"], sort_keys=True)
+
+
+def compare_results(baseline, current, metric="p95_ms", tolerance=0.10):
+    """
+    Rows present in both reports as (name, params, baseline, current, change) with `change`
+    the relative difference of `metric`; `regressed` lists those slower than `tolerance`.
+    """
+    previous = {_key(result): result for result in baseline["results"]}
+    rows, regressed = [], []
+    for result in current["results"]:
+        old = previous.get(_key(result))
+        if not old or not old.get(metric) or result.get(metric) is None:
+            continue
+        change = (result[metric] - old[metric]) / old[metric]
+        row = (result["name"], result["params"], old[metric], result[metric], change)
+        rows.append(row)
+        if change > tolerance:
+            regressed.append(row)
+    return rows, regressed
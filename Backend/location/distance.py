@@ -0,0 +1,87 @@
+"""
+Great-circle (haversine) distances, scalar and vectorized.
+
+`haversine_km` is the scalar formula. The NumPy functions compute the same thing
+for whole coordinate arrays: one point to many (`haversine_one_to_many`),
+element-wise pairs (`haversine_pairs`) and full M×N matrices
+(`haversine_matrix`, optionally chunked to bound temporary memory). NumPy is
+imported on first use, so importing this module for the scalar formula stays cheap.
+A `dtype` of None means float64.
+"""
+import math
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Unrounded great-circle distance in km between two points given in degrees."""
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = math.sin(dlat / 2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2)**2
+    c = 2 * math.asin(math.sqrt(a))
+
+    return EARTH_RADIUS_KM * c
+
+
+def _radians(values, dtype):
+    import numpy as np
+    return np.radians(np.asarray(values, dtype=dtype))
+
+
+def _haversine(lat1, lon1, lat2, lon2, dtype):
+    """Broadcasting haversine over radian arrays."""
+    import numpy as np
+    a = np.sin((lat2 - lat1) * 0.5) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) * 0.5) ** 2
+    np.clip(a, 0.0, 1.0, out=a)  # Rounding can push `a` a hair outside [0, 1]
+    return (2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))).astype(dtype, copy=False)
+
+
+def haversine_pairs(lats1, lons1, lats2, lons2, dtype=None):
+    """Element-wise distances between N pairs of points; returns an array of shape (N,)."""
+    import numpy as np
+    dtype = dtype or np.float64
+    return _haversine(_radians(lats1, dtype), _radians(lons1, dtype), _radians(lats2, dtype), _radians(lons2, dtype), dtype)
+
+
+def haversine_one_to_many(lat, lon, lats, lons, dtype=None):
+    """Distances from one point to N points; returns an array of shape (N,)."""
+    import numpy as np
+    dtype = dtype or np.float64
+    lat, lon = np.radians(dtype(lat)), np.radians(dtype(lon))
+    return _haversine(lat, lon, _radians(lats, dtype), _radians(lons, dtype), dtype)
+
+
+def haversine_matrix(lats1, lons1, lats2, lons2, dtype=None, chunk_size=None):
+    """
+    Pairwise distances between M origins and N destinations; returns an (M, N) array.
+    With `chunk_size`, origins are processed that many rows at a time, so temporaries
+    stay at chunk_size × N instead of M × N (the result itself is always M × N).
+    """
+    import numpy as np
+    dtype = dtype or np.float64
+    lat1, lon1 = _radians(lats1, dtype), _radians(lons1, dtype)
+    lat2, lon2 = _radians(lats2, dtype)[np.newaxis, :], _radians(lons2, dtype)[np.newaxis, :]
+    out = np.empty((lat1.shape[0], lat2.shape[1]), dtype=dtype)
+
+    step = chunk_size or max(lat1.shape[0], 1)
+    for start in range(0, lat1.shape[0], step):
+        stop = start + step
+        out[start:stop] = _haversine(lat1[start:stop, np.newaxis], lon1[start:stop, np.newaxis], lat2, lon2, dtype)
+    return out
+
+
+def landmark_distances(lat, lon, queryset, dtype=None):
+    """
+    Distances (km) from one point to the stored landmark of every row in `queryset`.
+    Returns (ids, distances) arrays; rows without a landmark are skipped.
+    """
+    import numpy as np
+    rows = np.array(
+        list(queryset.filter(landmark_lat__isnull=False, landmark_lng__isnull=False)
+             .values_list('id', 'landmark_lat', 'landmark_lng')),
+        dtype=np.float64,
+    ).reshape(-1, 3)
+    return rows[:, 0].astype(np.int64), haversine_one_to_many(lat, lon, rows[:, 1], rows[:, 2], dtype=dtype)
@@ -0,0 +1,9 @@
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class DuplicateImage(APIException):
+    """The uploaded content's `image_hash` already belongs to another `LocationImage`."""
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "❗ This image already exists in the database and cannot be uploaded again."
+    default_code = 'duplicate_image'
@@ -0,0 +1,95 @@
+"""
+Streaming export of `LocationImage` rows as NDJSON or CSV.
+
+Rows are read as plain tuples through a server-side cursor (`.iterator()`), rendered
+into ~64 KB text blocks and optionally gzip-compressed on the fly, so memory stays
+flat however many rows are exported. Only stored columns are read; nothing here
+calls Geocoding or Vision.
+"""
+import csv
+import io
+import json
+import zlib
+from django.conf import settings
+from .models import LocationImage
+
+DEFAULT_SETTINGS = {
+    "CHUNK_SIZE": 2000,       # Rows fetched per round trip from the server-side cursor
+    "BLOCK_SIZE": 64 * 1024,  # Bytes of rendered output buffered per yielded block
+}
+
+EXPORT_FIELDS = [
+    'id', 'image', 'uploaded_at', 'image_hash', 'status', 'home_address', 'latitude', 'longitude',
+    'landmark_name', 'landmark_confidence', 'landmark_lat', 'landmark_lng', 'landmark_detected_at', 'distance_km',
+    'road_distance_km', 'travel_time_min', 'travel_cost',
+]
+
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+}
+
+
+def get_export_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "LOCATION_EXPORT", {})}
+
+
+def export_rows(queryset=None, chunk_size=None):
+    """Yield one tuple per row, in EXPORT_FIELDS order, through a server-side cursor."""
+    queryset = queryset if queryset is not None else LocationImage.objects.all()
+    chunk_size = chunk_size or get_export_settings()["CHUNK_SIZE"]
+    return queryset.order_by('pk').values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+
+
+def _value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def render_ndjson(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_FIELDS, map(_value, row))), ensure_ascii=False) + "\n"
+
+
+def render_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        writer.writerow(map(_value, row))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+RENDERERS = {"ndjson": render_ndjson, "csv": render_csv}
+
+
+def blocks(lines, block_size=None):
+    """Join rendered lines into UTF-8 blocks of roughly `block_size` bytes."""
+    block_size = block_size or get_export_settings()["BLOCK_SIZE"]
+    pending, size = [], 0
+    for line in lines:
+        pending.append(line)
+        size += len(line)
+        if size >= block_size:
+            yield "".join(pending).encode()
+            pending, size = [], 0
+    if pending:
+        yield "".join(pending).encode()
+
+
+def gzip_blocks(chunks, level=6):
+    """Gzip a stream of byte blocks incrementally."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream_export(export_format, queryset=None, compress=False, chunk_size=None):
+    """Byte blocks of the full export in `export_format` ("ndjson" or "csv")."""
+    stream = blocks(RENDERERS[export_format](export_rows(queryset, chunk_size)))
+    return gzip_blocks(stream) if compress else stream
@@ -0,0 +1,157 @@
+import asyncio
+import re
+import threading
+import unicodedata
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from .providers import get_provider
+from .services import get_service_settings
+from .instrumentation import span, timed
+from .lru import LRUCache, MISSING
+from .models import GeocodedAddress
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "TTL": 60 * 60 * 24 * 90,   # Refresh stored coordinates after this many seconds
+    "MAX_ENTRIES": 4096,        # In-memory LRU in front of the GeocodedAddress table
+}
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_address(address):
+    """
+    Fold an address to its lookup key: accents stripped, lower-cased,
+    punctuation dropped and runs of whitespace collapsed.
+    "35 Davean Dr., North York" and "35  davean dr north york" share one key.
+    """
+    address = unicodedata.normalize("NFKD", address or "")
+    address = "".join(ch for ch in address if not unicodedata.combining(ch))
+    address = _PUNCTUATION.sub(" ", address.casefold())
+    return _WHITESPACE.sub(" ", address).strip()[:255]
+
+
+def fetch_coordinates(address):
+    """Geocode through the configured provider; returns (lat, lng) or (None, None)."""
+    try:
+        with span("geocode.provider"):
+            return get_provider().geocode(address)
+    except Exception as e:
+        logger.error("❗ Exception in `fetch_coordinates()`: %s", e)
+        return None, None
+
+
+async def afetch_coordinates(address):
+    """Async `fetch_coordinates()`, bounded by EXTERNAL_SERVICES["ASYNC_GEOCODE_DEADLINE"]."""
+    try:
+        with span("geocode.provider"):
+            return await asyncio.wait_for(get_provider().ageocode(address), get_service_settings()["ASYNC_GEOCODE_DEADLINE"])
+    except Exception as e:
+        logger.error("❗ Exception in `afetch_coordinates()`: %s", e or type(e).__name__)
+        return None, None
+
+
+class GeocodingCache:
+    """
+    Two-level address → coordinates store: a per-process LRU backed by the
+    `GeocodedAddress` table. Rows older than TTL are re-geocoded on access;
+    if the refresh fails the stale coordinates are still served.
+    """
+
+    def __init__(self, options):
+        self.ttl = timedelta(seconds=options["TTL"])
+        self._lru = LRUCache(max_entries=options["MAX_ENTRIES"], ttl=options["TTL"])
+
+    def get_coordinates(self, address):
+        key = normalize_address(address)
+        if not key:
+            return None, None
+
+        cached = self._lru.get(key)
+        if cached is not MISSING:
+            return cached
+
+        coordinates, record = self._lookup(key)
+        if coordinates is not MISSING:
+            return coordinates
+        return self._store(key, address, record, fetch_coordinates(address))
+
+    async def aget_coordinates(self, address):
+        """`get_coordinates()` for async callers: table reads/writes on a sync thread, the geocode awaited."""
+        key = normalize_address(address)
+        if not key:
+            return None, None
+
+        cached = self._lru.get(key)  # Hot addresses are answered without leaving the event loop
+        if cached is not MISSING:
+            return cached
+
+        coordinates, record = await sync_to_async(self._lookup)(key)
+        if coordinates is not MISSING:
+            return coordinates
+        return await sync_to_async(self._store)(key, address, record, await afetch_coordinates(address))
+
+    def _lookup(self, key):
+        """(coordinates, None) for a fresh stored row, else (MISSING, stale record or None)."""
+        record = GeocodedAddress.objects.filter(normalized_address=key).first()
+        if record and record.updated_at + self.ttl > timezone.now():
+            coordinates = (record.latitude, record.longitude)
+            self._lru.set(key, coordinates)
+            return coordinates, None
+        return MISSING, record
+
+    def _store(self, key, address, record, fetched):
+        """Persist freshly geocoded coordinates; fall back to the stale `record` when geocoding failed."""
+        lat, lng = fetched
+        if lat is None or lng is None:
+            if record:
+                logger.warning("❗ Geocoding refresh failed, serving stored coordinates for: %s", key)
+                return record.latitude, record.longitude
+            return None, None
+
+        GeocodedAddress.objects.update_or_create(
+            normalized_address=key,
+            defaults={"address": address, "latitude": lat, "longitude": lng},
+        )
+        self._lru.set(key, (lat, lng))
+        return lat, lng
+
+    def invalidate(self, address):
+        key = normalize_address(address)
+        self._lru.delete(key)
+        GeocodedAddress.objects.filter(normalized_address=key).delete()
+
+    def stats(self):
+        return self._lru.stats()
+
+
+_geocoding_cache = None
+_geocoding_cache_lock = threading.Lock()
+
+
+def get_geocoding_cache():
+    """Return the process-wide geocoding cache configured by `settings.GEOCODING_CACHE`."""
+    global _geocoding_cache
+    if _geocoding_cache is None:
+        with _geocoding_cache_lock:
+            if _geocoding_cache is None:
+                options = {**DEFAULT_SETTINGS, **getattr(settings, "GEOCODING_CACHE", {})}
+                _geocoding_cache = GeocodingCache(options)
+    return _geocoding_cache
+
+
+@timed("geocode")
+def get_coordinates(address):
+    """Convert an address to (lat, lng), hitting the Geocoding API only for unseen or expired addresses."""
+    return get_geocoding_cache().get_coordinates(address)
+
+
+async def aget_coordinates(address):
+    """Async `get_coordinates()`."""
+    with span("geocode"):
+        return await get_geocoding_cache().aget_coordinates(address)
@@ -0,0 +1,302 @@
+"""
+Lightweight per-request instrumentation.
+
+* `span(name)` / `@timed(name)` time a block or function. Durations feed a
+  process-wide Prometheus histogram and, inside a request, that request's
+  timing breakdown.
+* `InstrumentationMiddleware` counts and times every DB query of the request
+  (through `connection.execute_wrapper`), adds a `Server-Timing` header,
+  records request metrics and, for a sampled share of requests, keeps a
+  cProfile dump when the request exceeds PROFILE_THRESHOLD_MS.
+* `metrics_view` serves the histograms in the Prometheus text format, to holders of
+  METRICS_TOKEN or, without a token, to METRICS_ALLOWED_NETWORKS (loopback) only.
+
+Metrics are per worker process, like the landmark cache counters. Work done on
+pool threads (batch geocoding, derivatives) feeds the histograms but not the
+request's Server-Timing breakdown. Under ASGI the middleware runs natively async;
+spans and queries in `sync_to_async` code still count towards the request.
+"""
+import bisect
+import contextvars
+import cProfile
+import functools
+import hmac
+import ipaddress
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "ENABLED": True,
+    "SERVER_TIMING": True,            # Add the Server-Timing response header
+    "METRICS_TOKEN": None,            # When set, /metrics requires "Authorization: Bearer <token>"
+    "METRICS_ALLOWED_NETWORKS": ("127.0.0.0/8", "::1/128"),  # Without a token, only these clients may scrape
+    "BUCKETS": (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    "PROFILE_SAMPLE_RATE": 0.0,       # Share of requests run under cProfile (0 disables profiling)
+    "PROFILE_THRESHOLD_MS": 1000,     # Sampled profiles are kept only for requests slower than this
+    "PROFILE_DIR": "/tmp/location-profiles",
+}
+
+
+def get_instrumentation_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "INSTRUMENTATION", {})}
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense (bucket counts include all smaller buckets when rendered)."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Process-wide metric store: histograms and counters keyed by (metric name, sorted labels)."""
+
+    HELP = {
+        "location_span_seconds": "Time spent in instrumented hot-path functions.",
+        "location_db_query_seconds": "Database query time by statement type.",
+        "location_http_request_seconds": "Request duration by view and method.",
+        "location_http_requests_total": "Requests by view, method and status code.",
+        "location_http_request_db_queries": "Database queries per request.",
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, name, value, buckets=None, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets or get_instrumentation_settings()["BUCKETS"])
+            histogram.observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    @staticmethod
+    def _labels(pairs):
+        if not pairs:
+            return ""
+        escaped = ('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+        return "{" + ",".join(escaped) + "}"
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            for kind, store in (("histogram", self.histograms), ("counter", self.counters)):
+                seen = set()
+                for (name, labels), value in sorted(store.items()):
+                    if name not in seen:
+                        seen.add(name)
+                        lines.append(f"# HELP {name} {self.HELP.get(name, name)}")
+                        lines.append(f"# TYPE {name} {kind}")
+                    if kind == "counter":
+                        lines.append(f"{name}{self._labels(labels)} {value}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(value.buckets + (float("inf"),), value.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{self._labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{self._labels(labels)} {value.sum}")
+                    lines.append(f"{name}_count{self._labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class RequestTimings:
+    """Per-request breakdown: total seconds and call count per span, plus DB query totals."""
+
+    def __init__(self):
+        self.spans = {}
+        self.db_queries = 0
+        self.db_seconds = 0.0
+
+    def add(self, name, seconds):
+        total, count = self.spans.get(name, (0.0, 0))
+        self.spans[name] = (total + seconds, count + 1)
+
+
+_current = contextvars.ContextVar("location_request_timings", default=None)
+
+
+def current_timings():
+    return _current.get()
+
+
+@contextmanager
+def span(name):
+    """Time the enclosed block as `name`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        registry.observe("location_span_seconds", elapsed, span=name)
+        timings = _current.get()
+        if timings is not None:
+            timings.add(name, elapsed)
+
+
+def timed(name):
+    """Decorator form of `span()`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _statement_type(sql):
+    return sql.lstrip().split(None, 1)[0].upper() if sql and sql.strip() else "OTHER"
+
+
+def _db_wrapper(timings):
+    def wrapper(execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            timings.db_queries += 1
+            timings.db_seconds += elapsed
+            registry.observe("location_db_query_seconds", elapsed, statement=_statement_type(sql))
+    return wrapper
+
+
+def _add_db_wrapper(wrapper):
+    connection.execute_wrappers.append(wrapper)
+
+
+def _remove_db_wrapper(wrapper):
+    connection.execute_wrappers.remove(wrapper)
+
+
+def server_timing_header(timings, total):
+    entries = [f'{name};dur={seconds * 1000:.2f};desc="{count}x"' for name, (seconds, count) in timings.spans.items()]
+    entries.append(f'db;dur={timings.db_seconds * 1000:.2f};desc="{timings.db_queries} queries"')
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        options = get_instrumentation_settings()
+        if not options["ENABLED"]:
+            return self.get_response(request)
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        profiler = cProfile.Profile() if random.random() < options["PROFILE_SAMPLE_RATE"] else None
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(_db_wrapper(timings)):
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            _current.reset(token)
+        return self._record(request, response, timings, time.perf_counter() - started, profiler, options)
+
+    async def __acall__(self, request):
+        options = get_instrumentation_settings()
+        if not options["ENABLED"]:
+            return await self.get_response(request)
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        # Connections are per thread: hook the one of the thread that runs this request's sync (ORM) code.
+        # cProfile would only see the event loop thread, so async requests are not profiled.
+        wrapper = _db_wrapper(timings)
+        await sync_to_async(_add_db_wrapper)(wrapper)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(_remove_db_wrapper)(wrapper)
+            _current.reset(token)
+        return self._record(request, response, timings, time.perf_counter() - started, None, options)
+
+    def _record(self, request, response, timings, total, profiler, options):
+        match = getattr(request, "resolver_match", None)
+        view = match.url_name if match and match.url_name else "unmatched"
+        registry.observe("location_http_request_seconds", total, view=view, method=request.method)
+        registry.observe("location_http_request_db_queries", timings.db_queries,
+                         buckets=(0, 1, 2, 5, 10, 20, 50, 100, 250), view=view)
+        registry.increment("location_http_requests_total", view=view, method=request.method, status=response.status_code)
+
+        if options["SERVER_TIMING"]:
+            response["Server-Timing"] = server_timing_header(timings, total)
+        if profiler is not None and total * 1000 >= options["PROFILE_THRESHOLD_MS"]:
+            self._dump_profile(profiler, options["PROFILE_DIR"], view, total)
+        return response
+
+    @staticmethod
+    def _dump_profile(profiler, directory, view, total):
+        try:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{view}-{int(total * 1000)}ms-{os.getpid()}.prof")
+            profiler.dump_stats(path)
+            logger.warning("🐢 Slow request to %s (%.0f ms), profile saved to %s", view, total * 1000, path)
+        except OSError as e:
+            logger.error("❗ Could not write profile: %s", e)
+
+
+def _metrics_allowed(request, options):
+    token = options["METRICS_TOKEN"]
+    if token:
+        return hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")
+    try:
+        client = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+    return any(client in ipaddress.ip_network(network) for network in options["METRICS_ALLOWED_NETWORKS"])
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint (per worker process)."""
+    if not _metrics_allowed(request, get_instrumentation_settings()):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,163 @@
+"""
+DB-backed enrichment queue for async uploads.
+
+Uploads in async mode are saved with `status=pending` and an `EnrichmentJob` row.
+Jobs are processed either by `manage.py run_enrichment_worker` or, when
+`LOCATION_INGESTION["RUN_IN_PROCESS"]` is set, by a thread pool inside the web
+process. No external broker is needed in either case.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from .models import EnrichmentJob, LocationImage
+from .serializers import enrich_image
+from .logs import get_request_id, request_id_var
+from .response_cache import invalidate_images
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "ASYNC": False,             # Default ingestion mode when the request does not pick one
+    "CONCURRENCY": 4,           # Worker threads per process
+    "MAX_ATTEMPTS": 3,
+    "RETRY_DELAY": 30,          # Seconds, doubled after each failed attempt
+    "STALE_AFTER": 15 * 60,     # Running jobs older than this are assumed orphaned and requeued
+    "RUN_IN_PROCESS": False,    # Process jobs in the web process instead of a separate worker
+}
+
+
+def get_ingestion_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "LOCATION_INGESTION", {})}
+
+
+def enqueue(image, home_address):
+    """Queue enrichment for a pending `LocationImage`; dispatched in-process after commit if configured."""
+    job = EnrichmentJob.objects.create(image=image, home_address=home_address, available_at=timezone.now())
+    if get_ingestion_settings()["RUN_IN_PROCESS"]:
+        request_id = get_request_id()  # Keep the upload's correlation id on the background work
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_thread, job.pk, True, request_id))
+    return job
+
+
+def claim_jobs(limit):
+    """
+    Atomically claim up to `limit` due jobs. Each claim is a conditional UPDATE,
+    so concurrent workers never process the same job (no row locks needed).
+    """
+    now = timezone.now()
+    candidates = EnrichmentJob.objects.filter(
+        status=EnrichmentJob.STATUS_QUEUED, available_at__lte=now
+    ).order_by('available_at', 'pk').values_list('pk', flat=True)[:limit]
+
+    claimed = []
+    for pk in candidates:
+        if _claim(pk):
+            claimed.append(pk)
+    return claimed
+
+
+def _claim(pk):
+    return EnrichmentJob.objects.filter(pk=pk, status=EnrichmentJob.STATUS_QUEUED).update(
+        status=EnrichmentJob.STATUS_RUNNING, updated_at=timezone.now()
+    ) == 1
+
+
+def requeue_stale_jobs():
+    """Return jobs left `running` by a crashed worker to the queue."""
+    cutoff = timezone.now() - timedelta(seconds=get_ingestion_settings()["STALE_AFTER"])
+    return EnrichmentJob.objects.filter(status=EnrichmentJob.STATUS_RUNNING, updated_at__lt=cutoff).update(
+        status=EnrichmentJob.STATUS_QUEUED, available_at=timezone.now()
+    )
+
+
+def process_job(job_pk):
+    """Run enrichment for one claimed job and record the outcome on the job and the image."""
+    job = EnrichmentJob.objects.select_related('image').get(pk=job_pk)
+    image = job.image
+    options = get_ingestion_settings()
+
+    LocationImage.objects.filter(pk=image.pk).update(status=LocationImage.STATUS_PROCESSING)
+    invalidate_images([image.pk])  # `update()` sends no signals; responses show the status
+    try:
+        fields = enrich_image(image.image, image.image_hash, job.home_address, image.perceptual_hash, exclude_pk=image.pk)
+    except Exception as e:
+        job.attempts += 1
+        job.last_error = _error_message(e)
+        # Bad input (e.g. an address that cannot be geocoded) will not succeed on retry
+        if isinstance(e, ValidationError) or job.attempts >= options["MAX_ATTEMPTS"]:
+            job.status = EnrichmentJob.STATUS_FAILED
+            LocationImage.objects.filter(pk=image.pk).update(status=LocationImage.STATUS_FAILED)
+            logger.error("❗ Enrichment failed permanently for Image ID %s: %s", image.pk, job.last_error,
+                         extra={"event": "enrichment_failed", "image_id": image.pk, "job_id": job.pk})
+        else:
+            job.status = EnrichmentJob.STATUS_QUEUED
+            job.available_at = timezone.now() + timedelta(seconds=options["RETRY_DELAY"] * 2 ** (job.attempts - 1))
+            LocationImage.objects.filter(pk=image.pk).update(status=LocationImage.STATUS_PENDING)
+            logger.warning("❗ Enrichment attempt %s failed for Image ID %s: %s", job.attempts, image.pk, job.last_error,
+                           extra={"event": "enrichment_retry", "image_id": image.pk, "job_id": job.pk})
+        job.save(update_fields=['attempts', 'last_error', 'status', 'available_at', 'updated_at'])
+        invalidate_images([image.pk])
+        return False
+
+    fields['status'] = LocationImage.STATUS_DONE
+    with transaction.atomic():
+        LocationImage.objects.filter(pk=image.pk).update(**fields)
+        job.attempts += 1
+        job.status = EnrichmentJob.STATUS_DONE
+        job.last_error = ''
+        job.save(update_fields=['attempts', 'last_error', 'status', 'updated_at'])
+        invalidate_images([image.pk])
+    logger.info("✅ Enriched Image ID %s in background", image.pk, extra={"event": "image_enriched", "image_id": image.pk, "job_id": job.pk})
+    return True
+
+
+def _error_message(exc):
+    detail = getattr(exc, 'detail', None)
+    if isinstance(detail, list):
+        return " ".join(str(item) for item in detail)
+    if isinstance(detail, dict):
+        return " ".join(f"{key}: {' '.join(map(str, value)) if isinstance(value, list) else value}" for key, value in detail.items())
+    return str(exc)
+
+
+def run_batch(executor, limit):
+    """Claim up to `limit` jobs and process them on `executor`; returns the number processed."""
+    claimed = claim_jobs(limit)
+    if claimed:
+        list(executor.map(_run_in_thread, claimed))
+    return len(claimed)
+
+
+def _run_in_thread(job_pk, claim=False, request_id=None):
+    close_old_connections()
+    token = request_id_var.set(request_id)
+    try:
+        if claim and not _claim(job_pk):
+            return False  # Already taken by a worker
+        return process_job(job_pk)
+    except Exception:
+        logger.exception("❗ Unexpected error processing enrichment job %s", job_pk, extra={"job_id": job_pk})
+        return False
+    finally:
+        request_id_var.reset(token)
+        close_old_connections()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=get_ingestion_settings()["CONCURRENCY"], thread_name_prefix="enrichment"
+                )
+    return _executor
@@ -0,0 +1,204 @@
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .lru import LRUCache, MISSING
+from .models import LandmarkCacheEntry
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "BACKEND": "location.landmark_cache.LocMemLandmarkCache",
+    "TTL": 60 * 60 * 24 * 30,        # Landmarks in a given photo do not change
+    "NEGATIVE_TTL": 60 * 60 * 24,    # "No landmark found" is retried sooner
+    "MAX_ENTRIES": 10000,
+    "CULL_EVERY": 100,               # DatabaseLandmarkCache checks MAX_ENTRIES once per this many writes
+    "CACHE_ALIAS": "default",        # Used by DjangoLandmarkCache
+    "KEY_PREFIX": "landmark",
+}
+
+
+class BaseLandmarkCache:
+    """
+    Landmark results keyed by the MD5 `image_hash` of the uploaded bytes.
+    `get()` returns MISSING on a miss and the stored result (a dict or None) on a hit,
+    so negative results are cached too.
+    """
+
+    def __init__(self, options):
+        self.ttl = options["TTL"]
+        self.negative_ttl = options["NEGATIVE_TTL"]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _count(self, result):
+        with self._lock:
+            if result is MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+                if result is None:
+                    self.negative_hits += 1
+
+    def ttl_for(self, result):
+        return self.ttl if result else self.negative_ttl
+
+    def get(self, image_hash):
+        result = self._get(image_hash)
+        self._count(result)
+        return result
+
+    def set(self, image_hash, result):
+        self._set(image_hash, result, self.ttl_for(result))
+
+    def _get(self, image_hash):
+        raise NotImplementedError
+
+    def _set(self, image_hash, result, ttl):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self).__name__,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "vision_calls_saved": self.hits,
+        }
+
+
+class LocMemLandmarkCache(BaseLandmarkCache):
+    """Per-process LRU bounded by MAX_ENTRIES; fastest, but not shared between workers."""
+
+    def __init__(self, options):
+        super().__init__(options)
+        self._lru = LRUCache(max_entries=options["MAX_ENTRIES"])
+
+    def _get(self, image_hash):
+        return self._lru.get(image_hash)
+
+    def _set(self, image_hash, result, ttl):
+        self._lru.set(image_hash, result, ttl=ttl)
+
+    def clear(self):
+        self._lru.clear()
+
+    def stats(self):
+        data = super().stats()
+        lru_stats = self._lru.stats()
+        data.update({
+            "entries": lru_stats["entries"],
+            "max_entries": lru_stats["max_entries"],
+            "evictions": lru_stats["evictions"],
+            "expirations": lru_stats["expirations"],
+        })
+        return data
+
+
+class DjangoLandmarkCache(BaseLandmarkCache):
+    """Stores results in a Django cache (`CACHES[CACHE_ALIAS]`), shared by all workers using it."""
+
+    def __init__(self, options):
+        super().__init__(options)
+        self._cache = caches[options["CACHE_ALIAS"]]
+        self.key_prefix = options["KEY_PREFIX"]
+
+    def _key(self, image_hash):
+        return f"{self.key_prefix}:{image_hash}"
+
+    def _get(self, image_hash):
+        # Wrap values so a cached negative result (None) is not mistaken for a miss
+        wrapped = self._cache.get(self._key(image_hash), MISSING)
+        return wrapped if wrapped is MISSING else wrapped["result"]
+
+    def _set(self, image_hash, result, ttl):
+        self._cache.set(self._key(image_hash), {"result": result}, timeout=ttl)
+
+    def clear(self):
+        self._cache.clear()
+
+
+class DatabaseLandmarkCache(BaseLandmarkCache):
+    """
+    Persists results in the `LandmarkCacheEntry` table so they survive restarts and deploys.
+    The size limit is enforced every CULL_EVERY writes of a process, so the table may briefly
+    hold up to CULL_EVERY rows per worker more than MAX_ENTRIES.
+    """
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.max_entries = options["MAX_ENTRIES"]
+        self.cull_every = max(options["CULL_EVERY"], 1)
+        self._writes = 0
+
+    def _get(self, image_hash):
+        entry = LandmarkCacheEntry.objects.filter(image_hash=image_hash).first()
+        if entry is None:
+            return MISSING
+        if entry.expires_at <= timezone.now():
+            entry.delete()
+            with self._lock:
+                self.evictions += 1
+            return MISSING
+        return entry.result
+
+    def _set(self, image_hash, result, ttl):
+        LandmarkCacheEntry.objects.update_or_create(
+            image_hash=image_hash,
+            defaults={"result": result, "expires_at": timezone.now() + timedelta(seconds=ttl)},
+        )
+        with self._lock:
+            self._writes += 1
+            due = self._writes % self.cull_every == 0
+        if due:
+            self._cull()
+
+    def _cull(self):
+        """Drop expired rows, then the soonest-to-expire ones, once the table exceeds MAX_ENTRIES."""
+        if LandmarkCacheEntry.objects.count() <= self.max_entries:
+            return
+        removed, _ = LandmarkCacheEntry.objects.filter(expires_at__lte=timezone.now()).delete()
+        overflow = LandmarkCacheEntry.objects.count() - self.max_entries
+        if overflow > 0:
+            stale = LandmarkCacheEntry.objects.order_by("expires_at").values_list("pk", flat=True)[:overflow]
+            extra, _ = LandmarkCacheEntry.objects.filter(pk__in=list(stale)).delete()
+            removed += extra
+        with self._lock:
+            self.evictions += removed
+
+    def clear(self):
+        LandmarkCacheEntry.objects.all().delete()
+
+    def stats(self):
+        data = super().stats()
+        data.update({"entries": LandmarkCacheEntry.objects.count(), "max_entries": self.max_entries})
+        return data
+
+
+_landmark_cache = None
+_landmark_cache_lock = threading.Lock()
+
+
+def get_landmark_cache():
+    """Return the process-wide landmark cache configured by `settings.LANDMARK_CACHE`."""
+    global _landmark_cache
+    if _landmark_cache is None:
+        with _landmark_cache_lock:
+            if _landmark_cache is None:
+                options = {**DEFAULT_SETTINGS, **getattr(settings, "LANDMARK_CACHE", {})}
+                backend = import_string(options["BACKEND"])
+                _landmark_cache = backend(options)
+                logger.info("Landmark cache backend: %s", options["BACKEND"])
+    return _landmark_cache
@@ -0,0 +1,168 @@
+"""
+Structured, non-blocking logging.
+
+* `RequestIdMiddleware` gives every request a correlation id (the incoming
+  `X-Request-ID` header, or a new one), echoed back in the response, so the
+  hash/geocode/vision/save events of one upload can be tied together.
+* `ContextFilter` stamps that id on every record; `SamplingFilter` keeps only a
+  share of records for high-volume events (`extra={"event": ...}`).
+* `QueueStreamHandler` puts records on an in-memory queue; a `QueueListener`
+  thread renders them with `JsonFormatter` and writes them, so request threads
+  never block on stdout. Forked children (preloading gunicorn workers) start
+  their own listener.
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+# Attributes every LogRecord has; anything else was passed through `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+
+def get_request_id():
+    return request_id_var.get()
+
+
+class RequestIdMiddleware:
+    header = "X-Request-ID"
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def _request_id(self, request):
+        incoming = request.headers.get(self.header, "")
+        return incoming if _VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        request_id = self._request_id(request)
+        token = request_id_var.set(request_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_id_var.reset(token)
+        response[self.header] = request_id
+        return response
+
+    async def __acall__(self, request):
+        request_id = self._request_id(request)
+        token = request_id_var.set(request_id)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_id_var.reset(token)
+        response[self.header] = request_id
+        return response
+
+
+class ContextFilter(logging.Filter):
+    """Attach the current request's correlation id (or None outside a request)."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep a `rates[event]` share of records whose `event` is listed; everything else,
+    and anything at WARNING or above, always passes.
+    """
+
+    def __init__(self, rates=None, name=""):
+        super().__init__(name)
+        self.rates = rates or {}
+
+    def filter(self, record):
+        rate = self.rates.get(getattr(record, "event", None))
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        return random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, logger, message, request id and any `extra` fields."""
+
+    def format(self, record):
+        payload = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        payload.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES})
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+class QueueStreamHandler(QueueHandler):
+    """
+    Enqueue records and write them from a background `QueueListener` thread.
+    Only the message interpolation happens on the calling thread; JSON encoding
+    and the stream write happen on the listener.
+    """
+
+    def __init__(self, stream=None, formatter=None, max_size=10000):
+        super().__init__(queue.Queue(max_size))
+        target = logging.StreamHandler(stream or sys.stderr)
+        target.setFormatter(formatter or JsonFormatter())
+        self.target = target
+        self.dropped = 0
+        self._start_listener()
+        atexit.register(lambda: self.listener.stop())
+        # The listener thread does not survive a fork (gunicorn `preload_app` configures logging in the master)
+        os.register_at_fork(after_in_child=self._restart_after_fork)
+
+    def _start_listener(self):
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+
+    def _restart_after_fork(self):
+        # A fresh queue too: the parent's listener may have held its lock at the fork, and its records are the parent's
+        self.queue = queue.Queue(self.queue.maxsize)
+        self._start_listener()
+
+    def setFormatter(self, fmt):
+        # dictConfig assigns the configured formatter here; it belongs to the writing handler
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Resolve everything that could change or is not safe to hand to another thread
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1  # Never block a request thread on a backed-up log writer
@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from location.models import LocationImage
+from location.preprocess import generate_derivatives, get_preprocessing_settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _generate(pk):
+    close_old_connections()
+    try:
+        generate_derivatives(pk)
+        return True
+    except Exception as e:
+        logger.error("❗ Derivative generation failed for Image ID %s: %s", pk, e)
+        return False
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = "Generate display-size derivatives and thumbnails for existing images."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help="Rows fetched per batch.")
+        parser.add_argument('--workers', type=int, default=get_preprocessing_settings()["WORKERS"])
+        parser.add_argument('--all', action='store_true', help="Also regenerate rows that already have a thumbnail.")
+
+    def handle(self, *args, **options):
+        queryset = LocationImage.objects.order_by('pk')
+        if not options['all']:
+            queryset = queryset.filter(thumbnail__isnull=True)
+
+        processed = failed = 0
+        last_pk = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                pks = list(queryset.filter(pk__gt=last_pk).values_list('pk', flat=True)[:options['batch_size']])
+                if not pks:
+                    break
+                last_pk = pks[-1]
+                for ok in executor.map(_generate, pks):
+                    processed += ok
+                    failed += not ok
+                self.stdout.write(f"Generated derivatives for {processed} images (last ID {last_pk})")
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Derivative backfill complete: {processed} updated, {failed} failed."))
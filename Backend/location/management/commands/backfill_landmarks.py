@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from location.models import LocationImage
+from location.response_cache import invalidate_images
+from location.routing import ROUTE_FIELDS, travel_fields
+from location.serializers import detect_landmark, haversine, landmark_fields
+import logging
+
+logger = logging.getLogger(__name__)
+
+LANDMARK_COLUMNS = ['landmark_name', 'landmark_confidence', 'landmark_lat', 'landmark_lng', 'landmark_geohash', 'landmark_detected_at', 'distance_km', *ROUTE_FIELDS]
+
+
+class Command(BaseCommand):
+    help = "Run landmark detection once for existing images and store the results on each row."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Rows fetched and updated per batch.")
+        parser.add_argument('--all', action='store_true', help="Also reprocess rows that already have stored results (served from the landmark cache when possible).")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = LocationImage.objects.order_by('pk')
+        if not options['all']:
+            queryset = queryset.filter(landmark_detected_at__isnull=True)
+
+        processed = failed = 0
+        last_pk = 0
+        while True:
+            # Keyset over the primary key so each batch is a cheap indexed range scan
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            updated = []
+            for instance in batch:
+                try:
+                    landmark_data = detect_landmark(instance.image, instance.image_hash)
+                except Exception as e:
+                    failed += 1
+                    logger.error("❗ Landmark backfill failed for Image ID %s: %s", instance.pk, e)
+                    continue
+
+                for field, value in landmark_fields(landmark_data).items():
+                    setattr(instance, field, value)
+                if not landmark_data:
+                    instance.distance_km = 0.0  # Same default as `create()` when no landmark is found
+                elif instance.latitude is not None and instance.longitude is not None:
+                    instance.distance_km = haversine(
+                        instance.latitude, instance.longitude,
+                        landmark_data['landmark_lat'], landmark_data['landmark_lng']
+                    )
+                if instance.latitude is not None and instance.longitude is not None:
+                    route = travel_fields(instance.latitude, instance.longitude, instance.landmark_lat, instance.landmark_lng)
+                    for field, value in route.items():
+                        setattr(instance, field, value)
+                updated.append(instance)
+
+            LocationImage.objects.bulk_update(updated, LANDMARK_COLUMNS)
+            invalidate_images([instance.pk for instance in updated])
+            processed += len(updated)
+            self.stdout.write(f"Backfilled {processed} images (last ID {last_pk})")
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Backfill complete: {processed} updated, {failed} failed."))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from location.models import LocationImage
+from location.phash import dhash, stamp_hash
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Compute the perceptual hash of existing images so they can be matched as near-duplicates."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help="Rows fetched and updated per batch.")
+
+    def handle(self, *args, **options):
+        queryset = LocationImage.objects.filter(perceptual_hash__isnull=True).order_by('pk').only('pk', 'image')
+
+        processed = failed = 0
+        last_pk = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            updated = []
+            for instance in batch:
+                try:
+                    with instance.image.open('rb') as image_file:
+                        stamp_hash(instance, dhash(image_file))
+                except Exception as e:
+                    failed += 1
+                    logger.error("❗ Perceptual hash failed for Image ID %s: %s", instance.pk, e)
+                    continue
+                updated.append(instance)
+
+            LocationImage.objects.bulk_update(updated, ['perceptual_hash', 'perceptual_hashed_at'])
+            processed += len(updated)
+            self.stdout.write(f"Hashed {processed} images (last ID {last_pk})")
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Perceptual hash backfill complete: {processed} updated, {failed} failed."))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from location.models import LocationImage
+from location.response_cache import invalidate_images
+from location.routing import ROUTE_FIELDS, get_router, travel_fields_many
+
+
+class Command(BaseCommand):
+    help = "Compute road distance, travel time and cost for stored images from the offline road graph."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows fetched and updated per batch.")
+        parser.add_argument('--all', action='store_true', help="Also recompute rows that already have a route (e.g. after a graph or cost change).")
+
+    def handle(self, *args, **options):
+        if get_router() is None:
+            raise CommandError("No road graph is loaded; set LOCATION_ROUTING['GRAPH_DIR'] (see build_road_graph).")
+
+        queryset = LocationImage.objects.filter(
+            latitude__isnull=False, longitude__isnull=False, landmark_lat__isnull=False, landmark_lng__isnull=False,
+        ).only('id', 'latitude', 'longitude', 'landmark_lat', 'landmark_lng', *ROUTE_FIELDS).order_by('pk')
+        if not options['all']:
+            queryset = queryset.filter(road_distance_km__isnull=True)
+
+        processed = routed = searches = 0
+        last_pk = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            # One one-to-many search per home location in the batch
+            by_home = {}
+            for instance in batch:
+                by_home.setdefault((instance.latitude, instance.longitude), []).append(instance)
+            for (lat, lng), group in by_home.items():
+                landmarks = [(instance.landmark_lat, instance.landmark_lng) for instance in group]
+                for instance, fields in zip(group, travel_fields_many(lat, lng, landmarks)):
+                    for field, value in fields.items():
+                        setattr(instance, field, value)
+                    routed += fields['road_distance_km'] is not None
+            searches += len(by_home)
+
+            LocationImage.objects.bulk_update(batch, list(ROUTE_FIELDS))
+            invalidate_images([instance.pk for instance in batch])
+            processed += len(batch)
+            self.stdout.write(f"Routed {processed} images (last ID {last_pk})")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Route backfill complete: {processed} images, {routed} with a route, {searches} searches."
+        ))
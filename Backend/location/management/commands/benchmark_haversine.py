@@ -0,0 +1,44 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from location.distance import haversine_km, haversine_matrix, haversine_pairs
+
+
+class Command(BaseCommand):
+    help = "Compare the scalar haversine loop with the vectorized NumPy implementation."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pairs', type=int, default=1_000_000, help="Number of coordinate pairs.")
+        parser.add_argument('--matrix', type=int, default=2000, help="Side of the M×N matrix benchmark (0 to skip).")
+        parser.add_argument('--chunk-size', type=int, default=256, help="Row chunk for the matrix benchmark.")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        n = options['pairs']
+        lats1, lats2 = rng.uniform(-90, 90, n), rng.uniform(-90, 90, n)
+        lons1, lons2 = rng.uniform(-180, 180, n), rng.uniform(-180, 180, n)
+
+        start = time.perf_counter()
+        scalar = [haversine_km(a, b, c, d) for a, b, c, d in zip(lats1.tolist(), lons1.tolist(), lats2.tolist(), lons2.tolist())]
+        scalar_seconds = time.perf_counter() - start
+
+        results = {}
+        for dtype in (np.float64, np.float32):
+            start = time.perf_counter()
+            vector = haversine_pairs(lats1, lons1, lats2, lons2, dtype=dtype)
+            results[dtype] = (time.perf_counter() - start, float(np.max(np.abs(vector - np.asarray(scalar)))))
+
+        self.stdout.write(f"{n:,} pairs")
+        self.stdout.write(f"  scalar loop      {scalar_seconds:8.3f}s")
+        for dtype, (seconds, error) in results.items():
+            self.stdout.write(
+                f"  numpy {np.dtype(dtype).name:<10} {seconds:8.3f}s  "
+                f"({scalar_seconds / seconds:6.1f}x)  max abs error {error:.2e} km"
+            )
+
+        m = options['matrix']
+        if m:
+            start = time.perf_counter()
+            haversine_matrix(lats1[:m], lons1[:m], lats2[:m], lons2[:m], chunk_size=options['chunk_size'])
+            self.stdout.write(f"  {m}x{m} matrix (chunk {options['chunk_size']})  {time.perf_counter() - start:8.3f}s")
@@ -0,0 +1,37 @@
+import json
+import numpy as np
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Write a synthetic gazetteer (addresses and landmarks) for the offline GazetteerProvider."
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Destination .json path.")
+        parser.add_argument('--addresses', type=int, default=100_000)
+        parser.add_argument('--landmarks', type=int, default=10_000)
+        parser.add_argument('--center', type=float, nargs=2, default=(43.6532, -79.3832), metavar=('LAT', 'LNG'))
+        parser.add_argument('--spread', type=float, default=0.5, help="Half-width of the area in degrees.")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        lat0, lng0 = options['center']
+        spread = options['spread']
+
+        def points(n):
+            return np.column_stack((
+                np.round(lat0 + rng.uniform(-spread, spread, n), 6),
+                np.round(lng0 + rng.uniform(-spread, spread, n), 6),
+            )).tolist()
+
+        streets = ["Yonge St", "Bloor St W", "Queen St E", "King St W", "Dundas St W", "Bathurst St", "Spadina Ave", "Eglinton Ave E"]
+        addresses = [
+            [f"{i // len(streets) + 1} {streets[i % len(streets)]}, Toronto, ON", lat, lng]
+            for i, (lat, lng) in enumerate(points(options['addresses']))
+        ]
+        landmarks = [[f"Landmark {i}", lat, lng] for i, (lat, lng) in enumerate(points(options['landmarks']))]
+
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump({"addresses": addresses, "landmarks": landmarks}, f)
+        self.stdout.write(self.style.SUCCESS(f"✅ Wrote {len(addresses)} addresses and {len(landmarks)} landmarks to {options['output']}."))
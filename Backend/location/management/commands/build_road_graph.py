@@ -0,0 +1,154 @@
+import bz2
+import gzip
+import re
+import xml.etree.ElementTree as ET
+from django.core.management.base import BaseCommand, CommandError
+from location.distance import haversine_km
+from location.routing import DEFAULT_CELL_DEG, DEFAULT_LANDMARKS, write_graph
+
+# Default speeds (km/h) for routable `highway=*` ways without a usable `maxspeed`
+HIGHWAY_SPEEDS = {
+    "motorway": 100, "motorway_link": 60,
+    "trunk": 80, "trunk_link": 50,
+    "primary": 60, "primary_link": 50,
+    "secondary": 50, "secondary_link": 40,
+    "tertiary": 40, "tertiary_link": 30,
+    "unclassified": 30, "residential": 30, "road": 30,
+    "living_street": 10, "service": 15,
+}
+IMPLIED_ONEWAY = {"motorway", "motorway_link"}
+
+_MAXSPEED = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(mph)?\s*$")
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def _speed(tags):
+    match = _MAXSPEED.match(tags.get("maxspeed", ""))
+    if match:
+        speed = float(match.group(1)) * (1.609344 if match.group(2) else 1)
+        if speed > 0:
+            return speed
+    return HIGHWAY_SPEEDS[tags["highway"]]
+
+
+def _direction(tags):
+    """1: forward only, -1: backward only, 0: both ways."""
+    oneway = tags.get("oneway", "")
+    if oneway in ("yes", "true", "1"):
+        return 1
+    if oneway in ("-1", "reverse"):
+        return -1
+    if oneway == "no":
+        return 0
+    return 1 if tags["highway"] in IMPLIED_ONEWAY or tags.get("junction") == "roundabout" else 0
+
+
+class Command(BaseCommand):
+    help = "Build the memory-mapped road graph used for offline routing from an OSM XML extract (.osm, .osm.gz, .osm.bz2)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="OSM XML extract.")
+        parser.add_argument('output', help="Graph directory (set LOCATION_ROUTING['GRAPH_DIR'] to it).")
+        parser.add_argument('--cell-deg', type=float, default=DEFAULT_CELL_DEG, help="Cell size of the snapping grid in degrees.")
+        parser.add_argument('--landmarks', type=int, default=DEFAULT_LANDMARKS,
+                            help="ALT landmarks precomputed to speed up A* (one forward and one backward search each; 0 disables).")
+
+    def handle(self, *args, **options):
+        ways = self._read_ways(options['input'])
+        if not ways:
+            raise CommandError("The extract contains no routable highway ways.")
+        coordinates = self._read_nodes(options['input'], {ref for refs, *_ in ways for ref in refs})
+
+        # Split ways where the extract lacks a node's coordinates (clipped at its boundary)
+        runs = []
+        for refs, speed, direction, toll in ways:
+            run = []
+            for ref in refs + [None]:
+                if ref in coordinates:
+                    run.append(ref)
+                    continue
+                if len(run) > 1:
+                    runs.append((run, speed, direction, toll))
+                run = []
+
+        # Only intersections and dead ends become graph nodes; the nodes in between only shape edge lengths
+        uses = {}
+        for run, *_ in runs:
+            for ref in run:
+                uses[ref] = uses.get(ref, 0) + 1
+        node_ids = {}
+        for run, *_ in runs:
+            for ref in (run[0], run[-1]):
+                node_ids.setdefault(ref, len(node_ids))
+        for ref, count in uses.items():
+            if count > 1:
+                node_ids.setdefault(ref, len(node_ids))
+
+        sources, targets, lengths, times, tolls = [], [], [], [], []
+        for run, speed, direction, toll in runs:
+            start, length = run[0], 0.0
+            previous = coordinates[start]
+            for ref in run[1:]:
+                point = coordinates[ref]
+                length += haversine_km(*previous, *point) * 1000
+                previous = point
+                if ref not in node_ids:
+                    continue
+                if ref != start:
+                    seconds = length / (speed / 3.6)
+                    for u, v, allowed in ((start, ref, direction >= 0), (ref, start, direction <= 0)):
+                        if allowed:
+                            sources.append(node_ids[u])
+                            targets.append(node_ids[v])
+                            lengths.append(length)
+                            times.append(seconds)
+                            tolls.append(toll)
+                start, length = ref, 0.0
+
+        node_lat = [0.0] * len(node_ids)
+        node_lng = [0.0] * len(node_ids)
+        for ref, index in node_ids.items():
+            node_lat[index], node_lng[index] = coordinates[ref]
+
+        meta = write_graph(options['output'], node_lat, node_lng, sources, targets, lengths, times, tolls,
+                           cell_deg=options['cell_deg'], landmarks=options['landmarks'], source=options['input'])
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Road graph written to {options['output']}: {meta['nodes']} nodes, {meta['edges']} edges "
+            f"(from {len(ways)} ways, {len(coordinates)} OSM nodes)."
+        ))
+
+    def _read_ways(self, path):
+        """[(node refs, speed km/h, direction, toll)] for every routable way."""
+        ways = []
+        with _open(path) as source:
+            for _, element in ET.iterparse(source):
+                if element.tag == "way":
+                    tags = {tag.get("k"): tag.get("v") for tag in element.iter("tag")}
+                    if tags.get("highway") in HIGHWAY_SPEEDS and tags.get("access") not in ("no", "private"):
+                        refs = [int(nd.get("ref")) for nd in element.iter("nd")]
+                        if len(refs) > 1:
+                            ways.append((refs, _speed(tags), _direction(tags), tags.get("toll") == "yes"))
+                if element.tag in ("node", "way", "relation"):
+                    element.clear()
+        return ways
+
+    def _read_nodes(self, path, wanted):
+        """{node id: (lat, lng)} for the nodes in `wanted`."""
+        coordinates = {}
+        with _open(path) as source:
+            for _, element in ET.iterparse(source):
+                if element.tag == "node":
+                    ref = int(element.get("id"))
+                    if ref in wanted:
+                        coordinates[ref] = (float(element.get("lat")), float(element.get("lon")))
+                    element.clear()
+                elif element.tag in ("way", "relation"):
+                    element.clear()
+        return coordinates
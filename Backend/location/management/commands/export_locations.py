@@ -0,0 +1,29 @@
+import sys
+from django.core.management.base import BaseCommand
+from location.export import FORMATS, get_export_settings, stream_export
+
+
+class Command(BaseCommand):
+    help = "Stream every location record as NDJSON or CSV to a file or stdout."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS), default='ndjson')
+        parser.add_argument('--output', '-o', help="Destination path (default: stdout).")
+        parser.add_argument('--gzip', action='store_true', help="Gzip-compress the output.")
+        parser.add_argument('--chunk-size', type=int, default=get_export_settings()["CHUNK_SIZE"],
+                            help="Rows fetched per round trip from the database cursor.")
+
+    def handle(self, *args, **options):
+        stream = stream_export(options['format'], compress=options['gzip'], chunk_size=options['chunk_size'])
+        if not options['output']:
+            for block in stream:
+                sys.stdout.buffer.write(block)
+            sys.stdout.buffer.flush()
+            return
+
+        written = 0
+        with open(options['output'], 'wb') as destination:
+            for block in stream:
+                destination.write(block)
+                written += len(block)
+        self.stderr.write(self.style.SUCCESS(f"✅ Exported to {options['output']} ({written} bytes)."))
@@ -0,0 +1,103 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.db.models import Q
+from location.models import LocationImage
+from location.purge import FILE_FIELDS
+from location.response_cache import invalidate_images
+from location.storage import ContentAddressedStorage, get_storage_settings, is_content_addressed
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Migration:
+    """Move one batch of legacy files into the content-addressed layout; counters are shared by the workers."""
+
+    def __init__(self, storage, dry_run):
+        self.storage = storage
+        self.dry_run = dry_run
+        self.counts = {"moved": 0, "missing": 0, "changed": 0, "failed": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def move(self, task):
+        pk, field_name, old_name = task
+        close_old_connections()
+        try:
+            if not self.storage.exists(old_name):
+                self._count("missing")
+                return
+            if self.dry_run:
+                self._count("moved")
+                return
+
+            field = LocationImage._meta.get_field(field_name)
+            # Only the directory and extension of this name are used; the storage picks the file name
+            suggested = field.generate_filename(None, os.path.basename(old_name))
+            with self.storage.open(old_name, 'rb') as source:
+                new_name = self.storage.save(suggested, source)
+
+            # Re-point the row only if it still references the old file
+            if not LocationImage.objects.filter(pk=pk, **{field_name: old_name}).update(**{field_name: new_name}):
+                self.storage.delete(new_name)
+                self._count("changed")
+                return
+            invalidate_images([pk])  # List pages link the thumbnail by its file name
+            still_used = Q()
+            for name in FILE_FIELDS:
+                still_used |= Q(**{name: old_name})
+            if not LocationImage.objects.filter(still_used).exists():
+                self.storage.delete(old_name)
+            self._count("moved")
+        except Exception as e:
+            logger.error("❗ Could not move %s of Image ID %s: %s", old_name, pk, e)
+            self._count("failed")
+        finally:
+            close_old_connections()
+
+
+class Command(BaseCommand):
+    help = "Move stored images and derivatives into the content-addressed, sharded media layout."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows fetched per batch.")
+        parser.add_argument('--workers', type=int, default=get_storage_settings()["MIGRATION_WORKERS"])
+        parser.add_argument('--dry-run', action='store_true', help="Only count the files that would be moved.")
+
+    def handle(self, *args, **options):
+        storage = LocationImage._meta.get_field('image').storage
+        if not isinstance(storage, ContentAddressedStorage):
+            raise CommandError("The default storage is not location.storage.ContentAddressedStorage; see STORAGES.")
+
+        migration = Migration(storage, options['dry_run'])
+        last_pk = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                rows = list(
+                    LocationImage.objects.filter(pk__gt=last_pk).order_by('pk')
+                    .values_list('pk', *FILE_FIELDS)[:options['batch_size']]
+                )
+                if not rows:
+                    break
+                last_pk = rows[-1][0]
+                tasks = [
+                    (row[0], field_name, name)
+                    for row in rows
+                    for field_name, name in zip(FILE_FIELDS, row[1:])
+                    if name and not is_content_addressed(name)
+                ]
+                list(executor.map(migration.move, tasks))
+                self.stdout.write(f"Processed rows up to ID {last_pk}: {migration.counts}")
+
+        verb = "would be moved" if options['dry_run'] else "moved"
+        counts = migration.counts
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Media migration complete: {counts['moved']} files {verb}, {counts['missing']} missing, "
+            f"{counts['changed']} skipped (row changed), {counts['failed']} failed."
+        ))
@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from location.purge import can_truncate, get_purge_settings, purge_all
+
+
+class Command(BaseCommand):
+    help = "Delete every location image row and its uploaded file, in batches (or TRUNCATE)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=get_purge_settings()["BATCH_SIZE"])
+        parser.add_argument('--truncate', action='store_true', help="Use TRUNCATE (PostgreSQL, requires LOCATION_PURGE['ALLOW_TRUNCATE']).")
+        parser.add_argument('--yes', action='store_true', help="Do not ask for confirmation.")
+
+    def handle(self, *args, **options):
+        if not options['yes'] and input("Delete ALL location images and files? [y/N] ").lower() != 'y':
+            self.stdout.write("Aborted.")
+            return
+        if options['truncate'] and not can_truncate():
+            self.stdout.write(self.style.WARNING("TRUNCATE not available here; deleting in batches."))
+
+        report = purge_all(truncate=options['truncate'], batch_size=options['batch_size'])
+        self.stdout.write(f"Deleted {report.rows_deleted} rows in {report.batches} batches; removing {report.files_total} files...")
+        while report.finished_at is None:
+            time.sleep(0.5)
+        result = report.as_dict()
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Purge complete: {result['files_deleted']} files deleted, "
+            f"{result['files_missing']} already missing, {result['files_failed']} failed."
+        ))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from location.startup import get_import_time_settings, measure_startup
+
+
+class Command(BaseCommand):
+    help = "Measure startup import time (`django.setup()` plus the URLconf) in fresh interpreters and check it against IMPORT_TIME."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, help="Fresh interpreters measured (default IMPORT_TIME['RUNS']).")
+        parser.add_argument('--budget-ms', type=float, help="Override IMPORT_TIME['BUDGET_MS'].")
+        parser.add_argument('--top', type=int, default=15, help="Packages and modules listed.")
+        parser.add_argument('--module', help="Module imported after `django.setup()` (default ROOT_URLCONF).")
+        parser.add_argument('--check', action='store_true',
+                            help="Fail when the median exceeds the budget or a deferred module is imported at startup.")
+
+    def handle(self, *args, **options):
+        config = get_import_time_settings()
+        budget = options['budget_ms'] or config['BUDGET_MS']
+        try:
+            median, report = measure_startup(options['runs'] or config['RUNS'], options['module'])
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        top = options['top']
+        self.stdout.write(f"Startup: {median:.0f} ms median wall time (budget {budget:.0f} ms), "
+                          f"{len(report.modules)} modules, {report.total_ms:.0f} ms in module bodies")
+        self.stdout.write("\nSlowest packages (self time):")
+        for package, ms in report.by_package()[:top]:
+            self.stdout.write(f"  {ms:8.1f} ms  {package}")
+        self.stdout.write("\nSlowest top-level imports (cumulative):")
+        for module, ms in report.slowest()[:top]:
+            self.stdout.write(f"  {ms:8.1f} ms  {module}")
+
+        eager = [module for module in config['DEFERRED_MODULES'] if report.loaded(module)]
+        if eager:
+            self.stdout.write(self.style.WARNING(f"\n⚠️ Imported at startup but meant to be deferred: {', '.join(eager)}"))
+
+        if options['check']:
+            if median > budget:
+                raise CommandError(f"Startup import time {median:.0f} ms exceeds the {budget:.0f} ms budget.")
+            if eager:
+                raise CommandError(f"Deferred modules imported at startup: {', '.join(eager)}")
+        self.stdout.write(self.style.SUCCESS(f"\n✅ Startup import time {median:.0f} ms"))
@@ -0,0 +1,65 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from location.benchmarks import compare_results, run_benchmarks
+
+SCENARIOS = ['upload', 'reads', 'duplicates', 'haversine', 'hash']
+
+
+def _size(value):
+    width, _, height = value.partition('x')
+    return [int(width), int(height or width)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark uploads, list/detail reads, the duplicate query, haversine and image hashing "
+        "against a throw-away test database (SQLite or PostgreSQL) with Google replaced by the "
+        "offline gazetteer provider. Writes p50/p95/p99, throughput and peak RSS as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', default='benchmark-results.json')
+        parser.add_argument('--compare', metavar='BASELINE', help="Compare with an earlier results file; exits non-zero on regressions.")
+        parser.add_argument('--tolerance', type=float, default=0.10, help="Allowed relative p95 slowdown when comparing.")
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+        parser.add_argument('--table-sizes', type=int, nargs='+', default=[1000, 10000])
+        parser.add_argument('--uploads', type=int, default=50, help="Single uploads to time.")
+        parser.add_argument('--batches', type=int, default=5, help="Batch uploads to time.")
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--upload-size', type=_size, default=[1600, 1200], help="Upload dimensions, WIDTHxHEIGHT.")
+        parser.add_argument('--reads', type=int, default=200, help="Requests/queries per read scenario.")
+        parser.add_argument('--hash-sizes', type=_size, nargs='+', default=[[640, 480], [1600, 1200], [4000, 3000]])
+        parser.add_argument('--hash-iterations', type=int, default=50)
+        parser.add_argument('--haversine-points', type=int, default=100_000)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep-db', action='store_true', help="Reuse the test database between runs.")
+
+    def handle(self, *args, **options):
+        settings_keys = [
+            'scenarios', 'table_sizes', 'uploads', 'batches', 'batch_size', 'upload_size', 'reads',
+            'hash_sizes', 'hash_iterations', 'haversine_points', 'warmup', 'seed', 'keep_db',
+        ]
+        report = run_benchmarks({key: options[key] for key in settings_keys}, progress=lambda message: self.stderr.write(f"… {message}"))
+
+        self.stdout.write(f"{'scenario':<24} {'params':<34} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>10} {'RSS MB':>8}")
+        for result in report["results"]:
+            params = json.dumps(result["params"], separators=(',', ':'))
+            self.stdout.write(
+                f"{result['name']:<24} {params:<34} {result['p50_ms']:>9.3f} {result['p95_ms']:>9.3f} "
+                f"{result['p99_ms']:>9.3f} {result['throughput_per_s']:>10.1f} {result['peak_rss_mb']:>8.1f}"
+            )
+
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"✅ Results written to {options['output']}"))
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)
+            rows, regressed = compare_results(baseline, report, tolerance=options['tolerance'])
+            for name, params, old, new, change in rows:
+                marker = "❗" if change > options['tolerance'] else "  "
+                self.stdout.write(f"{marker} {name:<24} {json.dumps(params):<34} p95 {old:9.3f} → {new:9.3f} ms ({change:+.1%})")
+            if regressed:
+                raise CommandError(f"{len(regressed)} scenario(s) regressed by more than {options['tolerance']:.0%} (p95).")
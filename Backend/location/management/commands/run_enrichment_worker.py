@@ -0,0 +1,32 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from location.jobs import get_ingestion_settings, requeue_stale_jobs, run_batch
+
+
+class Command(BaseCommand):
+    help = "Process queued async-upload enrichment jobs (geocoding, landmark detection, distance)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=None, help="Worker threads (default: LOCATION_INGESTION['CONCURRENCY']).")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to sleep when the queue is empty.")
+        parser.add_argument('--once', action='store_true', help="Drain the queue once and exit.")
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency'] or get_ingestion_settings()["CONCURRENCY"]
+        self.stdout.write(f"Enrichment worker started with concurrency {concurrency}")
+
+        processed = 0
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="enrichment") as executor:
+            requeue_stale_jobs()
+            while True:
+                count = run_batch(executor, limit=concurrency * 2)
+                processed += count
+                if count:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                requeue_stale_jobs()
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Processed {processed} enrichment jobs."))
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('location', '0002_alter_locationimage_unique_together_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='locationimage',
+            name='landmark_confidence',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='locationimage',
+            name='landmark_detected_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='locationimage',
+            name='landmark_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='locationimage',
+            name='landmark_lng',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='locationimage',
+            name='landmark_name',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
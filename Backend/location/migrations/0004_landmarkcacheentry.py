@@ -0,0 +1,21 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('location', '0003_locationimage_landmark_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LandmarkCacheEntry',
+            fields=[
+                ('image_hash', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:21
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def delete_duplicate_images(apps, schema_editor):
+    """Keep the oldest row for each image_hash so the unique constraint can be created."""
+    LocationImage = apps.get_model('location', 'LocationImage')
+    duplicates = (
+        LocationImage.objects.filter(image_hash__isnull=False)
+        .values('image_hash')
+        .annotate(rows=Count('id'), keep_id=Min('id'))
+        .filter(rows__gt=1)
+    )
+    for group in duplicates.iterator():
+        extra = LocationImage.objects.filter(image_hash=group['image_hash']).exclude(id=group['keep_id'])
+        kept_names = set(LocationImage.objects.filter(id=group['keep_id']).values_list('image', flat=True))
+        for row in extra:
+            if row.image and row.image.name not in kept_names:
+                row.image.delete(save=False)
+        extra.delete()
+
+
+class Migration(migrations.Migration):
+    # The dedupe deletes rows referenced by EnrichmentJob's deferred FK; PostgreSQL refuses to create
+    # the index while those trigger events are pending, so the dedupe commits in its own transaction first
+    atomic = False
+
+    dependencies = [
+        ('location', '0006_enrichment_queue'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_images, migrations.RunPython.noop, atomic=True),
+        migrations.AddConstraint(
+            model_name='locationimage',
+            constraint=models.UniqueConstraint(condition=models.Q(('image_hash__isnull', False)), fields=('image_hash',), name='unique_location_image_hash'),
+        ),
+    ]
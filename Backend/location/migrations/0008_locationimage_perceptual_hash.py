@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('location', '0007_unique_image_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='locationimage',
+            name='perceptual_hash',
+            field=models.CharField(blank=True, max_length=16, null=True),
+        ),
+        migrations.AddField(
+            model_name='locationimage',
+            name='perceptual_hashed_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:25
+
+from django.db import migrations, models
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(lat, lng, precision):
+    """Standard base-32 geohash of a point (frozen copy of `location.spatial.geohash_encode`)."""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, coord = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if coord >= mid:
+            value = (value << 1) | 1
+            rng[0] = mid
+        else:
+            value <<= 1
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+def fill_landmark_geohash(apps, schema_editor):
+    LocationImage = apps.get_model('location', 'LocationImage')
+    rows = LocationImage.objects.filter(landmark_lat__isnull=False, landmark_lng__isnull=False).only('id', 'landmark_lat', 'landmark_lng')
+    batch = []
+    for row in rows.iterator(chunk_size=2000):
+        row.landmark_geohash = geohash_encode(row.landmark_lat, row.landmark_lng, precision=9)
+        batch.append(row)
+        if len(batch) >= 2000:
+            LocationImage.objects.bulk_update(batch, ['landmark_geohash'])
+            batch = []
+    LocationImage.objects.bulk_update(batch, ['landmark_geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('location', '0008_locationimage_perceptual_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='locationimage',
+            name='landmark_geohash',
+            field=models.CharField(blank=True, db_index=True, max_length=12, null=True),
+        ),
+        migrations.AlterField(
+            model_name='locationimage',
+            name='landmark_detected_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(fill_landmark_geohash, migrations.RunPython.noop),
+    ]
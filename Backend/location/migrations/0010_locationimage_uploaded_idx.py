@@ -0,0 +1,17 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('location', '0009_locationimage_landmark_geohash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='locationimage',
+            index=models.Index(fields=['uploaded_at', 'id'], name='location_image_uploaded_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:30
+
+import location.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('location', '0010_locationimage_uploaded_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='locationimage',
+            name='display_image',
+            field=models.ImageField(blank=True, null=True, upload_to=location.models.display_upload_to),
+        ),
+        migrations.AddField(
+            model_name='locationimage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to=location.models.thumbnail_upload_to),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 17:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('location', '0011_locationimage_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='locationimage',
+            name='road_distance_km',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='locationimage',
+            name='travel_cost',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='locationimage',
+            name='travel_time_min',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
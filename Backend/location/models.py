@@ -1,20 +1,69 @@
 import hashlib
 from django.db import models
+from .instrumentation import timed
 
 def upload_to(instance, filename):
-    "Define image upload path"
+    "Define image upload path (the storage names the file by its content hash)"
     return f'uploads/{filename}'
 
+def display_upload_to(instance, filename):
+    "Define display derivative path"
+    return f'uploads/display/{filename}'
+
+def thumbnail_upload_to(instance, filename):
+    "Define thumbnail path"
+    return f'uploads/thumbnails/{filename}'
+
 class LocationImage(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
     id = models.AutoField(primary_key=True)
     image = models.ImageField(upload_to=upload_to)
+    display_image = models.ImageField(upload_to=display_upload_to, blank=True, null=True)  #  Oriented, downscaled derivative (WebP/JPEG)
+    thumbnail = models.ImageField(upload_to=thumbnail_upload_to, blank=True, null=True)  #  Served by list views
     uploaded_at = models.DateTimeField(auto_now_add=True)
     image_hash = models.CharField(max_length=64, blank=True, null=True)  #  For duplicate detection
+    perceptual_hash = models.CharField(max_length=16, blank=True, null=True)  #  64-bit dHash (hex) for near-duplicate detection
+    perceptual_hashed_at = models.DateTimeField(blank=True, null=True, db_index=True)  #  Last `perceptual_hash` write; the near-duplicate index refreshes from it
     home_address = models.CharField(max_length=255, blank=True, null=True)
     latitude = models.FloatField(blank=True, null=True)
     longitude = models.FloatField(blank=True, null=True)
     distance_km = models.FloatField(blank=True, null=True)
+    # Road route home → landmark (see location/routing.py); NULL without a landmark, a road graph or a route
+    road_distance_km = models.FloatField(blank=True, null=True)
+    travel_time_min = models.FloatField(blank=True, null=True)
+    travel_cost = models.FloatField(blank=True, null=True)
+    # Landmark detection results, stored once so reads never hit Vision
+    landmark_name = models.CharField(max_length=255, blank=True, null=True)
+    landmark_confidence = models.FloatField(blank=True, null=True)
+    landmark_lat = models.FloatField(blank=True, null=True)
+    landmark_lng = models.FloatField(blank=True, null=True)
+    landmark_geohash = models.CharField(max_length=12, blank=True, null=True, db_index=True)  #  Coarse spatial filter for radius queries
+    landmark_detected_at = models.DateTimeField(blank=True, null=True, db_index=True)  #  NULL = detection not run yet; the spatial index refreshes from it
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_DONE)  #  Enrichment state for async uploads
 
+    class Meta:
+        constraints = [
+            # Unique (and therefore indexed) content hash; rows without a hash are not constrained
+            models.UniqueConstraint(
+                fields=['image_hash'],
+                condition=models.Q(image_hash__isnull=False),
+                name='unique_location_image_hash',
+            ),
+        ]
+        # Keyset pagination of the list endpoint walks this index
+        indexes = [models.Index(fields=['uploaded_at', 'id'], name='location_image_uploaded_idx')]
+
+    @timed("image_hash")
     def calculate_image_hash(self):
         """Compute MD5 hash of the image."""
         if not self.image:
@@ -33,4 +82,54 @@ class LocationImage(models.Model):
         super().save(*args, **kwargs)
 
     def __str__(self):
-        return f"Image {self.id} - {self.image.name}"
\ No newline at end of file
+        return f"Image {self.id} - {self.image.name}"
+
+class LandmarkCacheEntry(models.Model):
+    """Cached Vision landmark result for one image content hash (`result` is NULL when no landmark was found)."""
+    image_hash = models.CharField(max_length=64, primary_key=True)
+    result = models.JSONField(blank=True, null=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Landmark cache {self.image_hash}"
+
+
+class GeocodedAddress(models.Model):
+    """Geocoding API result for one normalized address, so repeated addresses skip the HTTP call."""
+    normalized_address = models.CharField(max_length=255, unique=True)
+    address = models.CharField(max_length=255)  #  Last raw address geocoded for this key
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.normalized_address} ({self.latitude}, {self.longitude})"
+
+
+class EnrichmentJob(models.Model):
+    """DB-backed queue entry: geocode + landmark detection + distance for one async upload."""
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    image = models.OneToOneField(LocationImage, on_delete=models.CASCADE, related_name='enrichment_job')
+    home_address = models.CharField(max_length=255)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    available_at = models.DateTimeField()  #  Not claimed before this time (retry backoff)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'available_at'], name='enrichment_job_queue_idx')]
+
+    def __str__(self):
+        return f"Enrichment job {self.id} for Image {self.image_id} ({self.status})"
@@ -0,0 +1,108 @@
+import base64
+import hashlib
+from datetime import datetime
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+DEFAULT_SETTINGS = {
+    "PAGE_SIZE": 50,
+    "MAX_PAGE_SIZE": 500,   # Upper bound for ?page_size=
+}
+
+# Columns `LocationImageSerializer.to_representation` reads; list queries load only these
+LIST_FIELDS = (
+    'id', 'uploaded_at', 'home_address', 'latitude', 'longitude', 'distance_km', 'status',
+    'landmark_name', 'landmark_confidence', 'landmark_lat', 'landmark_lng', 'thumbnail',
+    'road_distance_km', 'travel_time_min', 'travel_cost',
+)
+
+
+def get_list_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "LOCATION_LIST", {})}
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination over `(uploaded_at, id)`. Each page is an indexed range
+    scan that starts after the previous page's last row, so page N costs the same as page 1
+    and rows inserted while a client is paging do not shift the pages.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        options = get_list_settings()
+        self.page_size = options["PAGE_SIZE"]
+        self.max_page_size = options["MAX_PAGE_SIZE"]
+
+    def encode_cursor(self, instance):
+        raw = f"{instance.uploaded_at.isoformat()}|{instance.id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)).decode()
+            uploaded_at, pk = raw.split('|')
+            return datetime.fromisoformat(uploaded_at), int(pk)
+        except (ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_page_size(self, request):
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(requested, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by('uploaded_at', 'id')
+
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            uploaded_at, pk = cursor
+            queryset = queryset.filter(Q(uploaded_at__gt=uploaded_at) | Q(uploaded_at=uploaded_at, id__gt=pk))
+
+        # One extra row tells us whether there is a next page without a COUNT query
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        self.page = rows[:page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        next_link = self.get_next_link()
+        headers = {'Link': f'<{next_link}>; rel="next"'} if next_link else None
+        return Response({'next': next_link, 'results': data}, headers=headers)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+def page_etag(rows, has_next=False, fields=LIST_FIELDS):
+    """Weak ETag over the listed columns of a page (and whether more follow), computed before serialization."""
+    hasher = hashlib.md5(b"next" if has_next else b"last")
+    for row in rows:
+        hasher.update(repr(tuple(getattr(row, field) for field in fields)).encode())
+    return f'W/"{hasher.hexdigest()}"'
@@ -0,0 +1,173 @@
+"""
+Perceptual hashing and near-duplicate lookup.
+
+`dhash()` produces a 64-bit difference hash that survives re-encoding, resizing and
+EXIF stripping, so such copies of an image we have already enriched can reuse its
+landmark result instead of paying for another Vision call. Lookups use an in-memory
+BK-tree over Hamming distance that is loaded from the database on first use and then
+extended incrementally: every write of `perceptual_hash` also sets
+`perceptual_hashed_at` (`stamp_hash()`), and each lookup adds the rows stamped since
+the previous one, whichever process wrote them (uploads, updates, batch uploads,
+`backfill_perceptual_hashes`).
+"""
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from PIL import Image, ImageOps
+from .models import LocationImage
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "ENABLED": True,
+    "MAX_DISTANCE": 6,   # Max differing bits (of 64) for two images to count as near-duplicates
+    "REFRESH_OVERLAP": 60,  # Seconds each refresh re-reads before the last one (late commits, clock skew between hosts)
+}
+
+HASH_SIZE = 8
+
+
+def get_phash_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "PERCEPTUAL_HASH", {})}
+
+
+def dhash(image_file):
+    """64-bit difference hash of an image file, as a 16-character hex string."""
+    image_file.seek(0)
+    with Image.open(image_file) as img:
+        img.draft('L', (HASH_SIZE * 4, HASH_SIZE * 4))  # Let the JPEG decoder downscale cheaply
+        img = ImageOps.exif_transpose(img)
+        pixels = list(img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS).getdata())
+    image_file.seek(0)
+
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return f"{value:016x}"
+
+
+def stamp_hash(instance, perceptual_hash):
+    """Set `perceptual_hash` and its `perceptual_hashed_at` stamp on an unsaved `LocationImage`."""
+    instance.perceptual_hash = perceptual_hash
+    instance.perceptual_hashed_at = timezone.now() if perceptual_hash else None
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit ints; a radius search only visits subtrees that can match."""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, key, value):
+        node = [key, [value], {}]  # key, values sharing this exact hash, children by distance
+        self.size += 1
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming(key, current[0])
+            if distance == 0:
+                current[1].append(value)
+                return
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, key, max_distance):
+        """Return (distance, value) pairs within `max_distance` of `key`, closest first."""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node_key, values, children = stack.pop()
+            distance = hamming(key, node_key)
+            if distance <= max_distance:
+                found.extend((distance, value) for value in values)
+            low, high = distance - max_distance, distance + max_distance
+            stack.extend(child for d, child in children.items() if low <= d <= high)
+        return sorted(found, key=lambda item: item[0])
+
+
+class NearDuplicateIndex:
+    """Process-wide BK-tree of `LocationImage.perceptual_hash`, refreshed by `perceptual_hashed_at` watermark."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.tree = BKTree()
+        self.keys = {}           # pk → hash it is indexed under, so re-read rows are not added twice
+        self.refreshed_at = None
+
+    def refresh(self):
+        """Add rows hashed since the previous refresh (all hashed rows on the first one)."""
+        started_at = timezone.now()
+        rows = LocationImage.objects.filter(perceptual_hash__isnull=False)
+        if self.refreshed_at is not None:
+            overlap = timedelta(seconds=get_phash_settings()["REFRESH_OVERLAP"])
+            rows = rows.filter(perceptual_hashed_at__gte=self.refreshed_at - overlap)
+        for pk, perceptual_hash in rows.values_list('pk', 'perceptual_hash').iterator(chunk_size=2000):
+            key = int(perceptual_hash, 16)
+            if self.keys.get(pk) != key:
+                # A re-hashed row keeps its old node too; `find()` re-checks candidates against the database
+                self.tree.add(key, pk)
+                self.keys[pk] = key
+        self.refreshed_at = started_at
+
+    def find(self, perceptual_hash, max_distance=None, exclude_pk=None):
+        """
+        Closest enriched `LocationImage` within `max_distance` bits of `perceptual_hash`, or None.
+        Candidates are re-checked against the database, so deleted or re-hashed rows are skipped.
+        """
+        if max_distance is None:
+            max_distance = get_phash_settings()["MAX_DISTANCE"]
+        key = int(perceptual_hash, 16)
+        with self._lock:
+            self.refresh()
+            candidates = [pk for _, pk in self.tree.search(key, max_distance) if pk != exclude_pk]
+        if not candidates:
+            return None
+
+        rows = LocationImage.objects.filter(pk__in=candidates, landmark_detected_at__isnull=False, perceptual_hash__isnull=False)
+        best = None
+        for row in rows:
+            distance = hamming(key, int(row.perceptual_hash, 16))
+            if distance <= max_distance and (best is None or distance < best[0]):
+                best = (distance, row)
+        return best[1] if best else None
+
+
+near_duplicates = NearDuplicateIndex()
+
+
+def find_near_duplicate(perceptual_hash, exclude_pk=None):
+    if not perceptual_hash or not get_phash_settings()["ENABLED"]:
+        return None
+    return near_duplicates.find(perceptual_hash, exclude_pk=exclude_pk)
+
+
+def stored_landmark(instance):
+    """Rebuild a `detect_landmark()`-style result from a row's stored landmark columns."""
+    if instance.landmark_name is None:
+        return None
+    return {
+        "landmark_name": instance.landmark_name,
+        "confidence_score": instance.landmark_confidence,
+        "landmark_lat": instance.landmark_lat,
+        "landmark_lng": instance.landmark_lng,
+    }
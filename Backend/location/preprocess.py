@@ -0,0 +1,164 @@
+"""
+Pillow preprocessing of uploaded photos.
+
+* `vision_content()` applies EXIF orientation and downscales to VISION_MAX_EDGE before
+  the bytes go to Vision, so a 12 MB phone photo becomes a ~200 KB request.
+* `generate_derivatives()` stores a display-size copy and a thumbnail (WebP, or JPEG
+  where Pillow lacks WebP support) next to the untouched original. It runs on a
+  thread pool after the upload has been committed, so requests never wait for it.
+"""
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps, features
+from .models import LocationImage
+from .instrumentation import timed
+from .response_cache import invalidate_images
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "ENABLED": True,
+    "VISION_MAX_EDGE": 1024,    # Longest edge (px) of the image sent to Vision
+    "VISION_QUALITY": 90,       # JPEG quality of the Vision payload
+    "DISPLAY_MAX_EDGE": 2048,   # Longest edge of the stored display derivative
+    "THUMBNAIL_EDGE": 256,      # Longest edge of the stored thumbnail
+    "FORMAT": "WEBP",           # Derivative format; JPEG is used when WebP is unavailable
+    "QUALITY": 80,
+    "WORKERS": 2,               # Threads generating derivatives (Pillow releases the GIL while resampling/encoding)
+}
+
+
+def get_preprocessing_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "IMAGE_PREPROCESSING", {})}
+
+
+def _derivative_format(options):
+    fmt = options["FORMAT"].upper()
+    if fmt == "WEBP" and not features.check("webp"):
+        return "JPEG"
+    return fmt
+
+
+def _open_oriented(img, max_edge):
+    """Let the JPEG decoder downscale close to `max_edge`, then return an EXIF-oriented copy."""
+    img.draft('RGB', (max_edge, max_edge))
+    return ImageOps.exif_transpose(img)
+
+
+def _encode(img, fmt, quality):
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt, quality=quality, optimize=fmt == "JPEG")
+    return buffer.getvalue()
+
+
+@timed("preprocess.vision")
+def vision_content(content):
+    """
+    Bytes to send to Vision for `content`: oriented and no larger than VISION_MAX_EDGE.
+    The original bytes are returned unchanged when they are already small and upright,
+    or when Pillow cannot read them (Vision reports its own error then).
+    """
+    options = get_preprocessing_settings()
+    if not options["ENABLED"]:
+        return content
+    max_edge = options["VISION_MAX_EDGE"]
+    try:
+        with Image.open(io.BytesIO(content)) as original:
+            upright = original.getexif().get(0x0112, 1) == 1  # EXIF Orientation tag
+            if upright and max(original.size) <= max_edge:
+                return content
+            img = _open_oriented(original, max_edge)
+            img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+            return _encode(img, "JPEG", options["VISION_QUALITY"])
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning("❗ Could not downscale image for Vision, sending original: %s", e)
+        return content
+
+
+def render_derivatives(source, options=None):
+    """{"display": bytes, "thumbnail": bytes} for an image file or path."""
+    options = options or get_preprocessing_settings()
+    fmt = _derivative_format(options)
+    with Image.open(source) as original:
+        display = _open_oriented(original, options["DISPLAY_MAX_EDGE"])
+    display.thumbnail((options["DISPLAY_MAX_EDGE"],) * 2, Image.Resampling.LANCZOS)
+    thumbnail = display.copy()
+    thumbnail.thumbnail((options["THUMBNAIL_EDGE"],) * 2, Image.Resampling.LANCZOS)
+    return {
+        "display": _encode(display, fmt, options["QUALITY"]),
+        "thumbnail": _encode(thumbnail, fmt, options["QUALITY"]),
+    }
+
+
+def generate_derivatives(pk):
+    """Render and store the display image and thumbnail for one row, replacing older derivatives."""
+    options = get_preprocessing_settings()
+    instance = LocationImage.objects.only('id', 'image', 'display_image', 'thumbnail').filter(pk=pk).first()
+    if instance is None or not instance.image:
+        return
+    previous = [name for name in (instance.display_image.name, instance.thumbnail.name) if name]
+
+    with instance.image.open('rb') as source:
+        rendered = render_derivatives(source, options)
+
+    stem = os.path.splitext(os.path.basename(instance.image.name))[0]
+    extension = "webp" if _derivative_format(options) == "WEBP" else "jpg"
+    instance.display_image.save(f"{stem}.{extension}", ContentFile(rendered["display"]), save=False)
+    instance.thumbnail.save(f"{stem}.{extension}", ContentFile(rendered["thumbnail"]), save=False)
+
+    # Update only these columns, and only if the original has not been replaced meanwhile
+    updated = LocationImage.objects.filter(pk=pk, image=instance.image.name).update(
+        display_image=instance.display_image.name, thumbnail=instance.thumbnail.name
+    )
+    if updated:
+        invalidate_images([pk])  # List pages link the thumbnail
+    stale = previous if updated else [instance.display_image.name, instance.thumbnail.name]
+    for name in stale:
+        instance.image.storage.delete(name)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=get_preprocessing_settings()["WORKERS"], thread_name_prefix="preprocess"
+                )
+    return _executor
+
+
+def _run_in_thread(pk):
+    close_old_connections()
+    try:
+        generate_derivatives(pk)
+    except Exception as e:
+        logger.error("❗ Derivative generation failed for Image ID %s: %s", pk, e)
+    finally:
+        close_old_connections()
+
+
+def schedule_derivatives(pks):
+    """Generate derivatives for `pks` on the preprocessing pool once the current transaction commits."""
+    if not get_preprocessing_settings()["ENABLED"]:
+        return
+    pks = [pk for pk in pks if pk is not None]
+
+    def submit():
+        executor = _get_executor()
+        for pk in pks:
+            executor.submit(_run_in_thread, pk)
+
+    transaction.on_commit(submit)
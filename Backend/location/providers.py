@@ -0,0 +1,266 @@
+"""
+Pluggable geocoding and landmark-detection providers.
+
+`get_provider()` returns the process-wide provider named by
+`settings.LOCATION_PROVIDER["BACKEND"]`:
+
+* `GoogleProvider` (default) calls the Google Geocoding API and Google Vision
+  through the pooled clients in `location/services.py`.
+* `GazetteerProvider` answers from a local JSON gazetteer of addresses and
+  landmarks, deterministically and without network access. Artificial latency
+  and error rates make it a stand-in for load tests; simulated errors go through
+  the same retries and circuit breakers as real ones.
+
+`ageocode()` / `adetect_landmark()` are the coroutine versions used by the ASGI
+views; providers without native async I/O run their sync methods on a thread.
+"""
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+from . import services
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "BACKEND": "location.providers.GoogleProvider",
+    # GazetteerProvider only
+    "GAZETTEER_PATH": None,       # Defaults to location/data/gazetteer.json
+    "LATENCY_MS": 0.0,            # Mean artificial latency per call
+    "LATENCY_JITTER_MS": 0.0,     # Uniform ± jitter around LATENCY_MS
+    "ERROR_RATE": 0.0,            # Probability that a call fails with a retryable error
+    "NO_LANDMARK_RATE": 0.2,      # Share of images for which no landmark is "detected"
+    "SYNTHESIZE_UNKNOWN": True,   # Derive coordinates for addresses missing from the gazetteer
+    "SEED": 0,                    # Seeds the latency/error sequence
+}
+
+
+def get_provider_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "LOCATION_PROVIDER", {})}
+
+
+def landmark_from_response(response):
+    """Extract our landmark dict from a Vision `AnnotateImageResponse` (None when nothing was found)."""
+    landmarks = response.landmark_annotations
+    if landmarks:
+        landmark = landmarks[0]  # Assume the most confident detection
+        return {
+            "landmark_name": landmark.description,
+            "confidence_score": round(landmark.score * 100, 2),
+            "landmark_lat": landmark.locations[0].lat_lng.latitude,
+            "landmark_lng": landmark.locations[0].lat_lng.longitude
+        }
+    return None
+
+
+class BaseProvider:
+    """
+    Interface: `geocode(address)` returns (lat, lng) or (None, None); `detect_landmark(content)`
+    returns a landmark dict or None; `detect_landmarks(contents)` returns one (landmark, error)
+    pair per image. Failures of the whole call raise.
+    """
+
+    def __init__(self, options):
+        self.options = options
+
+    def geocode(self, address):
+        raise NotImplementedError
+
+    def detect_landmark(self, content):
+        raise NotImplementedError
+
+    async def ageocode(self, address):
+        return await sync_to_async(self.geocode, thread_sensitive=False)(address)
+
+    async def adetect_landmark(self, content):
+        return await sync_to_async(self.detect_landmark, thread_sensitive=False)(content)
+
+    def detect_landmarks(self, contents):
+        results = []
+        for content in contents:
+            try:
+                results.append((self.detect_landmark(content), None))
+            except Exception as e:
+                results.append((None, str(e)))
+        return results
+
+
+class GoogleProvider(BaseProvider):
+    @staticmethod
+    def _coordinates(data):
+        if data['status'] == 'OK':
+            location = data['results'][0]['geometry']['location']
+            return location['lat'], location['lng']
+        logger.error("❗ Geocoding Error: %s - %s", data['status'], data.get('error_message', 'No details provided'))
+        return None, None
+
+    def geocode(self, address):
+        return self._coordinates(services.geocode(address))
+
+    async def ageocode(self, address):
+        return self._coordinates(await services.ageocode(address))
+
+    def detect_landmark(self, content):
+        return landmark_from_response(services.annotate_landmarks(content))
+
+    async def adetect_landmark(self, content):
+        return landmark_from_response(await services.aannotate_landmarks(content))
+
+    def detect_landmarks(self, contents):
+        return [
+            (None, response.error.message) if response.error.code else (landmark_from_response(response), None)
+            for response in services.batch_annotate_landmarks(contents)
+        ]
+
+
+class SimulatedOutage(Exception):
+    """A retryable failure injected by `GazetteerProvider`."""
+
+
+class GazetteerProvider(BaseProvider):
+    """
+    Offline provider backed by a JSON file of the form
+    {"addresses": [[address, lat, lng], ...], "landmarks": [[name, lat, lng], ...]}.
+    Addresses are indexed by their normalized form; coordinates live in float64 arrays.
+    The landmark for an image is chosen from the MD5 of its bytes, so the same image
+    always gets the same answer.
+    """
+
+    def __init__(self, options):
+        super().__init__(options)
+        import numpy as np  # Only the offline backend needs it; keep it out of startup
+        from .geocoding import normalize_address  # geocoding imports this module
+
+        self.normalize = normalize_address
+        path = options["GAZETTEER_PATH"] or settings.BASE_DIR / "location" / "data" / "gazetteer.json"
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+
+        self.address_index = {}
+        coordinates = []
+        for address, lat, lng in data.get("addresses", []):
+            self.address_index.setdefault(normalize_address(address), len(coordinates))
+            coordinates.append((lat, lng))
+        self.address_coordinates = np.array(coordinates, dtype=np.float64).reshape(-1, 2)
+
+        self.landmark_names = [name for name, _, _ in data.get("landmarks", [])]
+        self.landmark_coordinates = np.array(
+            [(lat, lng) for _, lat, lng in data.get("landmarks", [])], dtype=np.float64
+        ).reshape(-1, 2)
+
+        # Synthetic coordinates for unknown addresses fall inside the bounding box of the known ones
+        points = self.address_coordinates
+        self.bounds = (points.min(axis=0), points.max(axis=0)) if len(points) else (np.zeros(2), np.zeros(2))
+
+        self._random = random.Random(options["SEED"])
+        self._lock = threading.Lock()
+        logger.info("Gazetteer loaded from %s: %s addresses, %s landmarks", path, len(self.address_index), len(self.landmark_names))
+
+    def _draw(self):
+        """(delay in seconds, failed) for one simulated call."""
+        options = self.options
+        with self._lock:
+            jitter = self._random.uniform(-1.0, 1.0) * options["LATENCY_JITTER_MS"]
+            failed = self._random.random() < options["ERROR_RATE"]
+        return max(0.0, options["LATENCY_MS"] + jitter) / 1000, failed
+
+    def _simulate(self, service):
+        """Sleep for the configured latency and fail with probability ERROR_RATE, under retries and the breaker."""
+        def attempt():
+            delay, failed = self._draw()
+            if delay:
+                time.sleep(delay)
+            if failed:
+                raise SimulatedOutage(f"Simulated {service} failure")
+
+        try:
+            services.call_with_retries(attempt, services.get_breaker(service), lambda exc: isinstance(exc, SimulatedOutage))
+        except SimulatedOutage as exc:
+            raise services.ServiceUnavailable(str(exc)) from exc
+
+    async def _asimulate(self, service):
+        """`_simulate()` awaiting the latency instead of blocking the thread."""
+        async def attempt():
+            delay, failed = self._draw()
+            if delay:
+                await asyncio.sleep(delay)
+            if failed:
+                raise SimulatedOutage(f"Simulated {service} failure")
+
+        try:
+            await services.acall_with_retries(attempt, services.get_breaker(service), lambda exc: isinstance(exc, SimulatedOutage))
+        except SimulatedOutage as exc:
+            raise services.ServiceUnavailable(str(exc)) from exc
+
+    @staticmethod
+    def _digest(data):
+        return int.from_bytes(hashlib.md5(data).digest()[:8], "big")
+
+    def geocode(self, address):
+        self._simulate("geocoding")
+        return self._lookup(address)
+
+    async def ageocode(self, address):
+        await self._asimulate("geocoding")
+        return self._lookup(address)
+
+    def _lookup(self, address):
+        key = self.normalize(address)
+        index = self.address_index.get(key)
+        if index is not None:
+            lat, lng = self.address_coordinates[index]
+            return float(lat), float(lng)
+        if not self.options["SYNTHESIZE_UNKNOWN"] or not key:
+            return None, None
+        digest = self._digest(key.encode())
+        low, high = self.bounds
+        fractions = ((digest & 0xFFFFFFFF) / 0xFFFFFFFF, (digest >> 32) / 0xFFFFFFFF)
+        lat, lng = (lo + fraction * (hi - lo) for lo, fraction, hi in zip(low, fractions, high))
+        return round(float(lat), 6), round(float(lng), 6)
+
+    def _landmark(self, content):
+        digest = self._digest(content)
+        if not self.landmark_names or (digest % 10_000) / 10_000 < self.options["NO_LANDMARK_RATE"]:
+            return None
+        index = (digest // 10_000) % len(self.landmark_names)
+        lat, lng = self.landmark_coordinates[index]
+        return {
+            "landmark_name": self.landmark_names[index],
+            "confidence_score": round(50 + (digest >> 40) % 5000 / 100, 2),
+            "landmark_lat": float(lat),
+            "landmark_lng": float(lng),
+        }
+
+    def detect_landmark(self, content):
+        self._simulate("vision")
+        return self._landmark(content)
+
+    async def adetect_landmark(self, content):
+        await self._asimulate("vision")
+        return self._landmark(content)
+
+    def detect_landmarks(self, contents):
+        self._simulate("vision")  # One round trip for the whole batch, like batch_annotate_images
+        return [(self._landmark(content), None) for content in contents]
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_provider():
+    """Return the process-wide provider configured by `settings.LOCATION_PROVIDER`."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                options = get_provider_settings()
+                _provider = import_string(options["BACKEND"])(options)
+                logger.info("Location provider backend: %s", options["BACKEND"])
+    return _provider
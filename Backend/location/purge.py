@@ -0,0 +1,191 @@
+"""
+Bulk purge of all `LocationImage` rows and their uploaded files.
+
+Rows are deleted with plain `DELETE ... WHERE id > a AND id <= b` statements in
+bounded primary-key ranges, each in its own short transaction, so no model instances
+are loaded and no long transaction is held. On PostgreSQL a single `TRUNCATE` can be
+used instead when `LOCATION_PURGE["ALLOW_TRUNCATE"]` is set. Files are removed
+afterwards by a background thread pool; progress is kept in a `PurgeReport`.
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection, transaction
+from .models import EnrichmentJob, LocationImage
+from .phash import near_duplicates
+from .response_cache import invalidate_all
+from .spatial import landmark_index
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "BATCH_SIZE": 5000,         # Rows deleted per statement/transaction
+    "FILE_WORKERS": 8,          # Threads removing uploaded files
+    "ALLOW_TRUNCATE": False,    # Permit the TRUNCATE fast path (PostgreSQL only)
+}
+
+
+# Every stored file of a row: the original and its derivatives
+FILE_FIELDS = ('image', 'display_image', 'thumbnail')
+
+
+def get_purge_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "LOCATION_PURGE", {})}
+
+
+class PurgeReport:
+    """Progress of one purge; file counters keep moving after the request has returned."""
+
+    def __init__(self, method):
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.rows_deleted = 0
+        self.batches = 0
+        self.files_total = 0
+        self.files_deleted = 0
+        self.files_missing = 0
+        self.files_failed = 0
+        self.started_at = time.time()
+        self.db_seconds = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def _check_finished(self):
+        if self.db_seconds is not None and self.files_deleted + self.files_missing + self.files_failed == self.files_total:
+            self.finished_at = time.time()
+
+    def rows_done(self, seconds):
+        with self._lock:
+            self.db_seconds = seconds
+            self._check_finished()
+
+    def file_done(self, outcome):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            self._check_finished()
+
+    def as_dict(self):
+        with self._lock:
+            files_done = self.files_deleted + self.files_missing + self.files_failed
+            return {
+                "id": self.id,
+                "method": self.method,
+                "state": "done" if self.finished_at else "deleting_rows" if self.db_seconds is None else "deleting_files",
+                "rows_deleted": self.rows_deleted,
+                "batches": self.batches,
+                "db_seconds": round(self.db_seconds, 3) if self.db_seconds is not None else None,
+                "files_total": self.files_total,
+                "files_pending": self.files_total - files_done,
+                "files_deleted": self.files_deleted,
+                "files_missing": self.files_missing,
+                "files_failed": self.files_failed,
+            }
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_last_report = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=get_purge_settings()["FILE_WORKERS"], thread_name_prefix="purge")
+    return _executor
+
+
+def last_report():
+    """The most recent purge started by this process, or None."""
+    return _last_report
+
+
+def _delete_file(storage, name, report):
+    try:
+        if not storage.exists(name):
+            report.file_done("files_missing")
+            return
+        storage.delete(name)
+        report.file_done("files_deleted")
+    except Exception as e:
+        logger.error("❗ Could not delete %s: %s", name, e)
+        report.file_done("files_failed")
+
+
+def _remove_files(names, report):
+    storage = LocationImage._meta.get_field('image').storage
+    names = [name for name in names if name]
+    with report._lock:
+        report.files_total += len(names)
+    executor = _get_executor()
+    for name in names:
+        executor.submit(_delete_file, storage, name, report)
+
+
+def _delete_batches(report, batch_size):
+    last_pk = 0
+    while True:
+        rows = list(
+            LocationImage.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', *FILE_FIELDS)[:batch_size]
+        )
+        if not rows:
+            return
+        low, high = last_pk, rows[-1][0]
+        with transaction.atomic():
+            # `_raw_delete` issues one DELETE for the range without collecting instances;
+            # jobs go first because their foreign key would otherwise cascade through the collector
+            EnrichmentJob.objects.filter(image_id__gt=low, image_id__lte=high)._raw_delete(EnrichmentJob.objects.db)
+            deleted = LocationImage.objects.filter(pk__gt=low, pk__lte=high)._raw_delete(LocationImage.objects.db)
+        report.rows_deleted += deleted
+        report.batches += 1
+        last_pk = high
+        _remove_files([name for _, *names in rows for name in names], report)
+
+
+def _truncate(report):
+    tables = [EnrichmentJob._meta.db_table, LocationImage._meta.db_table]
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            quoted = ", ".join(connection.ops.quote_name(table) for table in tables)
+            # Block writers while the file list is read, so no upload slips in between
+            cursor.execute(f"LOCK TABLE {quoted} IN ACCESS EXCLUSIVE MODE")
+            rows = list(LocationImage.objects.values_list(*FILE_FIELDS).iterator(chunk_size=10000))
+            cursor.execute(f"TRUNCATE TABLE {quoted}")
+    report.rows_deleted = len(rows)
+    report.batches = 1
+    return [name for names in rows for name in names]
+
+
+def can_truncate():
+    return get_purge_settings()["ALLOW_TRUNCATE"] and connection.vendor == 'postgresql'
+
+
+def purge_all(truncate=False, batch_size=None):
+    """
+    Delete every `LocationImage` (and its enrichment job). Returns the `PurgeReport`
+    once the rows are gone; uploaded files are still being removed in the background.
+    """
+    global _last_report
+    truncate = truncate and can_truncate()
+    report = PurgeReport("truncate" if truncate else "batched")
+    _last_report = report
+    started = time.monotonic()
+
+    if truncate:
+        _remove_files(_truncate(report), report)
+    else:
+        _delete_batches(report, batch_size or get_purge_settings()["BATCH_SIZE"])
+    report.rows_done(time.monotonic() - started)
+
+    # In-memory indexes of this process point at rows that no longer exist; cached responses describe them
+    invalidate_all()
+    with near_duplicates._lock:
+        near_duplicates.reset()
+    landmark_index.rebuild()
+
+    logger.info("🗑️ Purged %s images in %s batches (%.2fs), removing %s files", report.rows_deleted, report.batches, report.db_seconds, report.files_total)
+    return report
@@ -0,0 +1,174 @@
+"""
+Rendered-response cache for the image detail and list endpoints.
+
+JSON bodies are cached in a Django cache and stamped with version tokens: one per
+image, one for all list pages and a global generation. A lookup fetches the entry and
+its tokens with one `get_many()` and serves the stored bytes only while the stamp still
+matches, so a hit costs no query and no serialization. Entries carry an ETag and
+requests with a matching `If-None-Match` get a 304.
+
+Tokens are bumped after the writing transaction commits: by `post_save`/`post_delete`
+on `LocationImage` (location/signals.py) and by explicit `invalidate_images()` /
+`invalidate_all()` calls on paths that bypass signals (`update()`, `bulk_create()`,
+purges). Tokens are clock values, so a token evicted from the cache is replaced by a
+new one, never reused, and an old entry cannot match again.
+
+Bumps must reach every process that serves or writes images (web workers, the
+enrichment worker, management commands), so CACHE_ALIAS has to be a shared cache
+(Redis, Memcached). On a process-local backend (LocMem) the cache stays off unless
+ALLOW_PROCESS_LOCAL is set, for single-process deployments such as `runserver`.
+"""
+import hashlib
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from .lru import is_process_local
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "ENABLED": True,
+    "TTL": 300,                 # Seconds a rendered response is kept
+    "CACHE_ALIAS": "default",
+    "KEY_PREFIX": "location-response",
+    "ALLOW_PROCESS_LOCAL": False,   # Cache on a LocMem alias too (only correct with a single process)
+}
+
+GENERATION = "generation"
+LIST_VERSION = "list:v"
+CACHED_HEADERS = ('Link',)  # Response headers stored with the body (pagination links)
+
+
+def get_response_cache_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "RESPONSE_CACHE", {})}
+
+
+class ResponseCache:
+    def __init__(self, options):
+        self.ttl = options["TTL"]
+        self.key_prefix = options["KEY_PREFIX"]
+        self._cache = caches[options["CACHE_ALIAS"]]
+
+    def key(self, name):
+        return f"{self.key_prefix}:{name}"
+
+    def lookup(self, entry_key, token_keys):
+        """
+        (entry or None, stamp): the entry under `entry_key` if it was stored with the current
+        tokens, and the stamp a freshly rendered entry must be stored with. Read the stamp
+        before the data it describes, so a concurrent write makes the new entry stale, not wrong.
+        """
+        found = self._cache.get_many([entry_key, *token_keys])
+        stamp = []
+        for token_key in token_keys:
+            token = found.get(token_key)
+            if token is None:
+                token = time.time_ns()
+                if not self._cache.add(token_key, token, timeout=None):
+                    token = self._cache.get(token_key, token)  # Another request created it first
+            stamp.append(token)
+        stamp = tuple(stamp)
+
+        entry = found.get(entry_key)
+        if entry is not None and entry[0] == stamp:
+            return entry, stamp
+        return None, stamp
+
+    def store(self, entry_key, stamp, etag, content_type, content, headers):
+        self._cache.set(entry_key, (stamp, etag, content_type, content, headers), timeout=self.ttl)
+
+    def bump(self, token_keys):
+        token = time.time_ns()
+        self._cache.set_many({token_key: token for token_key in token_keys}, timeout=None)
+
+
+_response_cache = None
+_DISABLED = object()  # `_response_cache` when the configured alias cannot be shared
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Return the process-wide response cache, or None when it is off or CACHE_ALIAS is process-local."""
+    global _response_cache
+    options = get_response_cache_settings()
+    if not options["ENABLED"]:
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                if is_process_local(options["CACHE_ALIAS"]) and not options["ALLOW_PROCESS_LOCAL"]:
+                    logger.warning("⚠️ Response cache disabled: CACHES[%r] is process-local, so invalidations "
+                                   "would not reach other workers", options["CACHE_ALIAS"])
+                    _response_cache = _DISABLED
+                else:
+                    _response_cache = ResponseCache(options)
+    return None if _response_cache is _DISABLED else _response_cache
+
+
+def detail_keys(cache, pk):
+    """(entry key, token keys) for the detail response of image `pk`."""
+    return cache.key(f"image:{pk}"), [cache.key(GENERATION), cache.key(f"image:{pk}:v")]
+
+
+def list_keys(cache, request):
+    """(entry key, token keys) for one list page; pages are keyed by their absolute URL (cursor, page size)."""
+    url = request.build_absolute_uri(request.path)
+    query = sorted(request.query_params.lists())
+    digest = hashlib.md5(repr((url, query)).encode()).hexdigest()
+    return cache.key(f"list:{digest}"), [cache.key(GENERATION), cache.key(LIST_VERSION)]
+
+
+def invalidate_images(pks):
+    """Drop the cached detail responses of `pks` and every cached list page, once the current transaction commits."""
+    cache = get_response_cache()
+    if cache is None:
+        return
+    token_keys = [cache.key(f"image:{pk}:v") for pk in pks] + [cache.key(LIST_VERSION)]
+    transaction.on_commit(lambda: cache.bump(token_keys))
+
+
+def invalidate_all():
+    """Drop every cached response, once the current transaction commits."""
+    cache = get_response_cache()
+    if cache is not None:
+        transaction.on_commit(lambda: cache.bump([cache.key(GENERATION)]))
+
+
+class CachedResponseMixin:
+    """
+    For GET views: `cached_response()` answers from the response cache, or renders the view's
+    own response and caches it. Only plain JSON is cached; other renderings always run the view.
+    """
+
+    def cached_response(self, request, keys, respond):
+        """`keys(cache)` gives (entry key, token keys); `respond()` builds the uncached DRF Response."""
+        cache = get_response_cache()
+        renderer = request.accepted_renderer
+        if cache is None or request.accepted_media_type != renderer.media_type or renderer.format != 'json':
+            return respond()  # Not plain JSON (browsable API, `; indent=`): rendered per request
+
+        entry_key, token_keys = keys(cache)
+        entry, stamp = cache.lookup(entry_key, token_keys)
+        if entry is None:
+            response = respond()
+            if response.status_code != 200:
+                return response
+            content = renderer.render(response.data, request.accepted_media_type, self.get_renderer_context())
+            content_type = f"{renderer.media_type}; charset={renderer.charset}" if renderer.charset else renderer.media_type
+            etag = response.get('ETag') or f'"{hashlib.md5(content).hexdigest()}"'
+            headers = {name: response[name] for name in CACHED_HEADERS if name in response}
+            cache.store(entry_key, stamp, etag, content_type, content, headers)
+        else:
+            _, etag, content_type, content, headers = entry
+
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type=content_type, headers=headers)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'  # Clients may keep it but must revalidate
+        return response
@@ -0,0 +1,417 @@
+"""
+Offline road-network routing: travel distance, time and cost next to the haversine distance.
+
+`manage.py build_road_graph` turns an OSM extract into a graph directory of plain
+`.npy` arrays: CSR adjacency (`indptr`, `targets`) with per-edge length, travel time
+and toll flag, node coordinates, and a grid index used to snap points to nodes.
+`RoadGraph.load()` memory-maps them, so loading is instant, the OS pages in only what
+queries touch, and every worker process shares one copy in the page cache.
+
+Point-to-point queries run A*. Its lower bound on travel time comes from a few
+precomputed landmarks (ALT: shortest times from and to each landmark, stored per node
+and combined through the triangle inequality); shortest-distance queries and graphs
+built without landmarks use the great-circle distance instead. One-to-many queries
+(one home, many landmarks) run a single Dijkstra search that stops once every target
+is settled. Edges are weighted by travel time or length (`OPTIMIZE`). Points are snapped
+to their nearest graph node and the straight legs to and from it count at `ACCESS_SPEED_KMH`.
+Cost = km × FUEL_COST_PER_KM + toll km × TOLL_COST_PER_KM.
+"""
+import heapq
+import json
+import math
+import os
+import threading
+from django.conf import settings
+from django.utils import timezone
+from .distance import haversine_km, haversine_one_to_many
+from .instrumentation import span
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "GRAPH_DIR": None,              # Output of `manage.py build_road_graph`; routing is off without it
+    "OPTIMIZE": "time",             # "time" (fastest route) or "distance" (shortest route)
+    "FUEL_COST_PER_KM": 0.12,
+    "TOLL_COST_PER_KM": 0.25,       # Charged on top of fuel for the toll-road part of a route
+    "MAX_SNAP_KM": 2.0,             # Points farther than this from the road network get no route
+    "ACCESS_SPEED_KMH": 20.0,       # Speed assumed between a point and its snapped node
+    "MAX_SETTLED_NODES": 2_000_000, # Gives up on a query (no route) after settling this many nodes
+}
+
+GRAPH_FORMAT = 1
+GRAPH_ARRAYS = (
+    "node_lat", "node_lng", "indptr", "targets", "length_m", "time_s", "toll",
+    "cell_keys", "cell_start", "cell_nodes", "alt_from", "alt_to",
+)
+DEFAULT_CELL_DEG = 0.01  # Grid cell size of the snapping index (~1.1 km of latitude)
+DEFAULT_LANDMARKS = 8
+
+# Grid cells are keyed by (row, col) packed into one int64
+_CELL_OFFSET = 1 << 24
+_CELL_SPAN = 1 << 25
+_KM_PER_DEGREE = math.pi * 6371.0 / 180
+
+ROUTE_FIELDS = ("road_distance_km", "travel_time_min", "travel_cost")
+
+
+def get_routing_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "LOCATION_ROUTING", {})}
+
+
+def _cell_key(row, col):
+    return (row + _CELL_OFFSET) * _CELL_SPAN + (col + _CELL_OFFSET)
+
+
+def shortest_times(indptr, targets, weights, source):
+    """Full Dijkstra over CSR lists: the distance from `source` to every node (inf when unreachable)."""
+    import numpy as np
+    best = [math.inf] * (len(indptr) - 1)
+    best[source] = 0.0
+    heap = [(0.0, source)]
+    while heap:
+        cost, node = heapq.heappop(heap)
+        if cost > best[node]:
+            continue
+        for edge in range(indptr[node], indptr[node + 1]):
+            candidate = cost + weights[edge]
+            neighbour = targets[edge]
+            if candidate < best[neighbour]:
+                best[neighbour] = candidate
+                heapq.heappush(heap, (candidate, neighbour))
+    return np.array(best)
+
+
+def _landmark_times(node_lat, node_lng, indptr, targets, time_s, count):
+    """
+    (alt_from, alt_to): (N, count) travel times from and to `count` landmarks, NaN where unreachable.
+    Landmarks are picked greedily, each as far as possible (in time) from the ones before it.
+    """
+    import numpy as np
+    node_count = len(node_lat)
+    reverse = np.argsort(targets, kind="stable")
+    reverse_indptr = np.zeros(node_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(targets, minlength=node_count), out=reverse_indptr[1:])
+    forward_graph = (indptr.tolist(), targets.tolist(), time_s.tolist())
+    sources = np.repeat(np.arange(node_count), np.diff(indptr))
+    reverse_graph = (reverse_indptr.tolist(), sources[reverse].tolist(), time_s[reverse].tolist())
+
+    alt_from = np.full((node_count, count), np.nan, dtype=np.float32)
+    alt_to = np.full((node_count, count), np.nan, dtype=np.float32)
+    # Start from the node farthest from the centre, then keep maximizing the time to the nearest landmark
+    landmark = int(haversine_one_to_many(node_lat.mean(), node_lng.mean(), node_lat, node_lng).argmax()) if node_count else 0
+    nearest = np.full(node_count, np.inf)
+    for i in range(count if node_count else 0):
+        times_from = shortest_times(*forward_graph, landmark)
+        times_to = shortest_times(*reverse_graph, landmark)
+        alt_from[:, i] = np.where(np.isfinite(times_from), times_from, np.nan)
+        alt_to[:, i] = np.where(np.isfinite(times_to), times_to, np.nan)
+        nearest = np.minimum(nearest, times_from)
+        landmark = int(np.where(np.isfinite(nearest), nearest, -1).argmax())
+    return alt_from, alt_to
+
+
+def write_graph(directory, node_lat, node_lng, sources, targets, length_m, time_s, toll,
+                cell_deg=DEFAULT_CELL_DEG, landmarks=DEFAULT_LANDMARKS, source=None):
+    """
+    Write a graph directory from an edge list over nodes 0..N-1. Edges are sorted into
+    CSR order, the snapping index and `landmarks` ALT landmarks are computed here;
+    `meta.json` is written last.
+    """
+    import numpy as np
+    node_lat = np.asarray(node_lat, dtype=np.float64)
+    node_lng = np.asarray(node_lng, dtype=np.float64)
+    sources = np.asarray(sources, dtype=np.int64)
+    length_m = np.asarray(length_m, dtype=np.float32)
+    time_s = np.asarray(time_s, dtype=np.float32)
+    node_count = len(node_lat)
+
+    order = np.argsort(sources, kind="stable")
+    indptr = np.zeros(node_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=node_count), out=indptr[1:])
+
+    keys = _cell_key(np.floor(node_lat / cell_deg).astype(np.int64), np.floor(node_lng / cell_deg).astype(np.int64))
+    cell_nodes = np.argsort(keys, kind="stable")
+    cell_keys, cell_start = np.unique(keys[cell_nodes], return_index=True)
+
+    targets = np.asarray(targets, dtype=np.int32)[order]
+    time_s = time_s[order]
+    alt_from, alt_to = _landmark_times(node_lat, node_lng, indptr, targets, time_s, landmarks)
+
+    arrays = {
+        "node_lat": node_lat,
+        "node_lng": node_lng,
+        "indptr": indptr,
+        "targets": targets,
+        "length_m": length_m[order],
+        "time_s": time_s,
+        "toll": np.asarray(toll, dtype=np.bool_)[order],
+        "cell_keys": cell_keys,
+        "cell_start": np.append(cell_start, len(cell_nodes)).astype(np.int64),
+        "cell_nodes": cell_nodes.astype(np.int32),
+        "alt_from": alt_from,
+        "alt_to": alt_to,
+    }
+    os.makedirs(directory, exist_ok=True)
+    for name, values in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), values)
+
+    length_m = arrays["length_m"]
+    moving = time_s > 0
+    meta = {
+        "format": GRAPH_FORMAT,
+        "nodes": node_count,
+        "edges": len(order),
+        "max_speed_kmh": float((length_m[moving] / time_s[moving]).max() * 3.6) if moving.any() else 1.0,
+        "cell_deg": cell_deg,
+        "landmarks": landmarks,
+        "source": source,
+        "built_at": timezone.now().isoformat(),
+    }
+    with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+class Route:
+    __slots__ = ("distance_km", "duration_min", "toll_km")
+
+    def __init__(self, distance_km, duration_min, toll_km):
+        self.distance_km = distance_km
+        self.duration_min = duration_min
+        self.toll_km = toll_km
+
+    def cost(self, options):
+        return round(self.distance_km * options["FUEL_COST_PER_KM"] + self.toll_km * options["TOLL_COST_PER_KM"], 2)
+
+    def __repr__(self):
+        return f"Route({self.distance_km:.2f} km, {self.duration_min:.1f} min, {self.toll_km:.2f} toll km)"
+
+
+class RoadGraph:
+    """A CSR road graph (see `write_graph()`); arrays are memory-mapped by `load()`."""
+
+    def __init__(self, arrays, meta):
+        import numpy as np
+        for name in GRAPH_ARRAYS:
+            # Plain ndarray views of the mapped buffers: np.memmap indexing is far slower
+            setattr(self, name, arrays[name].view(np.ndarray))
+        self.meta = meta
+        self.cell_deg = meta["cell_deg"]
+        self.max_speed_mps = meta["max_speed_kmh"] / 3.6
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        import numpy as np
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != GRAPH_FORMAT:
+            raise ValueError(f"Unsupported road graph format {meta.get('format')!r}; rebuild it with build_road_graph.")
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in GRAPH_ARRAYS
+        }
+        return cls(arrays, meta)
+
+    @property
+    def node_count(self):
+        return self.meta["nodes"]
+
+    def _ring_nodes(self, row, col, ring):
+        """Node ids in the grid cells exactly `ring` cells away from (row, col)."""
+        import numpy as np
+        if ring == 0:
+            cells = [(row, col)]
+        else:
+            cells = [(row + dr, col + dc) for dr in (-ring, ring) for dc in range(-ring, ring + 1)]
+            cells += [(row + dr, col + dc) for dc in (-ring, ring) for dr in range(-ring + 1, ring)]
+        if not len(self.cell_keys):
+            return None
+        keys = np.array([_cell_key(r, c) for r, c in cells], dtype=np.int64)
+        found = np.minimum(np.searchsorted(self.cell_keys, keys), len(self.cell_keys) - 1)
+        found = found[self.cell_keys[found] == keys]
+        if not len(found):
+            return None
+        return np.concatenate([self.cell_nodes[self.cell_start[i]:self.cell_start[i + 1]] for i in found])
+
+    def nearest_node(self, lat, lng, max_km):
+        """(node, km) of the graph node nearest to (lat, lng), or (None, None) when none is within `max_km`."""
+        row, col = math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+        # Narrowest side of a cell here: anything beyond ring r is at least r cells of this away
+        cell_km = self.cell_deg * _KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01)
+        best, best_km = None, math.inf
+        for ring in range(int(max_km / cell_km) + 2):
+            candidates = self._ring_nodes(row, col, ring)
+            if candidates is not None:
+                distances = haversine_one_to_many(lat, lng, self.node_lat[candidates], self.node_lng[candidates])
+                i = int(distances.argmin())
+                if distances[i] < best_km:
+                    best, best_km = int(candidates[i]), float(distances[i])
+            if best_km <= ring * cell_km:
+                break
+        if best is None or best_km > max_km:
+            return None, None
+        return best, best_km
+
+    def search(self, source, targets, weights, goal=None, max_settled=None):
+        """
+        Settle nodes from `source` in order of `weights` until every node in `targets` is settled.
+        With a single `goal` node the search is A*, guided by the great-circle lower bound.
+        Returns ({node: (previous node, edge)}, settled nodes); tree entries of settled nodes are final.
+        """
+        indptr, adjacency = self.indptr, self.targets
+        heuristic = self._heuristic(goal, weights) if goal is not None else None
+        best = {source: 0.0}
+        tree = {source: (-1, -1)}
+        remaining = set(targets)
+        settled = set()
+        heap = [(0.0, 0.0, source)]
+        while heap and remaining:
+            _, cost, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled.add(node)
+            remaining.discard(node)
+            if max_settled and len(settled) >= max_settled:
+                break
+            start, end = int(indptr[node]), int(indptr[node + 1])
+            for edge, neighbour, weight in zip(range(start, end), adjacency[start:end].tolist(), weights[start:end].tolist()):
+                candidate = cost + weight
+                if candidate < best.get(neighbour, math.inf):
+                    best[neighbour] = candidate
+                    tree[neighbour] = (node, edge)
+                    estimate = candidate + heuristic(neighbour) if heuristic else candidate
+                    heapq.heappush(heap, (estimate, candidate, neighbour))
+        return tree, settled
+
+    def _heuristic(self, goal, weights):
+        if weights is self.time_s and self.alt_from.shape[1]:
+            return self._landmark_heuristic(goal)
+        goal_lat, goal_lng = float(self.node_lat[goal]), float(self.node_lng[goal])
+        # Edge lengths are summed great-circle segments, so the straight line never overestimates
+        scale = 1000.0 if weights is self.length_m else 1000.0 / self.max_speed_mps
+        node_lat, node_lng = self.node_lat, self.node_lng
+
+        def estimate(node):
+            return haversine_km(float(node_lat[node]), float(node_lng[node]), goal_lat, goal_lng) * scale
+        return estimate
+
+    def _landmark_heuristic(self, goal):
+        import numpy as np
+        # time(v, goal) >= time(L, goal) - time(L, v) and >= time(v, L) - time(goal, L) for every landmark L;
+        # NaN (unreachable) terms are skipped by fmax
+        alt_from, alt_to = self.alt_from, self.alt_to
+        from_goal, to_goal = alt_from[goal], alt_to[goal]
+        fmax, reduce = np.fmax, np.fmax.reduce
+
+        def estimate(node):
+            bound = float(reduce(fmax(from_goal - alt_from[node], alt_to[node] - to_goal)))
+            return bound if bound > 0 else 0.0
+        return estimate
+
+    def path_totals(self, tree, node):
+        """(metres, seconds, toll metres) along the tree path ending at `node`."""
+        length = duration = toll = 0.0
+        previous, edge = tree[node]
+        while edge >= 0:
+            edge_length = float(self.length_m[edge])
+            length += edge_length
+            duration += float(self.time_s[edge])
+            if self.toll[edge]:
+                toll += edge_length
+            previous, edge = tree[previous]
+        return length, duration, toll
+
+
+class Router:
+    """Answers home → landmark route queries on a `RoadGraph` with the configured cost model."""
+
+    def __init__(self, graph, options):
+        self.graph = graph
+        self.options = options
+        self.weights = graph.length_m if options["OPTIMIZE"] == "distance" else graph.time_s
+
+    def _snap(self, lat, lng):
+        return self.graph.nearest_node(lat, lng, self.options["MAX_SNAP_KM"])
+
+    def _route(self, tree, node, access_km):
+        length, duration, toll = self.graph.path_totals(tree, node)
+        distance_km = length / 1000 + access_km
+        duration_min = duration / 60 + access_km / self.options["ACCESS_SPEED_KMH"] * 60
+        return Route(distance_km, duration_min, toll / 1000)
+
+    def route(self, from_lat, from_lng, to_lat, to_lng):
+        """The best `Route` between two points, or None when either is off the network or no path exists."""
+        source, source_km = self._snap(from_lat, from_lng)
+        target, target_km = self._snap(to_lat, to_lng)
+        if source is None or target is None:
+            return None
+        tree, settled = self.graph.search(source, [target], self.weights, goal=target,
+                                          max_settled=self.options["MAX_SETTLED_NODES"])
+        return self._route(tree, target, source_km + target_km) if target in settled else None
+
+    def routes_from(self, lat, lng, destinations):
+        """One `Route` (or None) per (lat, lng) in `destinations`, from a single search rooted at (lat, lng)."""
+        source, source_km = self._snap(lat, lng)
+        if source is None:
+            return [None] * len(destinations)
+        snapped = [self._snap(dest_lat, dest_lng) for dest_lat, dest_lng in destinations]
+        tree, settled = self.graph.search(source, {node for node, _ in snapped if node is not None}, self.weights,
+                                          max_settled=self.options["MAX_SETTLED_NODES"])
+        return [
+            self._route(tree, node, source_km + node_km) if node in settled else None
+            for node, node_km in snapped
+        ]
+
+    def fields(self, route):
+        """The stored `LocationImage` route columns for `route` (all None without one)."""
+        if route is None:
+            return dict.fromkeys(ROUTE_FIELDS)
+        return {
+            "road_distance_km": round(route.distance_km, 2),
+            "travel_time_min": round(route.duration_min, 1),
+            "travel_cost": route.cost(self.options),
+        }
+
+
+_router = None
+_router_loaded = False
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """The process-wide `Router` over `GRAPH_DIR`, or None when routing is not configured or the graph cannot be loaded."""
+    global _router, _router_loaded
+    if not _router_loaded:
+        with _router_lock:
+            if not _router_loaded:
+                options = get_routing_settings()
+                _router = None
+                if options["GRAPH_DIR"]:
+                    try:
+                        graph = RoadGraph.load(options["GRAPH_DIR"])
+                        _router = Router(graph, options)
+                        logger.info("✅ Loaded road graph from %s (%s nodes, %s edges)", options["GRAPH_DIR"],
+                                    graph.meta["nodes"], graph.meta["edges"])
+                    except (OSError, ValueError, KeyError) as e:
+                        logger.error("❗ Could not load road graph from %s: %s", options["GRAPH_DIR"], e)
+                _router_loaded = True
+    return _router
+
+
+def travel_fields(home_lat, home_lng, landmark_lat, landmark_lng):
+    """Route columns for home → landmark; all None without a landmark, a road graph or a route."""
+    router = get_router()
+    if router is None or landmark_lat is None or landmark_lng is None:
+        return dict.fromkeys(ROUTE_FIELDS)
+    with span("routing"):
+        return router.fields(router.route(home_lat, home_lng, landmark_lat, landmark_lng))
+
+
+def travel_fields_many(home_lat, home_lng, landmarks):
+    """`travel_fields()` for one home and many (lat, lng) landmarks, answered by one search."""
+    router = get_router()
+    if router is None:
+        return [dict.fromkeys(ROUTE_FIELDS) for _ in landmarks]
+    with span("routing"):
+        return [router.fields(route) for route in router.routes_from(home_lat, home_lng, landmarks)]
@@ -1,71 +1,212 @@
-import requests
+import asyncio
 import hashlib
-import math
-from google.cloud import vision
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 from rest_framework import serializers
 from .models import LocationImage
-from PIL import Image
-import os
+from .distance import haversine_km
+from .spatial import geohash_encode
+from .exceptions import DuplicateImage
+from .landmark_cache import get_landmark_cache
+from .geocoding import aget_coordinates, get_coordinates
+from .providers import get_provider
+from .services import ServiceUnavailable, get_service_settings
+from .instrumentation import span, timed
+from .lru import MISSING
+from .uploads import content_hash, read_content
+from .phash import dhash, find_near_duplicate, get_phash_settings, stamp_hash, stored_landmark
+from .preprocess import schedule_derivatives, vision_content
+from .storage import release_files
+from .routing import travel_fields
 import logging
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
-# Haversine Formula for Distance Calculation
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371.0  # Earth radius in km
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-
-    a = math.sin(dlat / 2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2)**2
-    c = 2 * math.asin(math.sqrt(a))
+DEFAULT_HOME_ADDRESS = "35 Davean Dr, North York, ON, Canada M2L 2R6"
 
-    return round(R * c, 2)
-
-# Function to Convert Address to Coordinates
-def get_coordinates(address):
-    url = "https://maps.googleapis.com/maps/api/geocode/json"
-    params = {"address": address, "key": os.getenv('GOOGLE_API_KEY')}
-
-    try:
-        response = requests.get(url, params=params)
-        data = response.json()
-
-        if data['status'] == 'OK':
-            location = data['results'][0]['geometry']['location']
-            return location['lat'], location['lng']
-        else:
-            print(f"❗ Geocoding Error: {data['status']} - {data.get('error_message', 'No details provided')}")
-            return None, None
-
-    except Exception as e:
-        print(f"❗ Exception in `get_coordinates()`: {e}")
-        return None, None
+# Haversine Formula for Distance Calculation (vectorized versions live in location/distance.py)
+@timed("haversine")
+def haversine(lat1, lon1, lat2, lon2):
+    return round(haversine_km(lat1, lon1, lat2, lon2), 2)
 
 # Vision API Landmark Detection
-def detect_landmark(image_file):
-    """Detect landmark dynamically using Vision API with in-memory file support."""
-    client = vision.ImageAnnotatorClient()
-
-    # Read file content directly instead of using .path
-    image_file.seek(0)  # Move the cursor to the start of the file
-    content = image_file.read()
-
-    image = vision.Image(content=content)
-    response = client.landmark_detection(image=image)
-
-    landmarks = response.landmark_annotations
-    if landmarks:
-        landmark = landmarks[0]  # Assume the most confident detection
-        return {
-            "landmark_name": landmark.description,
-            "confidence_score": round(landmark.score * 100, 2),
-            "landmark_lat": landmark.locations[0].lat_lng.latitude,
-            "landmark_lng": landmark.locations[0].lat_lng.longitude
-        }
-    return None
+@timed("landmark")
+def detect_landmark(image_file, image_hash=None, perceptual_hash=None, exclude_pk=None):
+    """
+    Detect landmark dynamically using Vision API with in-memory file support.
+    Results (including "no landmark") are cached by the image's MD5 `image_hash`,
+    so bytes we have already seen never cost another Vision call. With a `perceptual_hash`,
+    a near-duplicate row's stored result (other than `exclude_pk`) is reused as well.
+    """
+    image_hash = image_hash or content_hash(image_file)
+    if image_hash:
+        known = known_landmark(image_hash, perceptual_hash, exclude_pk)
+        if known is not MISSING:
+            return known
+
+    # Reuse the received upload buffer when there is one, otherwise read the file once
+    content = read_content(image_file)
+    try:
+        if not image_hash:
+            image_hash = hashlib.md5(content).hexdigest()
+            known = known_landmark(image_hash, perceptual_hash, exclude_pk)
+            if known is not MISSING:
+                return known
+        with span("landmark.provider"):
+            result = get_provider().detect_landmark(vision_content(content))
+    finally:
+        if isinstance(content, memoryview):
+            content.release()  # The upload's BytesIO cannot be closed while a view is exported
+
+    get_landmark_cache().set(image_hash, result)
+    return result
+
+
+def known_landmark(image_hash, perceptual_hash=None, exclude_pk=None):
+    """
+    The landmark for `image_hash` without calling Vision: the cached result, else a near-duplicate
+    row's stored one (then cached under `image_hash`). MISSING when neither exists.
+    """
+    cache = get_landmark_cache()
+    cached = cache.get(image_hash)
+    if cached is not MISSING:
+        return cached
+
+    near_duplicate = find_near_duplicate(perceptual_hash, exclude_pk=exclude_pk)
+    if near_duplicate is None:
+        return MISSING
+    logger.info("✅ Reusing landmark of near-duplicate Image ID %s", near_duplicate.id,
+                extra={"event": "landmark_reused", "source_id": near_duplicate.id})
+    result = stored_landmark(near_duplicate)
+    cache.set(image_hash, result)
+    return result
+
+
+def _vision_bytes(image_file):
+    content = read_content(image_file)
+    try:
+        return bytes(vision_content(content))
+    finally:
+        if isinstance(content, memoryview):
+            content.release()
+
+
+async def adetect_landmark(image_file, image_hash, perceptual_hash=None, exclude_pk=None):
+    """
+    Async `detect_landmark()`: cache and near-duplicate lookups run on the request's DB thread,
+    downscaling on a worker thread, and the Vision call is awaited under ASYNC_VISION_DEADLINE.
+    """
+    with span("landmark"):
+        known = await sync_to_async(known_landmark)(image_hash, perceptual_hash, exclude_pk)
+        if known is not MISSING:
+            return known
+
+        content = await sync_to_async(_vision_bytes, thread_sensitive=False)(image_file)
+        deadline = get_service_settings()["ASYNC_VISION_DEADLINE"]
+        try:
+            with span("landmark.provider"):
+                result = await asyncio.wait_for(get_provider().adetect_landmark(content), deadline)
+        except asyncio.TimeoutError as exc:
+            raise ServiceUnavailable(f"Landmark detection did not finish within {deadline}s.") from exc
+
+        await sync_to_async(get_landmark_cache().set)(image_hash, result)
+        return result
+
+
+def landmark_fields(landmark_data):
+    """Map a `detect_landmark()` result onto the stored `LocationImage` landmark columns."""
+    landmark_data = landmark_data or {}
+    return {
+        "landmark_name": landmark_data.get("landmark_name"),
+        "landmark_confidence": landmark_data.get("confidence_score"),
+        "landmark_lat": landmark_data.get("landmark_lat"),
+        "landmark_lng": landmark_data.get("landmark_lng"),
+        "landmark_geohash": geohash_encode(landmark_data["landmark_lat"], landmark_data["landmark_lng"]) if landmark_data else None,
+        "landmark_detected_at": timezone.now(),
+    }
+
+
+def enrich_image(image_file, image_hash, home_address, perceptual_hash=None, exclude_pk=None):
+    """
+    Geocode `home_address`, detect the landmark in `image_file` and compute the distance.
+    Returns the `LocationImage` field values; shared by synchronous uploads and the enrichment worker.
+    """
+    home_lat, home_lng = require_coordinates(home_address, get_coordinates(home_address))
+
+    # Detect Landmark
+    landmark_data = detect_landmark(image_file, image_hash, perceptual_hash, exclude_pk)
+    return enrichment_fields(home_address, home_lat, home_lng, landmark_data)
+
+
+async def aenrich_image(image_file, image_hash, home_address, perceptual_hash=None, exclude_pk=None):
+    """
+    `enrich_image()` with geocoding and landmark detection running concurrently, so an upload
+    waits for the slower of the two calls instead of their sum. The landmark is still detected
+    (and cached) when the address turns out to be invalid.
+    """
+    coordinates, landmark_data = await asyncio.gather(
+        aget_coordinates(home_address),
+        adetect_landmark(image_file, image_hash, perceptual_hash, exclude_pk),
+    )
+    home_lat, home_lng = require_coordinates(home_address, coordinates)
+    # Routing is CPU-bound, so keep it off the event loop
+    return await sync_to_async(enrichment_fields, thread_sensitive=False)(home_address, home_lat, home_lng, landmark_data)
+
+
+def require_coordinates(home_address, coordinates):
+    home_lat, home_lng = coordinates
+    if not home_lat or not home_lng:
+        logger.error("❗ Invalid Address - %s", home_address, extra={"event": "geocode_failed"})
+        raise serializers.ValidationError("Invalid home address. Could not fetch coordinates.")
+    return home_lat, home_lng
+
+
+def enrichment_fields(home_address, home_lat, home_lng, landmark_data):
+    fields = {
+        'latitude': home_lat,
+        'longitude': home_lng,
+        'home_address': home_address,
+    }
+
+    # Calculate Distance
+    if landmark_data:
+        fields['distance_km'] = haversine(home_lat, home_lng, landmark_data['landmark_lat'], landmark_data['landmark_lng'])
+    else:
+        fields['distance_km'] = 0.0  # Default if no landmark found
+
+    # Road distance, travel time and cost (left NULL when no road graph is configured)
+    landmark_data = landmark_data or {}
+    fields.update(travel_fields(home_lat, home_lng, landmark_data.get('landmark_lat'), landmark_data.get('landmark_lng')))
+
+    # Persist the detection so reads never call Vision again
+    fields.update(landmark_fields(landmark_data))
+    return fields
+
+
+def save_unique(instance):
+    """
+    Save `instance`, turning a unique `image_hash` violation into a 409 `DuplicateImage`.
+    A newly stored file is removed again if the row could not be written.
+    """
+    stored_name = None
+    try:
+        with span("db.save"), transaction.atomic():
+            # Store the file first so a failed insert knows what to clean up
+            if instance.image and not instance.image._committed:
+                instance.image.save(instance.image.name, instance.image.file, save=False)
+                stored_name = instance.image.name
+            instance.save()
+            if stored_name:
+                schedule_derivatives([instance.pk])  # Display copy and thumbnail, after commit
+    except IntegrityError:
+        if stored_name:
+            instance.image.storage.delete(stored_name)
+        logger.warning("❗ Duplicate Image Rejected by Constraint - Hash: %s", instance.image_hash,
+                       extra={"event": "duplicate_rejected", "image_hash": instance.image_hash})
+        raise DuplicateImage()
+    return instance
 
 
 class LocationImageSerializer(serializers.ModelSerializer):
@@ -82,63 +223,69 @@ class LocationImageSerializer(serializers.ModelSerializer):
         image = data.get('image')
         home_address = data.get('home_address', '').strip()
 
-        # Calculate the image hash
-        image_instance = LocationImage(image=image)
-        image_hash = image_instance.calculate_image_hash()
+        # Use the hash computed while the upload was received; hash the file only if it was not
+        image_hash = content_hash(image) or LocationImage(image=image).calculate_image_hash()
 
-        logger.info(f"🔍 Image Hash Calculated: {image_hash}")
+        logger.info("🔍 Image Hash Calculated: %s", image_hash, extra={"event": "image_hashed", "image_hash": image_hash})
 
-        # Check if the image already exists in the database
-        if LocationImage.objects.filter(image_hash=image_hash).exists():
-            logger.warning(f"❗ Duplicate Image Found - Hash: {image_hash}")
-            raise serializers.ValidationError("❗ This image already exists in the database and cannot be uploaded again.")
+        # Fail fast before geocoding/Vision; an index lookup on the unique `image_hash` constraint.
+        # Concurrent uploads that both pass this check are caught by the constraint in `save_unique()`.
+        with span("db.duplicate_check"):
+            duplicate = bool(image_hash) and LocationImage.objects.filter(image_hash=image_hash).exclude(pk=getattr(self.instance, 'pk', None)).exists()
+        if duplicate:
+            logger.warning("❗ Duplicate Image Found - Hash: %s", image_hash, extra={"event": "duplicate_found", "image_hash": image_hash})
+            raise DuplicateImage()
 
         # Add hash to validated data to avoid recalculation in `create()`
         data['image_hash'] = image_hash
-        logger.info(f"✅ Validation Passed - Data: {data}")
+        if image and get_phash_settings()["ENABLED"]:
+            with span("perceptual_hash"):
+                data['perceptual_hash'] = dhash(image)
         return data
 
     def create(self, validated_data):
         """Create method for saving validated data."""
-        logger.info(f"🔍 Before Create - Data Received: {validated_data}")
 
-        # Handle `home_address`
-        home_address = validated_data.pop('home_address', "35 Davean Dr, North York, ON, Canada M2L 2R6")
-        home_lat, home_lng = get_coordinates(home_address)
+        home_address = self._creation_address(validated_data)
 
-        if not home_lat or not home_lng:
-            logger.error(f"❗ Invalid Address - {home_address}")
-            raise serializers.ValidationError("Invalid home address. Could not fetch coordinates.")
+        if self.context.get('defer_enrichment'):
+            # Async ingestion: store the upload now, the enrichment worker fills in the rest
+            validated_data.update({'home_address': home_address, 'status': LocationImage.STATUS_PENDING})
+        else:
+            validated_data.update(enrich_image(
+                validated_data['image'], validated_data.get('image_hash'), home_address, validated_data.get('perceptual_hash')
+            ))
+        return self._save_created(validated_data)
 
-        # ✅ Handle Missing `image` Gracefully
-        image = validated_data.get('image')
-        if not image:
-            logger.error("❗ [ERROR] No image provided during creation.")
-            raise serializers.ValidationError({"image": "Image is required for creation."})
+    async def acreate(self, validated_data):
+        """`create()` for the ASGI upload view: geocoding and Vision run concurrently."""
 
-        # Detect Landmark
-        landmark_data = detect_landmark(image)
+        home_address = self._creation_address(validated_data)
+        validated_data.update(await aenrich_image(
+            validated_data['image'], validated_data['image_hash'], home_address, validated_data.get('perceptual_hash')
+        ))
+        return await sync_to_async(self._save_created)(validated_data)
 
-        # Calculate Distance
-        if landmark_data:
-            landmark_lat = landmark_data['landmark_lat']
-            landmark_lng = landmark_data['landmark_lng']
-            validated_data['distance_km'] = haversine(home_lat, home_lng, landmark_lat, landmark_lng)
-        else:
-            validated_data['distance_km'] = 0.0  # Default if no landmark found
+    def _creation_address(self, validated_data):
+        # Handle `home_address`
+        home_address = validated_data.pop('home_address', DEFAULT_HOME_ADDRESS)
 
-        # Save Coordinates and Home Address
-        validated_data.update({
-            'latitude': home_lat,
-            'longitude': home_lng,
-            'home_address': home_address,
-        })
-        
-        logger.info(f"✅ Final Data Before Save: {validated_data}")
+        # ✅ Handle Missing `image` Gracefully
+        if not validated_data.get('image'):
+            logger.error("❗ [ERROR] No image provided during creation.")
+            raise serializers.ValidationError({"image": "Image is required for creation."})
+        return home_address
 
+    def _save_created(self, validated_data):
         # Save Image Record
-        image_instance = super().create(validated_data)
-        logger.info(f"✅ Successfully Created Image Record with ID: {image_instance.id}")
+        perceptual_hash = validated_data.pop('perceptual_hash', None)
+        image_instance = LocationImage(**validated_data)
+        stamp_hash(image_instance, perceptual_hash)
+        image_instance = save_unique(image_instance)
+        logger.info("✅ Successfully Created Image Record with ID: %s", image_instance.id, extra={
+            "event": "image_created", "image_id": image_instance.id, "image_hash": image_instance.image_hash,
+            "landmark": image_instance.landmark_name, "status": image_instance.status,
+        })
         return image_instance
     
     
@@ -146,55 +293,72 @@ class LocationImageSerializer(serializers.ModelSerializer):
         """ Improved Update Logic: Retrieve Data for Existing `home_address` + `image` """
 
         # Handle `home_address` updates independently
+        coordinates = None
         if 'home_address' in validated_data:
+            # ✅ Repeated addresses are served from the geocoding cache instead of the API
             home_address = validated_data['home_address']
-
-            # ✅ Check if an entry with the same `home_address` + `image_hash` exists
-            existing_record = LocationImage.objects.filter(
-                home_address=home_address,
-                image_hash=instance.image_hash
-            ).first()
-
-            if existing_record:
-                # ✅ Retrieve saved data instead of recalculating
-                instance.latitude = existing_record.latitude
-                instance.longitude = existing_record.longitude
-                instance.distance_km = existing_record.distance_km
-                logger.info(f"✅ [RETRIEVED] Existing data reused for Address: {home_address}")
-            else:
-                # If no matching record, proceed with recalculation
-                home_lat, home_lng = get_coordinates(home_address)
-
-                if home_lat and home_lng:
-                    instance.latitude = home_lat
-                    instance.longitude = home_lng
-                    instance.home_address = home_address
-                    logger.info(f"✅ [ADDRESS UPDATE] Address updated to: {home_address}")
-                else:
-                    logger.error(f"❗ [ERROR] Invalid address provided: {home_address}")
-                    raise serializers.ValidationError({
-                        "home_address": "Invalid home address. Could not fetch coordinates."
-                    })
+            coordinates = self._checked_coordinates(instance, home_address, get_coordinates(home_address))
 
         # Handle `image` updates (Optional in PUT requests)
+        landmark_data = None
         new_image = validated_data.get('image')
         if new_image:
-            new_image_instance = LocationImage(image=new_image)
-            new_image_hash = new_image_instance.calculate_image_hash()
+            landmark_data = detect_landmark(
+                new_image, self._new_image_hash(validated_data), validated_data.get('perceptual_hash'), exclude_pk=instance.pk
+            )
+        return self._apply_update(instance, validated_data, coordinates, landmark_data)
 
-            # Prevent duplicate image updates
-            if LocationImage.objects.filter(image_hash=new_image_hash).exists():
-                logger.warning(f"❗ [DUPLICATE IMAGE] Attempt to update with duplicate image - Hash: {new_image_hash}")
-                raise serializers.ValidationError({
-                    "image": "❗ This image already exists. Please upload a different image."
-                })
+    async def aupdate(self, instance, validated_data):
+        """`update()` for the ASGI update view: a new address and a new image are resolved concurrently."""
 
+        calls = {}
+        if 'home_address' in validated_data:
+            calls['coordinates'] = aget_coordinates(validated_data['home_address'])
+        new_image = validated_data.get('image')
+        if new_image:
+            calls['landmark'] = adetect_landmark(
+                new_image, self._new_image_hash(validated_data), validated_data.get('perceptual_hash'), exclude_pk=instance.pk
+            )
+        results = dict(zip(calls, await asyncio.gather(*calls.values())))
+
+        coordinates = None
+        if 'coordinates' in results:
+            coordinates = self._checked_coordinates(instance, validated_data['home_address'], results['coordinates'])
+        return await sync_to_async(self._apply_update)(instance, validated_data, coordinates, results.get('landmark'))
+
+    @staticmethod
+    def _new_image_hash(validated_data):
+        if not validated_data.get('image_hash'):
+            validated_data['image_hash'] = LocationImage(image=validated_data['image']).calculate_image_hash()
+        return validated_data['image_hash']
+
+    @staticmethod
+    def _checked_coordinates(instance, home_address, coordinates):
+        home_lat, home_lng = coordinates
+        if not home_lat or not home_lng:
+            logger.error("❗ [ERROR] Invalid address provided: %s", home_address, extra={"event": "geocode_failed", "image_id": instance.id})
+            raise serializers.ValidationError({
+                "home_address": "Invalid home address. Could not fetch coordinates."
+            })
+        return home_lat, home_lng
+
+    def _apply_update(self, instance, validated_data, coordinates, landmark_data):
+        """Write a resolved address (`coordinates`) and/or new image (`landmark_data`) to `instance` and save it."""
+        if coordinates is not None:
+            instance.latitude, instance.longitude = coordinates
+            instance.home_address = validated_data['home_address']
+            if instance.landmark_name is not None:
+                instance.distance_km = haversine(instance.latitude, instance.longitude, instance.landmark_lat, instance.landmark_lng)
+            logger.info("✅ [ADDRESS UPDATE] Address updated for Image ID: %s", instance.id, extra={"event": "address_updated", "image_id": instance.id})
+
+        new_image = validated_data.get('image')
+        previous_image = instance.image.name if new_image else None
+        if new_image:
             instance.image = new_image
-            instance.image_hash = new_image_hash
-            logger.info(f"✅ [IMAGE UPDATE] Image updated successfully for Image ID: {instance.id}")
+            instance.image_hash = validated_data['image_hash']
+            stamp_hash(instance, validated_data.get('perceptual_hash'))
 
             # Landmark detection logic
-            landmark_data = detect_landmark(new_image)
             if landmark_data:
                 landmark_lat = landmark_data['landmark_lat']
                 landmark_lng = landmark_data['landmark_lng']
@@ -202,9 +366,19 @@ class LocationImageSerializer(serializers.ModelSerializer):
             else:
                 instance.distance_km = 0.0
 
-        # Save the updated instance
-        instance.save()
-        logger.info(f"✅ [SUCCESS] Successfully Updated Image Record with ID: {instance.id}")
+            for field, value in landmark_fields(landmark_data).items():
+                setattr(instance, field, value)
+
+        if coordinates is not None or new_image:
+            route = travel_fields(instance.latitude, instance.longitude, instance.landmark_lat, instance.landmark_lng)
+            for field, value in route.items():
+                setattr(instance, field, value)
+
+        # Save the updated instance (the unique `image_hash` constraint rejects duplicate images)
+        save_unique(instance)
+        if previous_image:
+            release_files(instance.image.storage, [previous_image])  # The row's reference moved to the new file
+        logger.info("✅ [SUCCESS] Successfully Updated Image Record with ID: %s", instance.id, extra={"event": "image_updated", "image_id": instance.id})
         return instance
 
 
@@ -213,16 +387,30 @@ class LocationImageSerializer(serializers.ModelSerializer):
     
     
     def to_representation(self, instance):
-        """ Ensures GET, POST, and PUT return the desired response format """
-        landmark_data = detect_landmark(instance.image)
+        """ Ensures GET, POST, and PUT return the desired response format (read from stored landmark columns) """
+        has_landmark = instance.landmark_name is not None
 
         return {
             "id": instance.id,
             "Address": instance.home_address,  #  Show dynamic address from model
             "Latitude": instance.latitude,
             "Longitude": instance.longitude,
-            "Landmark": landmark_data["landmark_name"] if landmark_data else "Unknown",
-            "Confidence Score": f"{landmark_data['confidence_score']}%" if landmark_data else "0.0%",
-            "Coordinates": f"{landmark_data['landmark_lat']}, {landmark_data['landmark_lng']}" if landmark_data else "0.0, 0.0",
-            "Distance (Haversine Formula)": f"{instance.distance_km} km"
-        }
\ No newline at end of file
+            "Landmark": instance.landmark_name if has_landmark else "Unknown",
+            "Confidence Score": f"{instance.landmark_confidence}%" if has_landmark else "0.0%",
+            "Coordinates": f"{instance.landmark_lat}, {instance.landmark_lng}" if has_landmark else "0.0, 0.0",
+            "Distance (Haversine Formula)": f"{instance.distance_km} km",
+            **({
+                "Road Distance": f"{instance.road_distance_km} km",
+                "Travel Time": f"{instance.travel_time_min} min",
+                "Travel Cost": instance.travel_cost,
+            } if instance.road_distance_km is not None else {}),
+            **({"Status": instance.status} if instance.status != LocationImage.STATUS_DONE else {}),
+            **({"Thumbnail": self.file_url(instance.thumbnail)} if self.context.get('thumbnails') else {}),
+        }
+
+    def file_url(self, field_file):
+        """ Absolute URL of a stored file, or None until it has been generated """
+        if not field_file:
+            return None
+        request = self.context.get('request')
+        return request.build_absolute_uri(field_file.url) if request else field_file.url
\ No newline at end of file
@@ -0,0 +1,434 @@
+"""
+Shared clients for the external services the location API depends on
+(Google Geocoding over HTTP and Google Vision).
+
+Each worker process owns one pooled `requests.Session` and one Vision client,
+so keep-alive connections, TLS sessions and gRPC channels are reused across
+requests. Calls go through bounded retries with jittered exponential backoff
+and a per-service circuit breaker, so an outage fails fast instead of tying up
+every worker on timeouts.
+
+The `a`-prefixed coroutines are the ASGI counterparts: an `httpx.AsyncClient` and
+a Vision `ImageAnnotatorAsyncClient` per event loop, the same retries (awaiting
+the backoff) and the same circuit breakers. Under an ASGI server the loop lives as
+long as the worker; loops that end with their request (async views run through
+`async_to_sync` under WSGI) close their clients with `aclose_loop_clients()`.
+
+The client libraries (`requests`, `httpx`, `google.cloud.vision` with gRPC and
+protobuf) are imported on first use, not with this module, so `manage.py` commands
+and worker boots that never call a service do not pay for them. `preload_clients()`
+imports them up front for servers that preload the app (gunicorn `--preload`).
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+from asgiref.sync import sync_to_async
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "GEOCODING_URL": "https://maps.googleapis.com/maps/api/geocode/json",
+    "VISION_API_ENDPOINT": None,      # e.g. "http://127.0.0.1:9090" for a local fake Vision server
+    "CONNECT_TIMEOUT": 3.05,
+    "READ_TIMEOUT": 10.0,
+    "VISION_TIMEOUT": 15.0,
+    "ASYNC_GEOCODE_DEADLINE": 15.0,   # Overall budget of one async geocode, retries included
+    "ASYNC_VISION_DEADLINE": 30.0,    # Overall budget of one async landmark detection, retries included
+    "MAX_RETRIES": 2,                 # Retries after the first attempt
+    "BACKOFF_BASE": 0.2,
+    "BACKOFF_MAX": 2.0,
+    "POOL_CONNECTIONS": 4,
+    "POOL_MAXSIZE": 20,
+    "BREAKER_FAILURE_THRESHOLD": 5,   # Consecutive failures before the circuit opens
+    "BREAKER_RESET_TIMEOUT": 30.0,    # Seconds before a half-open trial call is allowed
+}
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def get_service_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "EXTERNAL_SERVICES", {})}
+
+
+class ServiceUnavailable(Exception):
+    """Raised when a call is rejected by an open circuit breaker or retries are exhausted."""
+
+
+class CircuitBreaker:
+    """
+    Closed → open after N consecutive failures; half-open after the reset timeout, when one trial
+    call goes through while every other call keeps failing fast until the trial succeeds.
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started_at = None  # Set while the half-open trial call is in flight
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == "open":
+                raise ServiceUnavailable(f"{self.name} circuit is open; skipping call.")
+            if state == "half-open":
+                now = time.monotonic()
+                # A trial that never reported back (e.g. a cancelled coroutine) gives way after another reset period
+                if self.trial_started_at is not None and now - self.trial_started_at < self.reset_timeout:
+                    raise ServiceUnavailable(f"{self.name} circuit is half-open and a trial call is in flight; skipping call.")
+                self.trial_started_at = now
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                # A failed half-open trial re-opens the circuit for another reset period
+                if self.opened_at is None:
+                    logger.warning("❗ %s circuit opened after %s consecutive failures", self.name, self.failures)
+                self.opened_at = time.monotonic()
+            self.trial_started_at = None
+
+
+def backoff_delay(attempt, base, cap):
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def call_with_retries(func, breaker, retryable, options=None):
+    """
+    Run `func()` under `breaker`, retrying exceptions for which `retryable(exc)` is true
+    up to MAX_RETRIES times with jittered backoff. Only those count toward opening the
+    circuit: any other exception (a 4xx, an image Vision rejects) is re-raised at once.
+    """
+    options = options or get_service_settings()
+    attempts = options["MAX_RETRIES"] + 1
+    for attempt in range(attempts):
+        breaker.before_call()
+        try:
+            result = func()
+        except Exception as exc:
+            if not retryable(exc):
+                breaker.record_success()  # The dependency answered; the request itself was bad
+                raise
+            breaker.record_failure()
+            if attempt == attempts - 1:
+                raise
+            delay = backoff_delay(attempt, options["BACKOFF_BASE"], options["BACKOFF_MAX"])
+            logger.warning("❗ %s call failed (%s), retry %s/%s in %.2fs", breaker.name, exc, attempt + 1, attempts - 1, delay)
+            time.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+
+async def acall_with_retries(func, breaker, retryable, options=None):
+    """`call_with_retries()` for a coroutine function `func`; backoff delays are awaited, not slept."""
+    options = options or get_service_settings()
+    attempts = options["MAX_RETRIES"] + 1
+    for attempt in range(attempts):
+        breaker.before_call()
+        try:
+            result = await func()
+        except Exception as exc:
+            if not retryable(exc):
+                breaker.record_success()  # The dependency answered; the request itself was bad
+                raise
+            breaker.record_failure()
+            if attempt == attempts - 1:
+                raise
+            delay = backoff_delay(attempt, options["BACKOFF_BASE"], options["BACKOFF_MAX"])
+            logger.warning("❗ %s call failed (%s), retry %s/%s in %.2fs", breaker.name, exc, attempt + 1, attempts - 1, delay)
+            await asyncio.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+
+class _RetryableStatus(Exception):
+    def __init__(self, response):
+        super().__init__(f"HTTP {response.status_code}")
+        self.response = response
+
+
+def _is_retryable_http_error(exc):
+    import requests
+    return isinstance(exc, (_RetryableStatus, requests.ConnectionError, requests.Timeout))
+
+
+class _ProcessState:
+    """Clients live per process: they hold sockets/channels that must not be shared across fork()."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.session = None
+        self.vision_client = None
+        self.breakers = {}
+        # Async clients are bound to the event loop that created them
+        self.async_http_clients = weakref.WeakKeyDictionary()
+        self.async_vision_clients = weakref.WeakKeyDictionary()
+
+
+_state = _ProcessState()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_state.reset)
+
+
+def get_breaker(name):
+    with _state.lock:
+        breaker = _state.breakers.get(name)
+        if breaker is None:
+            options = get_service_settings()
+            breaker = CircuitBreaker(name, options["BREAKER_FAILURE_THRESHOLD"], options["BREAKER_RESET_TIMEOUT"])
+            _state.breakers[name] = breaker
+        return breaker
+
+
+def get_http_session():
+    """Return this process's pooled keep-alive `requests.Session`."""
+    if _state.session is None:
+        with _state.lock:
+            if _state.session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                options = get_service_settings()
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=options["POOL_CONNECTIONS"], pool_maxsize=options["POOL_MAXSIZE"])
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _state.session = session
+    return _state.session
+
+
+def http_get_json(url, params=None, service="http"):
+    """GET `url` through the shared session with timeouts, retries and the `service` circuit breaker."""
+    options = get_service_settings()
+    session = get_http_session()
+    timeout = (options["CONNECT_TIMEOUT"], options["READ_TIMEOUT"])
+
+    def attempt():
+        response = session.get(url, params=params, timeout=timeout)
+        if response.status_code in RETRY_STATUS_CODES:
+            raise _RetryableStatus(response)
+        response.raise_for_status()
+        return response.json()
+
+    try:
+        return call_with_retries(attempt, get_breaker(service), _is_retryable_http_error, options)
+    except _RetryableStatus as exc:
+        raise ServiceUnavailable(f"{service} returned HTTP {exc.response.status_code}") from exc
+
+
+def geocode(address):
+    """Raw Geocoding API response for `address`."""
+    params = {"address": address, "key": os.getenv('GOOGLE_API_KEY')}
+    return http_get_json(get_service_settings()["GEOCODING_URL"], params=params, service="geocoding")
+
+
+def get_async_http_client():
+    """Return the pooled `httpx.AsyncClient` of the running event loop."""
+    import httpx  # Only the ASGI views need it
+
+    loop = asyncio.get_running_loop()
+    client = _state.async_http_clients.get(loop)
+    if client is None:
+        options = get_service_settings()
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(options["READ_TIMEOUT"], connect=options["CONNECT_TIMEOUT"]),
+            limits=httpx.Limits(max_connections=options["POOL_MAXSIZE"], max_keepalive_connections=options["POOL_MAXSIZE"]),
+        )
+        with _state.lock:
+            _state.async_http_clients[loop] = client
+    return client
+
+
+async def ahttp_get_json(url, params=None, service="http"):
+    """Async `http_get_json()` through the event loop's `httpx.AsyncClient`."""
+    import httpx
+
+    options = get_service_settings()
+    client = get_async_http_client()
+
+    async def attempt():
+        response = await client.get(url, params=params)
+        if response.status_code in RETRY_STATUS_CODES:
+            raise _RetryableStatus(response)
+        response.raise_for_status()
+        return response.json()
+
+    try:
+        return await acall_with_retries(
+            attempt, get_breaker(service), lambda exc: isinstance(exc, (_RetryableStatus, httpx.TransportError)), options
+        )
+    except _RetryableStatus as exc:
+        raise ServiceUnavailable(f"{service} returned HTTP {exc.response.status_code}") from exc
+
+
+async def ageocode(address):
+    """Async `geocode()`."""
+    params = {"address": address, "key": os.getenv('GOOGLE_API_KEY')}
+    return await ahttp_get_json(get_service_settings()["GEOCODING_URL"], params=params, service="geocoding")
+
+
+def _build_vision_client(options):
+    from google.cloud import vision
+
+    endpoint = options["VISION_API_ENDPOINT"]
+    if endpoint and endpoint.startswith("http://"):
+        # Plain-HTTP endpoint: a local fake server speaking the Vision REST API
+        from google.auth.credentials import AnonymousCredentials
+        from google.cloud.vision_v1.services.image_annotator.transports import ImageAnnotatorRestTransport
+
+        transport = ImageAnnotatorRestTransport(
+            host=endpoint[len("http://"):],
+            credentials=AnonymousCredentials(),
+            url_scheme="http",
+        )
+        return vision.ImageAnnotatorClient(transport=transport)
+    if endpoint:
+        return vision.ImageAnnotatorClient(client_options={"api_endpoint": endpoint})
+    return vision.ImageAnnotatorClient()
+
+
+def get_vision_client():
+    """Return this process's shared Vision `ImageAnnotatorClient` (one channel, credentials loaded once)."""
+    if _state.vision_client is None:
+        with _state.lock:
+            if _state.vision_client is None:
+                _state.vision_client = _build_vision_client(get_service_settings())
+    return _state.vision_client
+
+
+def get_async_vision_client():
+    """
+    Return the running event loop's Vision `ImageAnnotatorAsyncClient` (gRPC asyncio channel),
+    or None for a plain-HTTP endpoint, which only the synchronous REST transport can reach.
+    """
+    options = get_service_settings()
+    endpoint = options["VISION_API_ENDPOINT"]
+    if endpoint and endpoint.startswith("http://"):
+        return None
+    loop = asyncio.get_running_loop()
+    client = _state.async_vision_clients.get(loop)
+    if client is None:
+        from google.cloud import vision
+
+        client_options = {"api_endpoint": endpoint} if endpoint else None
+        client = vision.ImageAnnotatorAsyncClient(client_options=client_options)
+        with _state.lock:
+            _state.async_vision_clients[loop] = client
+    return client
+
+
+async def aclose_loop_clients():
+    """Close the running event loop's async clients; for loops that end with the request (async views under WSGI)."""
+    loop = asyncio.get_running_loop()
+    with _state.lock:
+        http_client = _state.async_http_clients.pop(loop, None)
+        vision_client = _state.async_vision_clients.pop(loop, None)
+    if http_client is not None:
+        await http_client.aclose()
+    if vision_client is not None:
+        await vision_client.transport.close()
+
+
+VISION_RETRYABLE_ERRORS = (
+    "ServiceUnavailable", "DeadlineExceeded", "TooManyRequests", "InternalServerError", "BadGateway", "GatewayTimeout",
+)
+
+
+def _is_retryable_vision_error(exc):
+    from google.api_core import exceptions as google_exceptions
+    return isinstance(exc, tuple(getattr(google_exceptions, name) for name in VISION_RETRYABLE_ERRORS))
+
+
+def annotate_landmarks(content):
+    """Run Vision landmark detection on raw image bytes; returns the `AnnotateImageResponse`."""
+    from google.cloud import vision
+
+    options = get_service_settings()
+    client = get_vision_client()
+    # The protobuf message needs bytes: this is the one copy of an in-memory upload buffer
+    image = vision.Image(content=bytes(content) if isinstance(content, memoryview) else content)
+    return call_with_retries(
+        lambda: client.landmark_detection(image=image, timeout=options["VISION_TIMEOUT"], retry=None),
+        get_breaker("vision"),
+        _is_retryable_vision_error,
+        options,
+    )
+
+
+async def aannotate_landmarks(content):
+    """Async `annotate_landmarks()`; returns the `AnnotateImageResponse`."""
+    client = get_async_vision_client()
+    if client is None:
+        # Plain-HTTP (fake) endpoint: the sync REST client on a worker thread
+        return await sync_to_async(annotate_landmarks, thread_sensitive=False)(content)
+    from google.cloud import vision
+
+    options = get_service_settings()
+    feature = {"type_": vision.Feature.Type.LANDMARK_DETECTION}
+    request = {"image": {"content": bytes(content) if isinstance(content, memoryview) else content}, "features": [feature]}
+
+    async def attempt():
+        response = await client.batch_annotate_images(requests=[request], timeout=options["VISION_TIMEOUT"], retry=None)
+        return response.responses[0]
+
+    return await acall_with_retries(attempt, get_breaker("vision"), _is_retryable_vision_error, options)
+
+
+def batch_annotate_landmarks(contents):
+    """
+    Landmark detection for several images in one `batch_annotate_images` call.
+    Returns one `AnnotateImageResponse` per input, in order; check `.error.code` per item.
+    Callers must keep each batch within Vision's per-request limit (16 images).
+    """
+    from google.cloud import vision
+
+    options = get_service_settings()
+    client = get_vision_client()
+    feature = {"type_": vision.Feature.Type.LANDMARK_DETECTION, "max_results": 1}
+    requests_ = [{"image": {"content": content}, "features": [feature]} for content in contents]
+    response = call_with_retries(
+        lambda: client.batch_annotate_images(requests=requests_, timeout=options["VISION_TIMEOUT"], retry=None),
+        get_breaker("vision"),
+        _is_retryable_vision_error,
+        options,
+    )
+    return list(response.responses)
+
+
+def preload_clients():
+    """Import the client libraries now, e.g. before a preloading server forks; the clients themselves stay per process."""
+    import requests  # noqa: F401
+    from google.api_core import exceptions  # noqa: F401
+    from google.cloud import vision  # noqa: F401
+
+
+def breaker_states():
+    return {name: breaker.state for name, breaker in _state.breakers.items()}
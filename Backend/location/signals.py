@@ -0,0 +1,42 @@
+"""Model signal receivers, connected in `ApiConfig.ready()`."""
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from .authentication import get_token_cache, invalidate_user_tokens
+from .models import LocationImage
+from .purge import FILE_FIELDS
+from .response_cache import invalidate_images
+from .storage import release_files
+
+
+@receiver(post_delete, sender=LocationImage)
+def release_deleted_files(sender, instance, **kwargs):
+    """Files are reference-counted by the storage, so a deleted row can drop its references safely."""
+    release_files(instance.image.storage, [getattr(instance, field).name for field in FILE_FIELDS])
+
+
+@receiver(post_save, sender=LocationImage)
+@receiver(post_delete, sender=LocationImage)
+def invalidate_cached_responses(sender, instance, **kwargs):
+    invalidate_images([instance.pk])
+
+
+# Fields the cached token authentication keeps per token
+AUTH_FLAGS = {'is_active', 'is_staff', 'is_superuser'}
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance, **kwargs):
+    key = instance.key  # A delete clears the primary key before the transaction commits
+    transaction.on_commit(lambda: get_token_cache().invalidate(key))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user_tokens(sender, instance, created, update_fields=None, **kwargs):
+    # A user's tokens are deleted (and invalidated) with the user; saves only matter when a flag may have changed
+    if created or update_fields is not None and not AUTH_FLAGS & set(update_fields):
+        return
+    transaction.on_commit(lambda: invalidate_user_tokens(instance.pk))
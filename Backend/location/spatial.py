@@ -0,0 +1,282 @@
+"""
+Spatial lookups over stored landmarks.
+
+Two complementary indexes:
+
+* `landmark_geohash` is an indexed column, so radius queries can pre-filter rows
+  in the database to the 3×3 block of geohash cells around the origin before
+  computing exact distances.
+* `LandmarkIndex` is an in-memory KD-tree over landmarks as unit-sphere (x, y, z)
+  vectors, answering exact k-nearest-neighbour queries in O(log n). Straight-line
+  (chord) distance on the unit sphere orders points the same way as great-circle
+  distance.
+"""
+import heapq
+import math
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from .distance import EARTH_RADIUS_KM, haversine_one_to_many
+from .models import LocationImage
+
+DEFAULT_SETTINGS = {
+    "GEOHASH_PRECISION": 9,      # Stored precision (~5 m cells)
+    "KDTREE_LEAF_SIZE": 16,
+    "REBUILD_INTERVAL": 300,     # Seconds before the in-memory tree is rebuilt from the database
+    "MAX_DELTA_FRACTION": 0.1,   # Rebuild early once rows changed since the build exceed this share
+    "REFRESH_OVERLAP": 60,       # Seconds of `landmark_detected_at` re-read per refresh (commit delays, clock skew)
+}
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def get_spatial_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "SPATIAL_INDEX", {})}
+
+
+# ---- Geohash ----------------------------------------------------------------
+
+def geohash_encode(lat, lng, precision=None):
+    """Standard base-32 geohash of a point."""
+    precision = precision or get_spatial_settings()["GEOHASH_PRECISION"]
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, coord = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if coord >= mid:
+            value = (value << 1) | 1
+            rng[0] = mid
+        else:
+            value <<= 1
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+def geohash_cell_size(precision):
+    """(lat_degrees, lng_degrees) covered by one cell at `precision`."""
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lng_bits)
+
+
+def geohash_cover(lat, lng, radius_km):
+    """
+    Geohash prefixes (the origin's cell and its 8 neighbours) that together contain every
+    point within `radius_km`, at the finest precision where that holds. None means no
+    useful prefix (the radius spans a large part of the globe).
+    """
+    lat_radius = radius_km / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(min(abs(lat) + lat_radius, 90.0)))
+    lng_radius = radius_km / (KM_PER_DEGREE * cos_lat) if cos_lat > 1e-9 else 360.0
+
+    precision = 0
+    for candidate in range(1, get_spatial_settings()["GEOHASH_PRECISION"] + 1):
+        cell_lat, cell_lng = geohash_cell_size(candidate)
+        if cell_lat < lat_radius or cell_lng < lng_radius:
+            break
+        precision = candidate
+    if precision == 0:
+        return None
+
+    cell_lat, cell_lng = geohash_cell_size(precision)
+    prefixes = set()
+    for dlat in (-cell_lat, 0.0, cell_lat):
+        for dlng in (-cell_lng, 0.0, cell_lng):
+            neighbour_lat = max(-90.0, min(90.0, lat + dlat))
+            neighbour_lng = (lng + dlng + 180.0) % 360.0 - 180.0
+            prefixes.add(geohash_encode(neighbour_lat, neighbour_lng, precision))
+    return sorted(prefixes)
+
+
+# ---- KD-tree ----------------------------------------------------------------
+
+def to_unit_vectors(lats, lngs):
+    import numpy as np
+    lat, lng = np.radians(np.asarray(lats, dtype=np.float64)), np.radians(np.asarray(lngs, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)))
+
+
+def km_to_chord(distance_km):
+    return 2 * math.sin(min(distance_km / EARTH_RADIUS_KM, math.pi) / 2)
+
+
+class KDTree:
+    """Array-backed KD-tree over 3-D points with vectorized leaf scans."""
+
+    def __init__(self, points, leaf_size=16):
+        import numpy as np
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        self.order = np.arange(len(self.points))
+        self.leaf_size = leaf_size
+        # Per node: start, stop (slice of `order`), split axis (-1 for leaves), split value, children
+        self.nodes = []
+        if len(self.points):
+            self._build()
+
+    def _build(self):
+        import numpy as np
+        stack = [(0, len(self.points), None, None)]
+        while stack:
+            start, stop, parent, side = stack.pop()
+            node_id = len(self.nodes)
+            if parent is not None:
+                self.nodes[parent][side] = node_id
+
+            indices = self.order[start:stop]
+            if stop - start <= self.leaf_size:
+                self.nodes.append([start, stop, -1, 0.0, None, None])
+                continue
+
+            block = self.points[indices]
+            axis = int(np.argmax(block.max(axis=0) - block.min(axis=0)))
+            mid = (stop - start) // 2
+            partition = np.argpartition(block[:, axis], mid)
+            self.order[start:stop] = indices[partition]
+            split = float(self.points[self.order[start + mid], axis])
+            self.nodes.append([start, stop, axis, split, None, None])
+            stack.append((start + mid, stop, node_id, 5))
+            stack.append((start, start + mid, node_id, 4))
+
+    def query(self, point, k, max_chord=math.inf):
+        """Up to `k` nearest (chord_distance, point_index) pairs, closest first, within `max_chord`."""
+        if not self.nodes or k <= 0:
+            return []
+        import numpy as np
+        point = np.asarray(point, dtype=np.float64)
+        best = []  # Max-heap of (-distance, index)
+        bound = max_chord
+
+        stack = [(0.0, 0)]
+        while stack:
+            plane_distance, node_id = stack.pop()
+            if plane_distance > bound:
+                continue
+            start, stop, axis, split, left, right = self.nodes[node_id]
+            if axis < 0:
+                indices = self.order[start:stop]
+                distances = np.sqrt(((self.points[indices] - point) ** 2).sum(axis=1))
+                for distance, index in zip(distances.tolist(), indices.tolist()):
+                    if distance > bound:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, index))
+                    else:
+                        heapq.heappushpop(best, (-distance, index))
+                    if len(best) == k:
+                        bound = min(max_chord, -best[0][0])
+                continue
+
+            gap = point[axis] - split
+            near, far = (left, right) if gap < 0 else (right, left)
+            # Visit the near side first: push the far side underneath it
+            stack.append((abs(gap), far))
+            stack.append((plane_distance, near))
+
+        return sorted((-negative, index) for negative, index in best)
+
+
+class LandmarkIndex:
+    """
+    Process-wide KD-tree of stored landmark coordinates. Rows whose landmark was stored since
+    the previous refresh (by `landmark_detected_at`, so rows enriched after their insert are
+    included) are kept in a small delta that is scanned linearly and supersedes their tree
+    entry; the tree is rebuilt when the delta grows past MAX_DELTA_FRACTION or
+    REBUILD_INTERVAL elapses.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tree = None
+        self.ids = []
+        self.built_at = 0.0
+        self.refreshed_at = None
+        self.delta = {}  # pk → unit vector of its current landmark, or None when it no longer has one
+
+    def rebuild(self):
+        with self._lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        import numpy as np
+        started_at = timezone.now()
+        rows = np.array(list(
+            LocationImage.objects.filter(landmark_lat__isnull=False, landmark_lng__isnull=False)
+            .values_list('pk', 'landmark_lat', 'landmark_lng')
+        ), dtype=np.float64).reshape(-1, 3)
+        self.ids = rows[:, 0].astype(np.int64)
+        self.tree = KDTree(to_unit_vectors(rows[:, 1], rows[:, 2]), leaf_size=get_spatial_settings()["KDTREE_LEAF_SIZE"])
+        self.delta = {}
+        self.refreshed_at = started_at
+        self.built_at = time.monotonic()
+
+    def _refresh(self):
+        options = get_spatial_settings()
+        if self.tree is None or time.monotonic() - self.built_at > options["REBUILD_INTERVAL"]:
+            self._rebuild()
+            return
+        started_at = timezone.now()
+        since = self.refreshed_at - timedelta(seconds=options["REFRESH_OVERLAP"])
+        changed = LocationImage.objects.filter(landmark_detected_at__gte=since).values_list('pk', 'landmark_lat', 'landmark_lng')
+        for pk, lat, lng in changed:
+            self.delta[pk] = None if lat is None or lng is None else to_unit_vectors([lat], [lng])[0]
+        self.refreshed_at = started_at
+        if len(self.delta) > options["MAX_DELTA_FRACTION"] * max(len(self.ids), 100):
+            self._rebuild()
+
+    def nearest(self, lat, lng, k, radius_km=None):
+        """[(id, distance_km)] for up to `k` landmarks nearest to (lat, lng), optionally within `radius_km`."""
+        import numpy as np
+        point = to_unit_vectors([lat], [lng])[0]
+        max_chord = km_to_chord(radius_km) if radius_km is not None else math.inf
+        with self._lock:
+            self._refresh()
+            # Tree entries of rows in the delta are outdated: ask for enough extra to make up for them
+            found = []
+            for chord, index in self.tree.query(point, k + len(self.delta), max_chord):
+                pk = int(self.ids[index])
+                if pk not in self.delta:
+                    found.append((chord, pk))
+            current = [(pk, vector) for pk, vector in self.delta.items() if vector is not None]
+            if current:
+                chords = np.sqrt(((np.array([vector for _, vector in current]) - point) ** 2).sum(axis=1))
+                found.extend((chord, pk) for chord, (pk, _) in zip(chords.tolist(), current) if chord <= max_chord)
+        found.sort()
+        return [(pk, 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2, 1.0))) for chord, pk in found[:k]]
+
+
+landmark_index = LandmarkIndex()
+
+
+def landmarks_within(lat, lng, radius_km, queryset=None):
+    """
+    [(id, distance_km)] for every landmark within `radius_km`, closest first.
+    The geohash column narrows the rows in the database; distances are then exact.
+    """
+    import numpy as np
+    queryset = queryset if queryset is not None else LocationImage.objects.all()
+    queryset = queryset.filter(landmark_lat__isnull=False, landmark_lng__isnull=False)
+    prefixes = geohash_cover(lat, lng, radius_km)
+    if prefixes:
+        condition = Q()
+        for prefix in prefixes:
+            condition |= Q(landmark_geohash__startswith=prefix)
+        queryset = queryset.filter(condition)
+
+    rows = np.array(list(queryset.values_list('pk', 'landmark_lat', 'landmark_lng')), dtype=np.float64).reshape(-1, 3)
+    distances = haversine_one_to_many(lat, lng, rows[:, 1], rows[:, 2])
+    inside = distances <= radius_km
+    ids, distances = rows[inside, 0].astype(np.int64), distances[inside]
+    order = np.argsort(distances, kind='stable')
+    return list(zip(ids[order].tolist(), distances[order].tolist()))
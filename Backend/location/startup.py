@@ -0,0 +1,116 @@
+"""
+Process startup: preloading for forking servers and import-time measurement.
+
+`preload()` imports everything a request needs (the URLconf with every view and
+serializer, the client libraries that location/services.py imports lazily, and NumPy) without
+opening connections or creating clients. gunicorn.conf.py calls it in the master when
+`preload_app` is on, so forked workers share those modules instead of importing them.
+
+`measure_imports()` runs `django.setup()` and imports the URLconf in a fresh interpreter
+with `-X importtime`; `manage.py report_import_time` prints the result and, with
+`--check`, fails when startup exceeds IMPORT_TIME["BUDGET_MS"] or imports a module
+listed in IMPORT_TIME["DEFERRED_MODULES"].
+"""
+import os
+import re
+import statistics
+import subprocess
+import sys
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "BUDGET_MS": 1500,     # Median wall time of `django.setup()` plus the URLconf import
+    "RUNS": 3,             # Fresh interpreters measured per report
+    # Imported on first use only; `--check` fails if startup imports any of them
+    "DEFERRED_MODULES": ["google.cloud.vision", "google.api_core", "grpc", "numpy"],
+}
+
+_IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+_WALL = "startup-wall-seconds"
+
+
+def get_import_time_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "IMPORT_TIME", {})}
+
+
+def preload():
+    """Import the URLconf (every view, serializer and their dependencies) and the lazily imported client libraries."""
+    from django.db import connections
+    from django.urls import get_resolver
+    from . import services
+
+    get_resolver().url_patterns
+    services.preload_clients()
+    import numpy  # noqa: F401  (spatial, routing and distance code imports it on first use)
+    connections.close_all()  # Never hand an open connection to forked workers
+    logger.info("✅ Application preloaded")
+
+
+class ImportReport:
+    """`-X importtime` output of one interpreter: [(module, self µs, cumulative µs, depth)] plus the wall time."""
+
+    def __init__(self, modules, wall_ms):
+        self.modules = modules
+        self.wall_ms = wall_ms
+
+    @property
+    def total_ms(self):
+        return sum(self_us for _, self_us, _, _ in self.modules) / 1000
+
+    def loaded(self, name):
+        """Whether `name` or one of its submodules was imported."""
+        return any(module == name or module.startswith(name + ".") for module, *_ in self.modules)
+
+    def by_package(self):
+        """[(top-level package, self ms)], slowest first."""
+        totals = {}
+        for module, self_us, _, _ in self.modules:
+            package = module.split(".")[0]
+            totals[package] = totals.get(package, 0) + self_us
+        return sorted(((package, us / 1000) for package, us in totals.items()), key=lambda item: -item[1])
+
+    def slowest(self):
+        """[(module, cumulative ms)] of the modules imported directly by `django.setup()` or the URLconf, slowest first."""
+        top = [(module, cumulative_us / 1000) for module, _, cumulative_us, depth in self.modules if depth == 0]
+        return sorted(top, key=lambda item: -item[1])
+
+
+def measure_imports(target=None):
+    """Run `django.setup()` and import `target` (default ROOT_URLCONF) in a fresh interpreter; return its ImportReport."""
+    target = target or settings.ROOT_URLCONF
+    code = (
+        "import time; start = time.perf_counter()\n"
+        "import django; django.setup()\n"
+        f"import importlib; importlib.import_module({target!r})\n"
+        f"print({_WALL!r}, time.perf_counter() - start)\n"
+    )
+    env = {
+        **os.environ,
+        "DJANGO_SETTINGS_MODULE": os.environ.get("DJANGO_SETTINGS_MODULE", "server_location_map.settings"),
+        "PYTHONPATH": os.pathsep.join(path for path in sys.path if path),  # Resolve the same modules as this process
+    }
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, env=env, cwd=settings.BASE_DIR,
+    )
+    if result.returncode:
+        raise RuntimeError(f"Importing {target} failed:\n{result.stderr[-2000:]}")
+
+    modules = []
+    for line in result.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            modules.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    wall = next(line.split()[1] for line in result.stdout.splitlines() if line.startswith(_WALL))
+    return ImportReport(modules, float(wall) * 1000)
+
+
+def measure_startup(runs, target=None):
+    """(median wall ms, report of the median run) over `runs` fresh interpreters."""
+    reports = sorted((measure_imports(target) for _ in range(max(runs, 1))), key=lambda report: report.wall_ms)
+    median = statistics.median(report.wall_ms for report in reports)
+    return median, reports[len(reports) // 2]
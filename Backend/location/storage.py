@@ -0,0 +1,241 @@
+"""
+Content-addressed, sharded media storage.
+
+Files keep the directory their field's `upload_to` chooses but are named by the MD5
+of their bytes, sharded below it: `uploads/ab/cd/abcd….jpg`. For an original upload
+that name is its `image_hash`. The client's filename only contributes the extension,
+so there is no collision probing and no directory grows without bound.
+
+Writes go to a temporary file under MEDIA_ROOT which is published with `os.link()`:
+a file appears complete or not at all, and an existing copy is never overwritten.
+Identical content is stored once.
+
+Every `save()` takes a reference, kept as a hard link to the file in the shard's
+`.refs` directory, and `delete()` drops one; the file itself goes with the last
+reference. Saves and deletes within a shard are serialized by a lock file. Files
+stored before this backend have no references and are deleted outright, as before.
+
+Filesystems without hard links (SMB mounts such as Azure Files / App Service
+storage) are detected on the first failed link, or declared with HARD_LINKS=False:
+files are then published with an atomic rename under the shard lock and references
+are empty marker files. Deduplication and reference counting work the same way.
+"""
+import errno
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+import uuid
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.files import locks
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from .uploads import content_hash
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "SHARD_LEVELS": 2,          # Directory levels below the `upload_to` directory
+    "SHARD_WIDTH": 2,           # Hex characters of the hash per level
+    "FSYNC": True,              # Flush file data to disk before publishing it
+    "TEMP_DIR": ".tmp",         # Under MEDIA_ROOT, so publishing never crosses filesystems
+    "HARD_LINKS": True,         # False for filesystems without hard links (detected on the first failure too)
+    "MIGRATION_WORKERS": 8,     # Threads used by `manage.py migrate_media_storage`
+}
+
+# What a filesystem without hard link support (e.g. SMB/CIFS) raises from `os.link()`
+NO_HARD_LINKS = {errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP, errno.ENOSYS, errno.EXDEV}
+
+REFS_DIR = ".refs"
+LOCK_FILE = ".lock"
+
+_CONTENT_NAME = re.compile(r"(?:^|/)(?:[0-9a-f]+/)+([0-9a-f]{32})(\.\w+)?$")
+
+
+def get_storage_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "LOCATION_STORAGE", {})}
+
+
+def is_content_addressed(name):
+    """True for names produced by `ContentAddressedStorage` (sharded MD5 file names)."""
+    match = _CONTENT_NAME.search(name or "")
+    if not match:
+        return False
+    options = get_storage_settings()
+    digest = match.group(1)
+    shards = name.split("/")[-1 - options["SHARD_LEVELS"]:-1]
+    width = options["SHARD_WIDTH"]
+    return shards == [digest[i * width:(i + 1) * width] for i in range(options["SHARD_LEVELS"])]
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hard_links = get_storage_settings()["HARD_LINKS"]
+
+    def content_name(self, directory, digest, extension):
+        options = get_storage_settings()
+        width = options["SHARD_WIDTH"]
+        shards = [digest[i * width:(i + 1) * width] for i in range(options["SHARD_LEVELS"])]
+        return posixpath.join(directory, *shards, digest + extension)
+
+    def get_available_name(self, name, max_length=None):
+        # `_save()` derives the final name from the content, so there is nothing to probe for
+        return name
+
+    def _save(self, name, content):
+        directory = posixpath.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+
+        # Uploads hashed on receipt: an already stored copy costs no write at all
+        digest = content_hash(content)
+        if digest:
+            final = self.content_name(directory, digest, extension)
+            if self._add_reference(final):
+                return final
+
+        temp_path, digest = self._write_temp(content)
+        final = self.content_name(directory, digest, extension)
+        try:
+            self._publish(temp_path, final)
+        finally:
+            if os.path.exists(temp_path):  # Renamed into place when there are no hard links
+                os.unlink(temp_path)
+        return final
+
+    def _write_temp(self, content):
+        """Copy `content` into a new temporary file, hashing it on the way; returns (path, md5)."""
+        options = get_storage_settings()
+        temp_dir = self.path(options["TEMP_DIR"])
+        os.makedirs(temp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+        hasher = hashlib.md5()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in content.chunks():
+                    hasher.update(chunk)
+                    f.write(chunk)
+                if options["FSYNC"]:
+                    f.flush()
+                    os.fsync(f.fileno())
+            if self.file_permissions_mode is not None:
+                os.chmod(temp_path, self.file_permissions_mode)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return temp_path, hasher.hexdigest()
+
+    def _makedirs(self, directory):
+        if self.directory_permissions_mode is not None:
+            # Same as FileSystemStorage: apply the mode exactly, regardless of the umask
+            old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+            try:
+                os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+            finally:
+                os.umask(old_umask)
+        else:
+            os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def _shard_lock(self, path):
+        with open(os.path.join(os.path.dirname(path), LOCK_FILE), "ab") as lock_file:
+            locks.lock(lock_file, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(lock_file)
+
+    def _link(self, source, target):
+        """Hard-link `source` as `target`; False (and no link) when the filesystem has no hard links."""
+        if not self.hard_links:
+            return False
+        try:
+            os.link(source, target)
+        except FileExistsError:
+            raise
+        except OSError as e:
+            if e.errno not in NO_HARD_LINKS:
+                raise
+            logger.warning("⚠️ No hard links under %s (%s); using renames and reference marker files", self.location, e)
+            self.hard_links = False
+            return False
+        return True
+
+    def _link_reference(self, path):
+        refs = os.path.join(os.path.dirname(path), REFS_DIR)
+        os.makedirs(refs, exist_ok=True)
+        reference = os.path.join(refs, f"{os.path.basename(path)}.{uuid.uuid4().hex}")
+        if not self._link(path, reference):
+            open(reference, "xb").close()  # Only the number of entries matters
+
+    @staticmethod
+    def _reference_paths(path):
+        refs = os.path.join(os.path.dirname(path), REFS_DIR)
+        prefix = os.path.basename(path) + "."
+        try:
+            return sorted(os.path.join(refs, entry) for entry in os.listdir(refs) if entry.startswith(prefix))
+        except FileNotFoundError:
+            return []
+
+    def _publish(self, temp_path, name):
+        path = self.path(name)
+        self._makedirs(os.path.dirname(path))
+        with self._shard_lock(path):
+            try:
+                if not self._link(temp_path, path) and not os.path.exists(path):
+                    os.replace(temp_path, path)  # Atomic too; the shard lock rules out overwriting a concurrent publish
+            except FileExistsError:
+                pass  # Same bytes are already stored under this name
+            self._link_reference(path)
+
+    def _add_reference(self, name):
+        """Take a reference on `name` if it is already stored; False when it is not."""
+        path = self.path(name)
+        if not os.path.isdir(os.path.dirname(path)):
+            return False
+        with self._shard_lock(path):
+            if not os.path.exists(path):
+                return False
+            self._link_reference(path)
+        return True
+
+    def references(self, name):
+        """How many saves of `name` have not been deleted yet."""
+        return len(self._reference_paths(self.path(name)))
+
+    def delete(self, name):
+        """Drop one reference to `name`; the file is removed with its last reference."""
+        if not name:
+            raise ValueError("The name must be given to delete().")
+        path = self.path(name)
+        if not os.path.isdir(os.path.dirname(path)):
+            return
+        with self._shard_lock(path):
+            references = self._reference_paths(path)
+            if references:
+                os.unlink(references[0])
+                if len(references) > 1:
+                    return
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def release_files(storage, names):
+    """Drop one storage reference per name once the current transaction commits."""
+    names = [name for name in names if name]
+    if not names:
+        return
+
+    def release():
+        for name in names:
+            try:
+                storage.delete(name)
+            except OSError as e:
+                logger.error("❗ Could not release %s: %s", name, e)
+
+    transaction.on_commit(release)
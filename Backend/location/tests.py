@@ -1,3 +1,867 @@
-from django.test import TestCase
+import contextlib
+import gzip
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+from . import authentication, batch, distance, geocoding, landmark_cache, providers, response_cache, routing, services, spatial
+from .authentication import CachedTokenAuthentication
+from .benchmarks import compare_results
+from .distance import haversine_km, haversine_matrix, haversine_one_to_many, haversine_pairs
+from .landmark_cache import DatabaseLandmarkCache, LocMemLandmarkCache
+from .logs import JsonFormatter, QueueStreamHandler
+from .lru import MISSING
+from .models import EnrichmentJob, GeocodedAddress, LandmarkCacheEntry, LocationImage
+from .pagination import KeysetPagination
+from .phash import BKTree, dhash, hamming, near_duplicates, stamp_hash
+from .preprocess import render_derivatives, vision_content
+from .serializers import detect_landmark
+from .spatial import geohash_encode
+from .startup import ImportReport
+from .storage import ContentAddressedStorage
+from .uploads import content_hash
 
-# Create your tests here.
+# Offline provider that finds a landmark in every image and geocodes any address
+TEST_PROVIDER = {
+    "BACKEND": "location.providers.GazetteerProvider",
+    "NO_LANDMARK_RATE": 0.0,
+    "SYNTHESIZE_UNKNOWN": True,
+}
+HOME_ADDRESS = "35 Davean Dr, North York, ON, Canada M2L 2R6"
+
+
+def jpeg(seed, size=(64, 64)):
+    """Distinct random-noise JPEG bytes for `seed`."""
+    pixels = np.random.default_rng(seed).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def gradient(size, flip=False):
+    """A smooth grayscale gradient (stable under resizing, unlike noise) as JPEG bytes."""
+    x = np.linspace(0, 255, size[0])
+    y = np.linspace(0, 255, size[1])[:, None]
+    pixels = ((x + y) / 2).astype(np.uint8)
+    if flip:
+        pixels = pixels[:, ::-1]
+    buffer = io.BytesIO()
+    Image.fromarray(pixels, "L").convert("RGB").save(buffer, "JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def upload(seed, name=None):
+    return SimpleUploadedFile(name or f"image_{seed}.jpg", jpeg(seed), content_type="image/jpeg")
+
+
+def reset_process_state():
+    """Drop the process-wide singletons so each test sees its own settings."""
+    providers._provider = None
+    landmark_cache._landmark_cache = None
+    geocoding._geocoding_cache = None
+    authentication._token_cache = None
+    response_cache._response_cache = None
+    routing._router, routing._router_loaded = None, False
+    near_duplicates.reset()
+    spatial.landmark_index.tree = None
+    services._state.reset()
+    cache.clear()
+
+
+@override_settings(
+    LOCATION_PROVIDER=TEST_PROVIDER,
+    RESPONSE_CACHE={"ENABLED": False},
+    LOCATION_INGESTION={"ASYNC": False, "RUN_IN_PROCESS": False},
+    IMAGE_PREPROCESSING={"ENABLED": False},
+    INSTRUMENTATION={"ENABLED": True, "SERVER_TIMING": True, "PROFILE_SAMPLE_RATE": 0},
+)
+class LocationTestCase(TestCase):
+    """Temporary MEDIA_ROOT, the offline provider and a superuser API client."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp(prefix="location_tests_")
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        reset_process_state()
+        self.addCleanup(reset_process_state)
+
+        self.user = get_user_model().objects.create_superuser("admin", "admin@example.com", "password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, seed, **data):
+        response = self.client.post(
+            "/api/location/upload/", {"image": upload(seed), "home_address": HOME_ADDRESS, **data}, format="multipart"
+        )
+        self.assertEqual(response.status_code, 201, getattr(response, "data", response.content))
+        return LocationImage.objects.get(pk=response.data["id"])
+
+
+class LandmarkStorageTests(LocationTestCase):
+    def test_upload_stores_landmark_and_reads_do_not_call_the_provider(self):
+        image = self.upload(1)
+        self.assertIsNotNone(image.landmark_name)
+        self.assertIsNotNone(image.landmark_detected_at)
+        self.assertIsNotNone(image.distance_km)
+
+        with mock.patch.object(providers.GazetteerProvider, "detect_landmark", side_effect=AssertionError("called")):
+            response = self.client.get(f"/api/location/images/{image.pk}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["Landmark"], image.landmark_name)
+
+
+class LandmarkCacheTests(LocationTestCase):
+    def test_repeated_bytes_cost_one_provider_call(self):
+        content = jpeg(2)
+        digest = hashlib.md5(content).hexdigest()
+        provider = providers.get_provider()
+        with mock.patch.object(provider, "detect_landmark", wraps=provider.detect_landmark) as detect:
+            first = detect_landmark(ContentFile(content), digest)
+            second = detect_landmark(ContentFile(content), digest)
+        self.assertEqual(first, second)
+        self.assertEqual(detect.call_count, 1)
+
+    def test_negative_results_are_cached(self):
+        cache = LocMemLandmarkCache({**landmark_cache.DEFAULT_SETTINGS})
+        self.assertIs(cache.get("a" * 32), MISSING)
+        cache.set("a" * 32, None)
+        self.assertIsNone(cache.get("a" * 32))
+        self.assertEqual(cache.stats()["negative_hits"], 1)
+
+    def test_database_cache_culls_every_n_writes(self):
+        cache = DatabaseLandmarkCache({**landmark_cache.DEFAULT_SETTINGS, "MAX_ENTRIES": 2, "CULL_EVERY": 3})
+        for i in range(2):
+            cache.set(f"{i:032x}", {"landmark_name": str(i)})
+        self.assertEqual(LandmarkCacheEntry.objects.count(), 2)
+        cache.set(f"{2:032x}", None)  # Third write: over the limit and due for a cull
+        self.assertEqual(LandmarkCacheEntry.objects.count(), 2)
+        cache.set(f"{3:032x}", None)  # Not due: the table may run over until the next cull
+        self.assertEqual(LandmarkCacheEntry.objects.count(), 3)
+
+
+class GeocodingCacheTests(LocationTestCase):
+    def test_normalized_addresses_share_one_lookup(self):
+        self.assertEqual(geocoding.normalize_address("35 Davean Dr., North  York"), "35 davean dr north york")
+        provider = providers.get_provider()
+        with mock.patch.object(provider, "geocode", wraps=provider.geocode) as geocode:
+            first = geocoding.get_coordinates("35 Davean Dr., North York")
+            second = geocoding.get_coordinates("35  davean dr north york")
+        self.assertEqual(first, second)
+        self.assertEqual(geocode.call_count, 1)
+        self.assertTrue(GeocodedAddress.objects.filter(normalized_address="35 davean dr north york").exists())
+
+    def test_stale_row_is_served_when_the_refresh_fails(self):
+        GeocodedAddress.objects.create(normalized_address="somewhere", address="Somewhere", latitude=1.0, longitude=2.0)
+        GeocodedAddress.objects.update(updated_at=timezone.now() - timedelta(days=365))
+        with mock.patch.object(geocoding, "fetch_coordinates", return_value=(None, None)):
+            self.assertEqual(geocoding.get_coordinates("Somewhere"), (1.0, 2.0))
+
+
+class FakeServer:
+    """A local HTTP server answering GETs with the queued (status, JSON body) pairs."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                status, body = server.responses.pop(0) if server.responses else (200, {})
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@override_settings(EXTERNAL_SERVICES={"MAX_RETRIES": 2, "BACKOFF_BASE": 0, "BREAKER_FAILURE_THRESHOLD": 3})
+class ServiceTests(SimpleTestCase):
+    def setUp(self):
+        services._state.reset()
+        self.addCleanup(services._state.reset)
+
+    def test_retries_a_failing_server_until_it_answers(self):
+        with FakeServer([(503, {}), (200, {"status": "OK"})]) as server:
+            self.assertEqual(services.http_get_json(server.url, service="fake"), {"status": "OK"})
+        self.assertEqual(server.requests, 2)
+        self.assertEqual(services.get_breaker("fake").state, "closed")
+
+    def test_open_circuit_fails_fast(self):
+        with FakeServer([(503, {})] * 3) as server:
+            with self.assertRaises(services.ServiceUnavailable):
+                services.http_get_json(server.url, service="fake")
+            with self.assertRaises(services.ServiceUnavailable):
+                services.http_get_json(server.url, service="fake")
+        self.assertEqual(server.requests, 3)
+        self.assertEqual(services.get_breaker("fake").state, "open")
+
+    def test_client_errors_do_not_open_the_circuit(self):
+        with FakeServer([(400, {})] * 4) as server:
+            for _ in range(4):
+                with self.assertRaises(Exception) as raised:
+                    services.http_get_json(server.url, service="fake")
+                self.assertNotIsInstance(raised.exception, services.ServiceUnavailable)
+        self.assertEqual(server.requests, 4)  # Not retried either
+        self.assertEqual(services.get_breaker("fake").state, "closed")
+
+    def test_session_is_shared(self):
+        self.assertIs(services.get_http_session(), services.get_http_session())
+
+    def test_half_open_circuit_lets_one_trial_through(self):
+        breaker = services.CircuitBreaker("trial", failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        breaker.opened_at -= 60
+        self.assertEqual(breaker.state, "half-open")
+        breaker.before_call()  # The trial
+        with self.assertRaises(services.ServiceUnavailable):
+            breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        breaker.before_call()
+
+    def test_failed_trial_reopens_the_circuit(self):
+        breaker = services.CircuitBreaker("trial", failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        breaker.opened_at -= 60
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+
+
+class AsyncIngestionTests(LocationTestCase):
+    def test_async_upload_is_enriched_by_the_job(self):
+        response = self.client.post(
+            "/api/location/upload/?async=true", {"image": upload(3), "home_address": HOME_ADDRESS}, format="multipart"
+        )
+        self.assertEqual(response.status_code, 202)
+        image = LocationImage.objects.get(pk=response.data["id"])
+        self.assertEqual(image.status, LocationImage.STATUS_PENDING)
+        self.assertIsNone(image.landmark_name)
+
+        from .jobs import claim_jobs, process_job
+        claimed = claim_jobs(10)
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(claim_jobs(10), [])  # Claimed jobs are not handed out twice
+        self.assertTrue(process_job(claimed[0]))
+
+        image.refresh_from_db()
+        self.assertEqual(image.status, LocationImage.STATUS_DONE)
+        self.assertIsNotNone(image.landmark_name)
+        self.assertEqual(EnrichmentJob.objects.get(pk=claimed[0]).status, EnrichmentJob.STATUS_DONE)
+        status = self.client.get(f"/api/location/images/{image.pk}/status/")
+        self.assertEqual(status.data["status"], LocationImage.STATUS_DONE)
+
+
+@mock.patch("location.batch.get_coordinates", return_value=(43.65, -79.38))
+class BatchUploadTests(LocationTestCase):
+    def test_chunks_report_each_item(self, _):
+        good = jpeg(10)
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as bundle:
+            for seed in range(11, 16):
+                bundle.writestr(f"img{seed}.jpg", jpeg(seed))
+            bundle.writestr("again.jpg", good)  # Same bytes as the first file, in a later chunk
+        data = {
+            "images": [SimpleUploadedFile("good.jpg", good), SimpleUploadedFile("broken.jpg", good[:len(good) * 2 // 3])],
+            "archive": SimpleUploadedFile("bundle.zip", archive.getvalue()),
+            "home_address": HOME_ADDRESS,
+        }
+        with override_settings(LOCATION_BATCH_UPLOAD={"CHUNK_SIZE": 3}):
+            response = self.client.post("/api/location/upload/batch/", data, format="multipart")
+
+        self.assertEqual(response.status_code, 201)
+        statuses = {item["filename"]: item["status"] for item in response.data["results"]}
+        self.assertEqual(len(statuses), 8)
+        self.assertEqual(statuses["good.jpg"], "created")
+        self.assertEqual(statuses["broken.jpg"], "error")
+        self.assertEqual(statuses["again.jpg"], "duplicate")
+        self.assertEqual(response.data["created"], 6)
+        self.assertEqual(LocationImage.objects.count(), 6)
+
+    def test_too_many_files_are_rejected_before_any_insert(self, _):
+        with override_settings(LOCATION_BATCH_UPLOAD={"MAX_FILES": 2}):
+            response = self.client.post(
+                "/api/location/upload/batch/", {"images": [upload(seed) for seed in (20, 21, 22)]}, format="multipart"
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(LocationImage.objects.exists())
+
+    def test_oversized_items_are_per_item_errors(self, _):
+        small, large = jpeg(23), jpeg(24, size=(256, 256))
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as bundle:
+            bundle.writestr("small.jpg", small)
+            bundle.writestr("bomb.bin.jpg", bytes(len(large) * 100))  # Compresses to almost nothing
+        data = {
+            "images": [SimpleUploadedFile("large.jpg", large)],
+            "archive": SimpleUploadedFile("bundle.zip", archive.getvalue()),
+            "home_address": HOME_ADDRESS,
+        }
+        with override_settings(LOCATION_BATCH_UPLOAD={"MAX_ITEM_BYTES": len(small) + 1}):
+            response = self.client.post("/api/location/upload/batch/", data, format="multipart")
+
+        self.assertEqual(response.status_code, 201)
+        statuses = {item["filename"]: item["status"] for item in response.data["results"]}
+        self.assertEqual(statuses, {"large.jpg": "error", "small.jpg": "created", "bomb.bin.jpg": "error"})
+
+    def test_entry_larger_than_declared_is_an_invalid_item(self, _):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as bundle:
+            bundle.writestr("bomb.jpg", bytes(10000))
+        uploads = batch.Uploads([], io.BytesIO(archive.getvalue()), max_bytes=100)
+        uploads.entries[0].file_size = 10  # What a crafted archive would declare
+        self.assertEqual([content for _, content, _ in uploads], [b""])
+
+    def test_invalid_items_do_not_mark_later_copies_duplicate(self, _):
+        broken = jpeg(25)[:500]
+        data = {
+            "images": [SimpleUploadedFile("first.jpg", broken), upload(26), SimpleUploadedFile("second.jpg", broken)],
+            "home_address": HOME_ADDRESS,
+        }
+        with override_settings(LOCATION_BATCH_UPLOAD={"CHUNK_SIZE": 2}):
+            response = self.client.post("/api/location/upload/batch/", data, format="multipart")
+        statuses = {item["filename"]: item["status"] for item in response.data["results"]}
+        self.assertEqual(statuses, {"first.jpg": "error", "image_26.jpg": "created", "second.jpg": "error"})
+
+    def test_insert_retries_until_no_hash_collides(self, _):
+        items = []
+        for seed in (27, 28, 29):
+            item = batch.BatchItem(seed, f"{seed}.jpg", jpeg(seed), HOME_ADDRESS)
+            item.instance = LocationImage(image=ContentFile(item.content, name=item.filename), image_hash=item.image_hash)
+            items.append(item)
+        racing = [items[0].image_hash, items[1].image_hash]
+
+        @contextlib.contextmanager
+        def racing_span(name):
+            if racing:  # A concurrent upload commits one of our hashes just before each attempt
+                LocationImage.objects.create(image=f"uploads/{racing[0]}.jpg", image_hash=racing.pop(0))
+            yield
+
+        with mock.patch("location.batch.span", racing_span):
+            batch._insert(items, batch.get_batch_settings())
+        self.assertEqual([item.status for item in items], ["duplicate", "duplicate", "created"])
+        self.assertEqual(LocationImage.objects.filter(image_hash=items[2].image_hash).count(), 1)
+
+
+class DuplicateUploadTests(LocationTestCase):
+    def test_same_bytes_are_rejected(self):
+        first = self.upload(4)
+        response = self.client.post(
+            "/api/location/upload/", {"image": upload(4, "renamed.jpg"), "home_address": HOME_ADDRESS}, format="multipart"
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(LocationImage.objects.get().pk, first.pk)
+
+    def test_upload_hash_is_the_md5_of_the_bytes(self):
+        image = self.upload(5)
+        self.assertEqual(image.image_hash, hashlib.md5(jpeg(5)).hexdigest())
+        self.assertEqual(content_hash(ContentFile(b"")), None)
+
+
+class PerceptualHashTests(LocationTestCase):
+    def test_dhash_survives_resizing(self):
+        small = int(dhash(io.BytesIO(gradient((120, 90)))), 16)
+        large = int(dhash(io.BytesIO(gradient((800, 600)))), 16)
+        flipped = int(dhash(io.BytesIO(gradient((800, 600), flip=True))), 16)
+        self.assertLessEqual(hamming(small, large), 4)
+        self.assertGreater(hamming(large, flipped), 16)
+
+    def test_bk_tree_search_matches_a_linear_scan(self):
+        rng = np.random.default_rng(7)
+        keys = [int(value) for value in rng.integers(0, 2 ** 63, 500, dtype=np.int64)]
+        keys += [keys[0] ^ 1, keys[0] ^ 0b1011, keys[1]]  # Close neighbours and an exact repeat
+        tree = BKTree()
+        for value, key in enumerate(keys):
+            tree.add(key, value)
+        for query in keys[:20]:
+            found = tree.search(query, 8)
+            expected = sorted((hamming(query, key), value) for value, key in enumerate(keys) if hamming(query, key) <= 8)
+            self.assertEqual(sorted(found), expected)
+            self.assertEqual([distance for distance, _ in found], sorted(distance for distance, _ in found))
+
+    def test_index_picks_up_rows_hashed_after_the_first_refresh(self):
+        old = LocationImage.objects.create(
+            image="uploads/old.jpg", image_hash="1" * 32, landmark_name="Old", landmark_detected_at=timezone.now()
+        )
+        stamp_hash(old, "00000000000000ff")
+        old.save()
+        self.assertEqual(near_duplicates.find("00000000000000fe").pk, old.pk)
+
+        # A backfilled row keeps its old pk but gets a fresh `perceptual_hashed_at`
+        late = LocationImage.objects.create(
+            image="uploads/late.jpg", image_hash="2" * 32, landmark_name="Late", landmark_detected_at=timezone.now()
+        )
+        LocationImage.objects.filter(pk=late.pk).update(perceptual_hash="ff00000000000000", perceptual_hashed_at=timezone.now())
+        self.assertEqual(near_duplicates.find("ff00000000000001").pk, late.pk)
+        self.assertIsNone(near_duplicates.find("0f0f0f0f0f0f0f0f"))
+        self.assertEqual(near_duplicates.tree.size, 2)
+
+
+class DistanceTests(SimpleTestCase):
+    def test_vectorized_matches_scalar(self):
+        rng = np.random.default_rng(3)
+        lats, lngs = rng.uniform(-89, 89, 50), rng.uniform(-179, 179, 50)
+        expected = [haversine_km(43.7, -79.4, lat, lng) for lat, lng in zip(lats, lngs)]
+        np.testing.assert_allclose(haversine_one_to_many(43.7, -79.4, lats, lngs), expected, rtol=1e-9)
+        np.testing.assert_allclose(haversine_pairs(np.full(50, 43.7), np.full(50, -79.4), lats, lngs), expected, rtol=1e-9)
+        matrix = haversine_matrix(lats[:5], lngs[:5], lats, lngs, chunk_size=2)
+        self.assertEqual(matrix.shape, (5, 50))
+        self.assertAlmostEqual(matrix[2, 7], haversine_km(lats[2], lngs[2], lats[7], lngs[7]), places=6)
+
+    def test_known_distance(self):
+        # Toronto → Montreal is about 504 km as the crow flies
+        self.assertAlmostEqual(haversine_km(43.6532, -79.3832, 45.5017, -73.5673), 504, delta=2)
+
+
+class SpatialTests(LocationTestCase):
+    def test_geohash_reference_value(self):
+        self.assertEqual(geohash_encode(57.64911, 10.40744, 11), "u4pruydqqvj")
+
+    def create_landmark(self, name, lat, lng):
+        return LocationImage.objects.create(
+            image=f"uploads/{name}.jpg", image_hash=hashlib.md5(name.encode()).hexdigest(),
+            landmark_name=name, landmark_lat=lat, landmark_lng=lng, landmark_geohash=geohash_encode(lat, lng),
+            landmark_detected_at=timezone.now(),
+        )
+
+    def test_nearby_radius_and_k_nearest(self):
+        near = self.create_landmark("Near", 43.651, -79.381)
+        middle = self.create_landmark("Middle", 43.70, -79.40)
+        self.create_landmark("Far", 45.50, -73.57)
+
+        response = self.client.get("/api/location/nearby/", {"lat": 43.65, "lng": -79.38, "radius_km": 10})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row["id"] for row in response.data["results"]], [near.pk, middle.pk])
+
+        response = self.client.get("/api/location/nearby/", {"lat": 43.65, "lng": -79.38, "k": 1})
+        self.assertEqual([row["id"] for row in response.data["results"]], [near.pk])
+        self.assertAlmostEqual(
+            response.data["results"][0]["Distance (km)"], haversine_km(43.65, -79.38, 43.651, -79.381), places=2
+        )
+
+        later = self.create_landmark("Later", 43.6501, -79.3801)  # Served from the delta until the next rebuild
+        response = self.client.get("/api/location/nearby/", {"lat": 43.65, "lng": -79.38, "k": 2})
+        self.assertEqual([row["id"] for row in response.data["results"]], [later.pk, near.pk])
+
+    def test_landmarks_stored_after_insert_are_found(self):
+        self.create_landmark("Far", 45.50, -73.57)
+        self.assertEqual(spatial.landmark_index.nearest(43.65, -79.38, 1, radius_km=10), [])
+
+        enriched = LocationImage.objects.create(image="uploads/enriched.jpg", image_hash="enriched")
+        LocationImage.objects.filter(pk=enriched.pk).update(
+            landmark_lat=43.651, landmark_lng=-79.381, landmark_detected_at=timezone.now()
+        )
+        self.assertEqual([pk for pk, _ in spatial.landmark_index.nearest(43.65, -79.38, 1, radius_km=10)], [enriched.pk])
+
+        LocationImage.objects.filter(pk=enriched.pk).update(  # Landmark cleared by a re-detection
+            landmark_lat=None, landmark_lng=None, landmark_detected_at=timezone.now()
+        )
+        self.assertEqual(spatial.landmark_index.nearest(43.65, -79.38, 1, radius_km=10), [])
+
+    def test_invalid_parameters(self):
+        response = self.client.get("/api/location/nearby/", {"lat": 43.65, "lng": -79.38, "k": 0})
+        self.assertEqual(response.status_code, 400)
+
+
+class ListPaginationTests(LocationTestCase):
+    def setUp(self):
+        super().setUp()
+        LocationImage.objects.bulk_create(
+            LocationImage(image=f"uploads/{i}.jpg", image_hash=f"{i:032x}") for i in range(7)
+        )
+        same_time = timezone.now()
+        LocationImage.objects.update(uploaded_at=same_time)  # Ties are broken by id
+
+    def test_cursor_pages_cover_every_row_once(self):
+        seen = []
+        url = "/api/location/images/?page_size=3"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [row["id"] for row in response.data["results"]]
+            url = response.data["next"]
+            if url:
+                self.assertIn(url, response["Link"])
+                LocationImage.objects.create(image="uploads/new.jpg", image_hash=f"new{len(seen):029d}")
+        original = list(LocationImage.objects.filter(image_hash__regex=r"^[0-9a-f]{32}$").order_by("id").values_list("id", flat=True))
+        self.assertEqual(seen[:7], original)
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_unchanged_page_revalidates_with_304(self):
+        first = self.client.get("/api/location/images/")
+        etag = first["ETag"]
+        self.assertEqual(self.client.get("/api/location/images/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        LocationImage.objects.filter(pk=first.data["results"][0]["id"]).update(landmark_name="Changed")
+        self.assertEqual(self.client.get("/api/location/images/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get("/api/location/images/", {"cursor": "not-a-cursor"}).status_code, 404)
+        self.assertIsNone(KeysetPagination().decode_cursor(mock.Mock(query_params={})))
+
+
+class ExportTests(LocationTestCase):
+    def setUp(self):
+        super().setUp()
+        LocationImage.objects.bulk_create(
+            LocationImage(image=f"uploads/{i}.jpg", image_hash=f"{i:032x}", landmark_name=f"Landmark {i}") for i in range(3)
+        )
+
+    def test_ndjson(self):
+        response = self.client.get("/api/location/export/")
+        self.assertEqual(response.status_code, 200)
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([row["landmark_name"] for row in rows], ["Landmark 0", "Landmark 1", "Landmark 2"])
+
+    def test_gzipped_csv(self):
+        response = self.client.get("/api/location/export/", {"type": "csv", "gzip": "true"})
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        lines = gzip.decompress(b"".join(response.streaming_content)).decode().splitlines()
+        self.assertTrue(lines[0].startswith("id,image,"))
+        self.assertEqual(len(lines), 4)
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get("/api/location/export/", {"type": "xml"}).status_code, 400)
+
+
+class PurgeTests(LocationTestCase):
+    def test_delete_all(self):
+        for seed in (30, 31):
+            self.upload(seed)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete("/api/location/images/delete-all/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["report"]["rows_deleted"], 2)
+        self.assertFalse(LocationImage.objects.exists())
+        self.assertEqual(self.client.delete("/api/location/images/delete-all/").status_code, 404)
+
+    def test_staff_cannot_delete(self):
+        staff = get_user_model().objects.create_user("staff", password="password", is_staff=True)
+        self.client.force_authenticate(staff)
+        self.assertEqual(self.client.delete("/api/location/images/delete-all/").status_code, 403)
+
+
+@override_settings(IMAGE_PREPROCESSING={"VISION_MAX_EDGE": 256, "THUMBNAIL_EDGE": 32, "DISPLAY_MAX_EDGE": 128, "FORMAT": "JPEG"})
+class PreprocessTests(SimpleTestCase):
+    def test_vision_content_downscales_large_images_only(self):
+        small = jpeg(40, (200, 100))
+        self.assertIs(vision_content(small), small)
+        with Image.open(io.BytesIO(vision_content(jpeg(41, (1000, 500))))) as img:
+            self.assertEqual(img.size, (256, 128))
+        self.assertEqual(vision_content(b"not an image"), b"not an image")
+
+    def test_derivatives(self):
+        derivatives = render_derivatives(io.BytesIO(jpeg(42, (400, 200))))
+        with Image.open(io.BytesIO(derivatives["display"])) as display:
+            self.assertEqual(display.size, (128, 64))
+        with Image.open(io.BytesIO(derivatives["thumbnail"])) as thumbnail:
+            self.assertEqual(thumbnail.size, (32, 16))
+
+
+class GazetteerProviderTests(SimpleTestCase):
+    def setUp(self):
+        self.provider = providers.GazetteerProvider({**providers.DEFAULT_SETTINGS, **TEST_PROVIDER})
+
+    def test_answers_are_deterministic(self):
+        content = jpeg(50)
+        self.assertEqual(self.provider.detect_landmark(content), self.provider.detect_landmark(content))
+        self.assertIn(self.provider.detect_landmark(content)["landmark_name"], self.provider.landmark_names)
+
+    def test_unknown_addresses_fall_inside_the_known_area(self):
+        lat, lng = self.provider.geocode("1 Nowhere Lane")
+        low, high = self.provider.bounds
+        self.assertTrue(low[0] <= lat <= high[0] and low[1] <= lng <= high[1])
+        self.assertEqual(self.provider.geocode("1 Nowhere Lane"), (lat, lng))
+
+
+class BenchmarkComparisonTests(SimpleTestCase):
+    def test_regressions_are_flagged(self):
+        baseline = {"results": [{"name": "a", "params": {}, "p95_ms": 10.0}, {"name": "b", "params": {}, "p95_ms": 10.0}]}
+        current = {"results": [{"name": "a", "params": {}, "p95_ms": 10.5}, {"name": "b", "params": {}, "p95_ms": 12.0},
+                               {"name": "c", "params": {}, "p95_ms": 1.0}]}
+        rows, regressed = compare_results(baseline, current)
+        self.assertEqual([row[0] for row in rows], ["a", "b"])
+        self.assertEqual([row[0] for row in regressed], ["b"])
+        self.assertAlmostEqual(regressed[0][4], 0.2)
+
+
+class InstrumentationTests(LocationTestCase):
+    def test_server_timing_header(self):
+        response = self.client.get("/api/location/images/")
+        self.assertIn("total;dur=", response["Server-Timing"])
+        self.assertIn("queries", response["Server-Timing"])
+
+    def test_metrics_access(self):
+        self.client.get("/api/location/images/")
+        response = self.client.get("/metrics", REMOTE_ADDR="127.0.0.1")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"location_http_requests_total", response.content)
+        self.assertEqual(self.client.get("/metrics", REMOTE_ADDR="203.0.113.7").status_code, 403)
+        with override_settings(INSTRUMENTATION={"METRICS_TOKEN": "secret"}):
+            self.assertEqual(self.client.get("/metrics", REMOTE_ADDR="127.0.0.1").status_code, 403)
+            response = self.client.get("/metrics", REMOTE_ADDR="203.0.113.7", HTTP_AUTHORIZATION="Bearer secret")
+            self.assertEqual(response.status_code, 200)
+
+
+class LoggingTests(LocationTestCase):
+    def test_request_id_is_echoed_or_generated(self):
+        response = self.client.get("/api/location/images/", HTTP_X_REQUEST_ID="abc-123")
+        self.assertEqual(response["X-Request-ID"], "abc-123")
+        response = self.client.get("/api/location/images/", HTTP_X_REQUEST_ID="bad id\n")
+        self.assertRegex(response["X-Request-ID"], r"^[0-9a-f]{32}$")
+
+    def test_json_formatter_includes_extra_fields(self):
+        record = logging.LogRecord("location", logging.INFO, __file__, 1, "Saved %s", (7,), None)
+        record.request_id = "abc"
+        record.image_id = 7
+        payload = json.loads(JsonFormatter().format(record))
+        self.assertEqual((payload["message"], payload["request_id"], payload["image_id"]), ("Saved 7", "abc", 7))
+
+    def test_queue_handler_writes_after_a_fork_restart(self):
+        stream = io.StringIO()
+        with mock.patch("location.logs.atexit.register"):
+            handler = QueueStreamHandler(stream=stream)
+        handler.listener.stop()
+        handler._restart_after_fork()  # What a forked worker runs: the parent's listener thread is gone
+        logger = logging.getLogger("location.tests.queue")
+        logger.propagate = False
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        logger.warning("hello %s", "child")
+        handler.listener.stop()  # Flushes the queue
+        self.assertEqual(json.loads(stream.getvalue())["message"], "hello child")
+
+
+class AsyncViewTests(LocationTestCase):
+    def test_async_upload_under_wsgi_closes_its_clients(self):
+        response = self.client.post(
+            "/api/location/async/upload/", {"image": upload(60), "home_address": HOME_ADDRESS}, format="multipart"
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertIsNotNone(LocationImage.objects.get(pk=response.data["id"]).landmark_name)
+        self.assertEqual(len(services._state.async_http_clients), 0)
+        self.assertEqual(len(services._state.async_vision_clients), 0)
+
+
+class ContentAddressedStorageTests(SimpleTestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp(prefix="location_storage_")
+        self.addCleanup(shutil.rmtree, self.location, ignore_errors=True)
+
+    def check_refcounting(self, storage):
+        first = storage.save("uploads/a.jpg", ContentFile(b"same bytes"))
+        second = storage.save("uploads/b.jpg", ContentFile(b"same bytes"))
+        self.assertEqual(first, second)
+        self.assertTrue(first.endswith(hashlib.md5(b"same bytes").hexdigest() + ".jpg"))
+        self.assertEqual(storage.references(first), 2)
+        storage.delete(first)
+        self.assertTrue(storage.exists(first))
+        storage.delete(first)
+        self.assertFalse(storage.exists(first))
+        self.assertEqual(storage.references(first), 0)
+        self.assertEqual(os.listdir(os.path.join(self.location, ".tmp")), [])
+
+    def test_identical_content_is_stored_once(self):
+        self.check_refcounting(ContentAddressedStorage(location=self.location))
+
+    def test_filesystem_without_hard_links(self):
+        storage = ContentAddressedStorage(location=self.location)
+        with mock.patch("os.link", side_effect=PermissionError(1, "Operation not permitted")):
+            self.check_refcounting(storage)
+        self.assertFalse(storage.hard_links)
+
+
+class TokenAuthenticationTests(LocationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=self.user)
+        self.auth = CachedTokenAuthentication()
+
+    def test_cached_token_costs_no_query(self):
+        user, _ = self.auth.authenticate_credentials(self.token.key)
+        with self.assertNumQueries(0):
+            cached_user, token = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual((cached_user.pk, cached_user.is_superuser), (user.pk, True))
+        self.assertEqual(token.key, self.token.key)
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.assertEqual(client.get("/api/location/images/").status_code, 200)
+
+    def test_deleted_token_and_deactivated_user_are_rejected(self):
+        self.auth.authenticate_credentials(self.token.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save(update_fields=["is_active"])
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+        self.user.is_active = True
+        self.user.save()
+        key = self.token.key
+        self.auth.authenticate_credentials(key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(key)
+
+    def test_process_local_cache_is_not_used_as_the_shared_tier(self):
+        self.assertIsNone(authentication.get_token_cache()._cache)
+
+
+def grid_graph(rows, cols, spacing=0.01, origin=(43.6, -79.5)):
+    """A bidirectional grid road graph with uneven travel times; returns (node_lat, node_lng, edges)."""
+    rng = np.random.default_rng(11)
+    node = lambda r, c: r * cols + c
+    lats = np.array([origin[0] + r * spacing for r in range(rows) for _ in range(cols)])
+    lngs = np.array([origin[1] + c * spacing for _ in range(rows) for c in range(cols)])
+    edges = []
+    for r in range(rows):
+        for c in range(cols):
+            for dr, dc in ((0, 1), (1, 0)):
+                if r + dr < rows and c + dc < cols:
+                    a, b = node(r, c), node(r + dr, c + dc)
+                    length = haversine_km(lats[a], lngs[a], lats[b], lngs[b]) * 1000
+                    speed = rng.uniform(8, 25)  # m/s
+                    toll = bool(rng.random() < 0.1)
+                    edges += [(a, b, length, length / speed, toll), (b, a, length, length / speed, toll)]
+    return lats, lngs, edges
+
+
+class RoutingTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.mkdtemp(prefix="location_graph_")
+        cls.lats, cls.lngs, edges = grid_graph(12, 12)
+        sources, targets, length_m, time_s, toll = map(list, zip(*edges))
+        routing.write_graph(cls.directory, cls.lats, cls.lngs, sources, targets, length_m, time_s, toll, landmarks=4)
+        cls.graph = routing.RoadGraph.load(cls.directory)
+        cls.options = {**routing.DEFAULT_SETTINGS, "GRAPH_DIR": cls.directory}
+        cls.router = routing.Router(cls.graph, cls.options)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_goal_directed_search_finds_the_shortest_time(self):
+        graph = self.graph
+        for source in (0, 17, 70):
+            expected = routing.shortest_times(graph.indptr, graph.targets, graph.time_s, source)
+            for goal in (143, 5, 100):
+                tree, settled = graph.search(source, [goal], graph.time_s, goal=goal)
+                self.assertIn(goal, settled)
+                _, duration, _ = graph.path_totals(tree, goal)
+                self.assertAlmostEqual(duration, expected[goal], delta=1e-3 * max(expected[goal], 1))
+
+    def test_one_search_serves_every_destination(self):
+        home = (self.lats[0], self.lngs[0])
+        destinations = [(self.lats[i], self.lngs[i]) for i in (143, 60, 11)]
+        many = self.router.routes_from(*home, destinations)
+        for destination, route in zip(destinations, many):
+            single = self.router.route(*home, *destination)
+            self.assertAlmostEqual(route.duration_min, single.duration_min, places=3)
+            self.assertAlmostEqual(route.distance_km, single.distance_km, places=3)
+
+    def test_points_off_the_network_have_no_route(self):
+        self.assertIsNone(self.router.route(self.lats[0], self.lngs[0], 10.0, 10.0))
+        self.assertEqual(self.router.fields(None), dict.fromkeys(routing.ROUTE_FIELDS))
+
+    def test_router_loads_from_settings(self):
+        routing._router, routing._router_loaded = None, False
+        self.addCleanup(setattr, routing, "_router_loaded", False)
+        self.addCleanup(setattr, routing, "_router", None)
+        with override_settings(LOCATION_ROUTING={"GRAPH_DIR": self.directory}):
+            router = routing.get_router()
+        self.assertEqual(router.graph.node_count, len(self.lats))
+
+
+@override_settings(RESPONSE_CACHE={"ENABLED": True, "ALLOW_PROCESS_LOCAL": True})
+class ResponseCacheTests(LocationTestCase):
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.image = LocationImage.objects.create(image="uploads/a.jpg", image_hash="a" * 32, landmark_name="Before")
+
+    def test_hits_cost_no_query_until_the_image_changes(self):
+        url = f"/api/location/images/{self.image.pk}/"
+        first = self.client.get(url)
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"]).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.image.landmark_name = "After"
+            self.image.save()
+        self.assertEqual(json.loads(self.client.get(url).content)["Landmark"], "After")
+
+    def test_list_pages_follow_updates_that_bypass_signals(self):
+        self.assertEqual(json.loads(self.client.get("/api/location/images/").content)["results"][0]["Landmark"], "Before")
+        with self.captureOnCommitCallbacks(execute=True):
+            LocationImage.objects.filter(pk=self.image.pk).update(landmark_name="After")
+            response_cache.invalidate_images([self.image.pk])
+        self.assertEqual(json.loads(self.client.get("/api/location/images/").content)["results"][0]["Landmark"], "After")
+
+    def test_process_local_cache_is_refused_by_default(self):
+        response_cache._response_cache = None
+        with override_settings(RESPONSE_CACHE={"ENABLED": True}):
+            self.assertIsNone(response_cache.get_response_cache())
+
+
+class StartupTests(SimpleTestCase):
+    def test_import_report(self):
+        report = ImportReport([("django", 1000, 5000, 0), ("django.db", 4000, 4000, 1), ("numpy", 2000, 2000, 0)], 12.0)
+        self.assertTrue(report.loaded("django"))
+        self.assertFalse(report.loaded("grpc"))
+        self.assertEqual(report.by_package(), [("django", 5.0), ("numpy", 2.0)])
+        self.assertEqual(report.slowest(), [("django", 5.0), ("numpy", 2.0)])
+        self.assertEqual(report.total_ms, 7.0)
+
+    def test_vision_client_is_imported_on_first_use(self):
+        self.assertFalse(any(name.startswith("google.cloud.vision") for name in vars(services)))
+
+    def test_numpy_is_imported_on_first_use(self):
+        for module in (distance, providers, routing, spatial):
+            self.assertNotIn("np", vars(module), module.__name__)
+        self.assertTrue(math.isfinite(services.backoff_delay(3, 0.2, 2.0)))
@@ -0,0 +1,67 @@
+"""
+Single-pass upload ingestion.
+
+The hashing upload handlers compute the MD5 `image_hash` while the multipart body
+is being received and attach it to the resulting file as `content_hash`. Validation,
+duplicate detection and landmark detection then reuse the received buffer instead
+of re-reading the file several times.
+"""
+import hashlib
+from io import BytesIO
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class HashingUploadHandlerMixin:
+    """Feed every received chunk into an MD5 hasher and expose the digest on the finished file."""
+
+    def new_file(self, *args, **kwargs):
+        self.hasher = hashlib.md5()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        # An inactive memory handler only passes chunks on to the next handler, which hashes them
+        if getattr(self, 'activated', True):
+            self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        if uploaded is not None:
+            uploaded.content_hash = self.hasher.hexdigest()
+        return uploaded
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
+
+
+class HashingUploadMixin:
+    """View mixin: parse multipart bodies with the hashing upload handlers."""
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [
+            HashingMemoryFileUploadHandler(request),
+            HashingTemporaryFileUploadHandler(request),
+        ]
+        return super().initialize_request(request, *args, **kwargs)
+
+
+def content_hash(file):
+    """MD5 recorded by the hashing upload handlers, or None for files that did not come through them."""
+    return getattr(file, 'content_hash', None)
+
+
+def read_content(file):
+    """
+    Return the file's bytes, without copying when it is an in-memory upload
+    (a memoryview over the upload buffer); other files are read once from the start.
+    """
+    buffer = getattr(file, 'file', None)
+    if isinstance(buffer, BytesIO):
+        return buffer.getbuffer()
+    file.seek(0)
+    return file.read()
@@ -1,46 +1,256 @@
 
 
 
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from rest_framework import status, generics
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from .permissions import CustomAdminPermission
 from .models import LocationImage
 from .serializers import LocationImageSerializer
+from .landmark_cache import get_landmark_cache
+from .jobs import enqueue, get_ingestion_settings
+from .batch import ingest_batch, read_uploads
+from .uploads import HashingUploadMixin
+from .geocoding import get_coordinates
+from .spatial import landmark_index, landmarks_within
+from .pagination import KeysetPagination, LIST_FIELDS, page_etag
+from .export import FORMATS, stream_export
+from .purge import last_report, purge_all
+from .response_cache import CachedResponseMixin, detail_keys, list_keys
+from .services import aclose_loop_clients
+import asyncio
 import logging
+from functools import partial
+import zipfile
 
 logger = logging.getLogger(__name__)
 
+class AsyncIngestionMixin:
+    """
+    `?async=true` (or LOCATION_INGESTION["ASYNC"]) stores the upload as pending, queues
+    enrichment and answers 202 with a status URL instead of blocking on geocoding/Vision.
+    """
+
+    def use_async_ingestion(self):
+        value = self.request.query_params.get('async')
+        if value is None:
+            return get_ingestion_settings()["ASYNC"]
+        return value.lower() in ('1', 'true', 'yes')
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.request.method == 'POST' and self.use_async_ingestion():
+            context['defer_enrichment'] = True
+        return context
+
+    def create(self, request, *args, **kwargs):
+        if not self.use_async_ingestion():
+            return super().create(request, *args, **kwargs)
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            instance = serializer.save()
+            enqueue(instance, instance.home_address)
+
+        return Response(
+            {
+                "id": instance.id,
+                "status": instance.status,
+                "status_url": reverse('image-status', kwargs={'pk': instance.id}),
+            },
+            status=status.HTTP_202_ACCEPTED
+        )
+
+class AsyncDispatchMixin:
+    """
+    Native async dispatch for DRF views whose handlers are coroutines (served under ASGI).
+    Authentication, permission checks and throttling use the ORM, so `initial()` runs on the
+    request's sync thread; handlers run on the event loop and hop to sync code themselves.
+    Under WSGI (or `runserver`) Django runs each call on a throwaway event loop, so the
+    loop's pooled clients are closed with the response.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        served_by_asgi = isinstance(request, ASGIRequest)
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        finally:
+            if not served_by_asgi:
+                await aclose_loop_clients()
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
 # ✅ Insert Only (Create API)
-class LocationImageUploadView(generics.CreateAPIView):
+class LocationImageUploadView(HashingUploadMixin, AsyncIngestionMixin, generics.CreateAPIView):
     queryset = LocationImage.objects.all()
     serializer_class = LocationImageSerializer
     parser_classes = (MultiPartParser, FormParser)
     permission_classes = [IsAuthenticated, CustomAdminPermission]
 
+# ✅ Batch Insert (many images, one request)
+class LocationImageBatchUploadView(HashingUploadMixin, APIView):
+    """
+    multipart fields: `images` (repeatable) and/or `archive` (a .zip of images),
+    plus `home_address` (whole batch) or repeated `home_address` values (one per image).
+    """
+    parser_classes = (MultiPartParser, FormParser)
+    permission_classes = [IsAuthenticated, CustomAdminPermission]
+
+    def post(self, request, *args, **kwargs):
+        files = request.FILES.getlist('images')
+        archive = request.FILES.get('archive')
+        if not files and archive is None:
+            return Response(
+                {"images": "Provide one or more `images` files or a zip `archive`."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        home_addresses = [address.strip() for address in request.data.getlist('home_address') if address.strip()]
+        try:
+            results = ingest_batch(read_uploads(files, archive), home_addresses)
+        except (ValueError, zipfile.BadZipFile) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        summary = {key: sum(item["status"] == key for item in results) for key in ("created", "duplicate", "error")}
+        return Response(
+            {**summary, "results": results},
+            status=status.HTTP_201_CREATED if summary["created"] else status.HTTP_200_OK
+        )
+
 # ✅ Insert + List
-class LocationImageListCreateView(generics.ListCreateAPIView):
+class LocationImageListCreateView(HashingUploadMixin, AsyncIngestionMixin, CachedResponseMixin, generics.ListCreateAPIView):
+    queryset = LocationImage.objects.all()
+    serializer_class = LocationImageSerializer
+    parser_classes = (MultiPartParser, FormParser)
+    permission_classes = [IsAuthenticated, CustomAdminPermission]
+    pagination_class = KeysetPagination
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.request.method == 'GET':
+            context['thumbnails'] = True  # Lists link thumbnails, not full-size originals
+        return context
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method == 'GET':
+            # Only the columns the list representation reads
+            queryset = queryset.only(*LIST_FIELDS)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        # ✅ Pages are cached by cursor and page size until an image changes
+        return self.cached_response(request, lambda cache: list_keys(cache, request), partial(self.list_page, request))
+
+    def list_page(self, request):
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        etag = page_etag(page, self.paginator.has_next)
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        serializer = self.get_serializer(page, many=True)
+        response = self.get_paginated_response(serializer.data)
+        response['ETag'] = etag
+        return response
+
+# ✅ Insert Only, Async (ASGI): geocoding and Vision run concurrently
+class LocationImageAsyncUploadView(HashingUploadMixin, AsyncIngestionMixin, AsyncDispatchMixin, generics.GenericAPIView):
     queryset = LocationImage.objects.all()
     serializer_class = LocationImageSerializer
     parser_classes = (MultiPartParser, FormParser)
     permission_classes = [IsAuthenticated, CustomAdminPermission]
 
+    def validated_serializer(self, request):
+        serializer = self.get_serializer(data=request.data)  # Parses (and hashes) the multipart body
+        serializer.is_valid(raise_exception=True)
+        return serializer
+
+    async def post(self, request, *args, **kwargs):
+        if self.use_async_ingestion():
+            # Deferred enrichment only stores the upload and queues a job: nothing to overlap
+            return await sync_to_async(self.create)(request, *args, **kwargs)
+
+        serializer = await sync_to_async(self.validated_serializer)(request)
+        serializer.instance = await serializer.acreate(serializer.validated_data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
 # ✅ Retrieve (Allow Viewing Details)
-class LocationImageDetailView(generics.RetrieveAPIView):
+class LocationImageDetailView(CachedResponseMixin, generics.RetrieveAPIView):
     queryset = LocationImage.objects.all()
     serializer_class = LocationImageSerializer
     lookup_field = 'pk'
     permission_classes = [IsAuthenticated, CustomAdminPermission]
 
+    def retrieve(self, request, *args, **kwargs):
+        # ✅ Served from the response cache until this image changes
+        pk = kwargs[self.lookup_field]
+        return self.cached_response(request, lambda cache: detail_keys(cache, pk), partial(super().retrieve, request, *args, **kwargs))
+
+# ✅ Enrichment Status (Poll after an async upload)
+class LocationImageStatusView(APIView):
+    permission_classes = [IsAuthenticated, CustomAdminPermission]
+
+    def get(self, request, pk, *args, **kwargs):
+        image = get_object_or_404(LocationImage.objects.select_related('enrichment_job'), pk=pk)
+        job = getattr(image, 'enrichment_job', None)
+        return Response({
+            "id": image.id,
+            "status": image.status,
+            "attempts": job.attempts if job else 0,
+            "error": job.last_error if job and job.last_error else None,
+        }, status=status.HTTP_200_OK)
+
 # ✅ Update (Admin Only)
-class LocationImageUpdateView(generics.UpdateAPIView):
+class LocationImageUpdateView(HashingUploadMixin, generics.UpdateAPIView):
+    queryset = LocationImage.objects.all()
+    serializer_class = LocationImageSerializer
+    lookup_field = 'pk'
+    permission_classes = [IsAuthenticated, CustomAdminPermission]
+
+# ✅ Update, Async (ASGI): a new address and a new image are resolved concurrently
+class LocationImageAsyncUpdateView(HashingUploadMixin, AsyncDispatchMixin, generics.GenericAPIView):
     queryset = LocationImage.objects.all()
     serializer_class = LocationImageSerializer
     lookup_field = 'pk'
     permission_classes = [IsAuthenticated, CustomAdminPermission]
 
+    def validated_serializer(self, request, partial):
+        serializer = self.get_serializer(self.get_object(), data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        return serializer
+
+    async def put(self, request, *args, partial=False, **kwargs):
+        serializer = await sync_to_async(self.validated_serializer)(request, partial)
+        serializer.instance = await serializer.aupdate(serializer.instance, serializer.validated_data)
+        return Response(serializer.data)
+
+    async def patch(self, request, *args, **kwargs):
+        return await self.put(request, *args, partial=True, **kwargs)
+
 # ✅ DELETE (SuperAdmin Only)
 class LocationImageDeleteView(generics.DestroyAPIView):
     queryset = LocationImage.objects.all()
@@ -50,24 +260,117 @@ class LocationImageDeleteView(generics.DestroyAPIView):
 
 # ✅ Bulk Delete (SuperAdmin Only)
 class DeleteAllLocationImagesView(APIView):
-    # queryset = LocationImage.objects.all()
-    # serializer_class = LocationImageSerializer
-    # permission_classes = [IsAuthenticated, CustomAdminPermission]
+    """
+    DELETE purges every image in bounded primary-key batches (`?truncate=true` uses
+    TRUNCATE when LOCATION_PURGE allows it) and returns a report; uploaded files are
+    removed in the background. GET returns the latest report from this worker.
+    """
     permission_classes = [IsAuthenticated, CustomAdminPermission]
-    
-    def delete(self, request, *args, **kwargs):
-        total_images = LocationImage.objects.count()
 
-        if total_images == 0:
+    def get(self, request, *args, **kwargs):
+        report = last_report()
+        if report is None:
+            return Response({"message": "No purge has run in this worker."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(report.as_dict(), status=status.HTTP_200_OK)
+
+    def delete(self, request, *args, **kwargs):
+        if not LocationImage.objects.exists():
             return Response(
                 {"message": "No images found to delete."},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        # Bulk delete
-        LocationImage.objects.all().delete()
+        truncate = request.query_params.get('truncate', '').lower() in ('1', 'true', 'yes')
+        report = purge_all(truncate=truncate)
 
         return Response(
-            {"message": f"✅ Successfully deleted {total_images} images."},
+            {"message": f"✅ Successfully deleted {report.rows_deleted} images.", "report": report.as_dict()},
             status=status.HTTP_200_OK
         )
+
+# ✅ Nearby Landmarks (radius and/or k-nearest query)
+class NearbyLandmarksView(APIView):
+    """
+    GET ?address=... (or ?lat=&lng=) with `radius_km` and/or `k`.
+    Radius-only queries are pre-filtered by the indexed geohash column; k-nearest
+    queries use the in-memory KD-tree.
+    """
+    permission_classes = [IsAuthenticated, CustomAdminPermission]
+    DEFAULT_K = 10
+    MAX_K = 500
+
+    def get(self, request, *args, **kwargs):
+        params = request.query_params
+        try:
+            radius_km = float(params['radius_km']) if params.get('radius_km') else None
+            k = int(params['k']) if params.get('k') else None
+            if radius_km is not None and radius_km <= 0 or k is not None and not 0 < k <= self.MAX_K:
+                raise ValueError
+        except ValueError:
+            return Response(
+                {"error": f"`radius_km` must be a positive number and `k` an integer between 1 and {self.MAX_K}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if params.get('address'):
+            lat, lng = get_coordinates(params['address'])
+            if lat is None or lng is None:
+                return Response({"address": "Invalid address. Could not fetch coordinates."}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            try:
+                lat, lng = float(params['lat']), float(params['lng'])
+            except (KeyError, ValueError):
+                return Response({"error": "Provide `address` or numeric `lat` and `lng`."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if k is None and radius_km is not None:
+            matches = landmarks_within(lat, lng, radius_km)
+        else:
+            matches = landmark_index.nearest(lat, lng, k or self.DEFAULT_K, radius_km)
+
+        rows = LocationImage.objects.only('id', 'landmark_name', 'landmark_lat', 'landmark_lng').in_bulk([pk for pk, _ in matches])
+        results = [
+            {
+                "id": pk,
+                "Landmark": rows[pk].landmark_name,
+                "Coordinates": f"{rows[pk].landmark_lat}, {rows[pk].landmark_lng}",
+                "Distance (km)": round(distance, 2),
+            }
+            for pk, distance in matches if pk in rows  # Skip rows deleted since the index was built
+        ]
+        return Response({
+            "origin": {"latitude": lat, "longitude": lng},
+            "count": len(results),
+            "results": results,
+        }, status=status.HTTP_200_OK)
+
+# ✅ Export All Records (Streamed NDJSON/CSV)
+class LocationImageExportView(APIView):
+    """
+    GET ?type=ndjson|csv (default ndjson), optionally &gzip=true. Stored columns only,
+    streamed through a server-side cursor.
+    """
+    permission_classes = [IsAuthenticated, CustomAdminPermission]
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.query_params.get('type', 'ndjson').lower()
+        if export_format not in FORMATS:
+            return Response({"error": f"`type` must be one of: {', '.join(FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        compress = request.query_params.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+        content_type, extension = FORMATS[export_format]
+        filename = f"location_images.{extension}"
+        if compress:
+            content_type, filename = "application/gzip", filename + ".gz"
+
+        response = StreamingHttpResponse(stream_export(export_format, compress=compress), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        logger.info("📤 Streaming %s export%s", export_format, " (gzip)" if compress else "")
+        return response
+
+# ✅ Landmark Cache Counters (Admin Only)
+class LandmarkCacheStatsView(APIView):
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        # Counters are per worker process; entries/max_entries describe the backend itself
+        return Response(get_landmark_cache().stats(), status=status.HTTP_200_OK)
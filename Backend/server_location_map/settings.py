@@ -45,7 +45,7 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'location.authentication.CachedTokenAuthentication',  # TokenAuthentication without a query per request
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -53,6 +53,8 @@ REST_FRAMEWORK = {
 }
 
 MIDDLEWARE = [
+    'location.logs.RequestIdMiddleware',  # Correlation id for every log line of the request
+    'location.instrumentation.InstrumentationMiddleware',  # Early, so its timings cover the whole stack
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -111,8 +113,172 @@ DATABASES = {
     'default': dj_database_url.parse(DATABASE_URL, conn_max_age=600, ssl_require=True)
 }
 
+# Cache shared by every worker (token auth, rendered responses). Without REDIS_URL each process
+# gets its own LocMemCache, and the caches that need cross-worker invalidation stay per-process
+# (see `location.lru.is_process_local`)
+REDIS_URL = os.getenv("REDIS_URL")
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL} if REDIS_URL
+    else {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+}
+
 APPEND_SLASH = False
 
+# Landmark results cached by image_hash; BACKEND is one of
+# location.landmark_cache.{LocMemLandmarkCache, DjangoLandmarkCache, DatabaseLandmarkCache}
+LANDMARK_CACHE = {
+    "BACKEND": os.getenv("LANDMARK_CACHE_BACKEND", "location.landmark_cache.LocMemLandmarkCache"),
+    "TTL": int(os.getenv("LANDMARK_CACHE_TTL", 60 * 60 * 24 * 30)),
+    "NEGATIVE_TTL": int(os.getenv("LANDMARK_CACHE_NEGATIVE_TTL", 60 * 60 * 24)),
+    "MAX_ENTRIES": int(os.getenv("LANDMARK_CACHE_MAX_ENTRIES", 10000)),
+    "CULL_EVERY": int(os.getenv("LANDMARK_CACHE_CULL_EVERY", 100)),
+}
+
+# Geocoded addresses: in-memory LRU in front of the GeocodedAddress table
+GEOCODING_CACHE = {
+    "TTL": int(os.getenv("GEOCODING_CACHE_TTL", 60 * 60 * 24 * 90)),
+    "MAX_ENTRIES": int(os.getenv("GEOCODING_CACHE_MAX_ENTRIES", 4096)),
+}
+
+# Pooled Geocoding/Vision clients (see location/services.py for all keys)
+EXTERNAL_SERVICES = {
+    "GEOCODING_URL": os.getenv("GEOCODING_URL", "https://maps.googleapis.com/maps/api/geocode/json"),
+    "VISION_API_ENDPOINT": os.getenv("VISION_API_ENDPOINT"),
+    "CONNECT_TIMEOUT": float(os.getenv("EXTERNAL_CONNECT_TIMEOUT", 3.05)),
+    "READ_TIMEOUT": float(os.getenv("EXTERNAL_READ_TIMEOUT", 10)),
+    "VISION_TIMEOUT": float(os.getenv("VISION_TIMEOUT", 15)),
+    "MAX_RETRIES": int(os.getenv("EXTERNAL_MAX_RETRIES", 2)),
+    # Per-call deadlines of the ASGI upload/update views, which run geocoding and Vision concurrently
+    "ASYNC_GEOCODE_DEADLINE": float(os.getenv("ASYNC_GEOCODE_DEADLINE", 15)),
+    "ASYNC_VISION_DEADLINE": float(os.getenv("ASYNC_VISION_DEADLINE", 30)),
+}
+
+# Async uploads (`?async=true`): enrichment jobs are queued in the database and processed by
+# `python manage.py run_enrichment_worker`, or in-process when RUN_IN_PROCESS is True
+LOCATION_INGESTION = {
+    "ASYNC": os.getenv("LOCATION_ASYNC_INGESTION", "False") == "True",
+    "CONCURRENCY": int(os.getenv("LOCATION_ENRICHMENT_CONCURRENCY", 4)),
+    "MAX_ATTEMPTS": int(os.getenv("LOCATION_ENRICHMENT_MAX_ATTEMPTS", 3)),
+    "RUN_IN_PROCESS": os.getenv("LOCATION_ENRICHMENT_IN_PROCESS", "False") == "True",
+}
+
+# Bulk uploads via /api/location/upload/batch/
+LOCATION_BATCH_UPLOAD = {
+    "MAX_FILES": int(os.getenv("LOCATION_BATCH_MAX_FILES", 1000)),
+    "CHUNK_SIZE": int(os.getenv("LOCATION_BATCH_CHUNK_SIZE", 100)),
+    "MAX_ITEM_BYTES": int(os.getenv("LOCATION_BATCH_MAX_ITEM_BYTES", 20 * 1024 * 1024)),
+    "CONCURRENCY": int(os.getenv("LOCATION_BATCH_CONCURRENCY", 4)),
+}
+# Room for a full batch of `images` plus the `archive` field
+DATA_UPLOAD_MAX_NUMBER_FILES = LOCATION_BATCH_UPLOAD["MAX_FILES"] + 1
+
+# Near-duplicate uploads (re-encoded/resized copies) reuse an existing row's landmark result
+PERCEPTUAL_HASH = {
+    "ENABLED": os.getenv("PERCEPTUAL_HASH_ENABLED", "True") == "True",
+    "MAX_DISTANCE": int(os.getenv("PERCEPTUAL_HASH_MAX_DISTANCE", 6)),
+    "REFRESH_OVERLAP": int(os.getenv("PERCEPTUAL_HASH_REFRESH_OVERLAP", 60)),
+}
+
+# In-memory KD-tree behind /api/location/nearby/ (see location/spatial.py for all keys)
+SPATIAL_INDEX = {
+    "REBUILD_INTERVAL": int(os.getenv("SPATIAL_INDEX_REBUILD_INTERVAL", 300)),
+    "REFRESH_OVERLAP": int(os.getenv("SPATIAL_INDEX_REFRESH_OVERLAP", 60)),
+}
+
+# Keyset pagination of /api/location/images/ (see location/pagination.py)
+LOCATION_LIST = {
+    "PAGE_SIZE": int(os.getenv("LOCATION_LIST_PAGE_SIZE", 50)),
+    "MAX_PAGE_SIZE": int(os.getenv("LOCATION_LIST_MAX_PAGE_SIZE", 500)),
+}
+
+# Streamed NDJSON/CSV exports via /api/location/export/ and `manage.py export_locations`
+LOCATION_EXPORT = {
+    "CHUNK_SIZE": int(os.getenv("LOCATION_EXPORT_CHUNK_SIZE", 2000)),
+}
+
+# DELETE /api/location/images/delete-all/ (see location/purge.py)
+LOCATION_PURGE = {
+    "BATCH_SIZE": int(os.getenv("LOCATION_PURGE_BATCH_SIZE", 5000)),
+    "ALLOW_TRUNCATE": os.getenv("LOCATION_PURGE_ALLOW_TRUNCATE", "False") == "True",
+}
+
+# Vision payload downscaling and stored display/thumbnail derivatives (see location/preprocess.py)
+IMAGE_PREPROCESSING = {
+    "ENABLED": os.getenv("IMAGE_PREPROCESSING_ENABLED", "True") == "True",
+    "VISION_MAX_EDGE": int(os.getenv("VISION_MAX_EDGE", 1024)),
+    "THUMBNAIL_EDGE": int(os.getenv("THUMBNAIL_EDGE", 256)),
+    "FORMAT": os.getenv("IMAGE_DERIVATIVE_FORMAT", "WEBP"),
+}
+
+# Geocoding/landmark provider. "location.providers.GazetteerProvider" answers offline from a local
+# gazetteer with artificial latency/errors, for load tests (see location/providers.py for all keys)
+LOCATION_PROVIDER = {
+    "BACKEND": os.getenv("LOCATION_PROVIDER_BACKEND", "location.providers.GoogleProvider"),
+    "GAZETTEER_PATH": os.getenv("GAZETTEER_PATH") or None,
+    "LATENCY_MS": float(os.getenv("GAZETTEER_LATENCY_MS", 0)),
+    "LATENCY_JITTER_MS": float(os.getenv("GAZETTEER_LATENCY_JITTER_MS", 0)),
+    "ERROR_RATE": float(os.getenv("GAZETTEER_ERROR_RATE", 0)),
+}
+
+# Per-request timings: Server-Timing header, Prometheus /metrics and sampled cProfile dumps
+# of slow requests (see location/instrumentation.py for all keys)
+INSTRUMENTATION = {
+    "ENABLED": os.getenv("INSTRUMENTATION_ENABLED", "True") == "True",
+    "METRICS_TOKEN": os.getenv("METRICS_TOKEN") or None,
+    # Without METRICS_TOKEN, /metrics answers these networks only (comma-separated CIDRs)
+    "METRICS_ALLOWED_NETWORKS": os.getenv("METRICS_ALLOWED_NETWORKS", "127.0.0.0/8,::1/128").split(","),
+    "PROFILE_SAMPLE_RATE": float(os.getenv("PROFILE_SAMPLE_RATE", 0)),
+    "PROFILE_THRESHOLD_MS": float(os.getenv("PROFILE_THRESHOLD_MS", 1000)),
+    "PROFILE_DIR": os.getenv("PROFILE_DIR", "/tmp/location-profiles"),
+}
+
+# Uploaded media is content-addressed: uploads/ab/cd/<md5>.<ext>, stored once and reference-counted
+# (see location/storage.py; move older files with `python manage.py migrate_media_storage`)
+STORAGES = {
+    "default": {"BACKEND": "location.storage.ContentAddressedStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+LOCATION_STORAGE = {
+    "FSYNC": os.getenv("MEDIA_FSYNC", "True") == "True",
+    # False on mounts without hard links (Azure Files/SMB); otherwise detected on the first failed link
+    "HARD_LINKS": os.getenv("MEDIA_HARD_LINKS", "True") == "True",
+    "MIGRATION_WORKERS": int(os.getenv("MEDIA_MIGRATION_WORKERS", 8)),
+}
+
+# Cached token authentication (see location/authentication.py); entries are invalidated by signals,
+# and a revoked token or demoted user is still accepted by other workers for up to TTL seconds
+TOKEN_AUTH_CACHE = {
+    "ENABLED": os.getenv("TOKEN_AUTH_CACHE_ENABLED", "True") == "True",
+    "TTL": int(os.getenv("TOKEN_AUTH_CACHE_TTL", 30)),
+    "SHARED_TTL": int(os.getenv("TOKEN_AUTH_CACHE_SHARED_TTL", 300)),
+    "CACHE_ALIAS": os.getenv("TOKEN_AUTH_CACHE_ALIAS", "default"),
+}
+
+# Offline road routing next to the haversine distance (see location/routing.py). Build the graph
+# from an OSM extract with `python manage.py build_road_graph`; routing is off without GRAPH_DIR
+LOCATION_ROUTING = {
+    "GRAPH_DIR": os.getenv("ROAD_GRAPH_DIR") or None,
+    "OPTIMIZE": os.getenv("ROUTING_OPTIMIZE", "time"),
+    "FUEL_COST_PER_KM": float(os.getenv("ROUTING_FUEL_COST_PER_KM", 0.12)),
+    "TOLL_COST_PER_KM": float(os.getenv("ROUTING_TOLL_COST_PER_KM", 0.25)),
+    "MAX_SNAP_KM": float(os.getenv("ROUTING_MAX_SNAP_KM", 2)),
+}
+
+# Rendered JSON of the image detail/list endpoints, invalidated when images change (see
+# location/response_cache.py). Needs a shared CACHE_ALIAS (REDIS_URL): on LocMem it stays off
+RESPONSE_CACHE = {
+    "ENABLED": os.getenv("RESPONSE_CACHE_ENABLED", "True" if REDIS_URL else "False") == "True",
+    "TTL": int(os.getenv("RESPONSE_CACHE_TTL", 300)),
+    "CACHE_ALIAS": os.getenv("RESPONSE_CACHE_ALIAS", "default"),
+}
+
+# Startup import-time budget (`manage.py report_import_time --check`)
+IMPORT_TIME = {
+    "BUDGET_MS": int(os.getenv("IMPORT_TIME_BUDGET_MS", 1500)),
+    "RUNS": int(os.getenv("IMPORT_TIME_RUNS", 3)),
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -149,12 +315,30 @@ USE_TZ = True
 
 
 
+# JSON lines (LOG_FORMAT=text for plain lines) written by a background thread, with a
+# per-request correlation id and sampling of high-volume events (see location/logs.py)
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
+    "formatters": {
+        "json": {"()": "location.logs.JsonFormatter"},
+        "text": {"format": "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"},
+    },
+    "filters": {
+        "context": {"()": "location.logs.ContextFilter"},
+        "sampling": {
+            "()": "location.logs.SamplingFilter",
+            "rates": {
+                "image_hashed": float(os.getenv("LOG_SAMPLE_IMAGE_HASHED", 0.01)),
+                "landmark_reused": float(os.getenv("LOG_SAMPLE_LANDMARK_REUSED", 0.1)),
+            },
+        },
+    },
     "handlers": {
         "console": {
-            "class": "logging.StreamHandler",
+            "class": "location.logs.QueueStreamHandler",
+            "formatter": os.getenv("LOG_FORMAT", "json"),
+            "filters": ["context", "sampling"],
         },
     },
     "root": {
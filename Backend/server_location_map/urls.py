@@ -2,13 +2,20 @@
 from django.contrib import admin
 from django.urls import path
 from location.views import LocationImageUploadView
+from location.instrumentation import metrics_view
 from location.views import (
     LocationImageListCreateView,
     LocationImageDetailView,
     LocationImageUpdateView,
     LocationImageDeleteView,
-    DeleteAllLocationImagesView
-    
+    DeleteAllLocationImagesView,
+    LandmarkCacheStatsView,
+    LocationImageStatusView,
+    LocationImageBatchUploadView,
+    NearbyLandmarksView,
+    LocationImageExportView,
+    LocationImageAsyncUploadView,
+    LocationImageAsyncUpdateView,
 )
 
 urlpatterns = [
@@ -16,10 +23,23 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     # Image Management URLs
     path('api/location/upload/', LocationImageUploadView.as_view(), name='image-upload'),
+    path('api/location/upload/batch/', LocationImageBatchUploadView.as_view(), name='image-batch-upload'),
     path('api/location/images/', LocationImageListCreateView.as_view(), name='image-list'),
     path('api/location/images/<int:pk>/', LocationImageDetailView.as_view(), name='image-detail'),
+    path('api/location/images/<int:pk>/status/', LocationImageStatusView.as_view(), name='image-status'),
     path('api/location/images/<int:pk>/edit/', LocationImageUpdateView.as_view(), name='image-edit'),
+    # Async (ASGI) Urls: geocoding and Vision calls run concurrently
+    path('api/location/async/upload/', LocationImageAsyncUploadView.as_view(), name='image-upload-async'),
+    path('api/location/async/images/<int:pk>/edit/', LocationImageAsyncUpdateView.as_view(), name='image-edit-async'),
     # Delete Urls
     path('api/location/images/<int:pk>/delete/', LocationImageDeleteView.as_view(), name='image-delete'),
      path('api/location/images/delete-all/', DeleteAllLocationImagesView.as_view(), name='delete-all-images'),
+    # Export Urls
+    path('api/location/export/', LocationImageExportView.as_view(), name='image-export'),
+    # Spatial Urls
+    path('api/location/nearby/', NearbyLandmarksView.as_view(), name='nearby-landmarks'),
+    # Metrics Urls
+    path('metrics', metrics_view, name='metrics'),
+    # Cache Urls
+    path('api/location/cache/landmarks/', LandmarkCacheStatsView.as_view(), name='landmark-cache-stats'),
 ]
\ No newline at end of file